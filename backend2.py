@@ -3,24 +3,34 @@ Backend Server for CutieChatter - FIXED VERSION
 Menghubungkan frontend HTML dengan backend DeepSeek-R1
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 import asyncio
 import json
 import time
 import uvicorn
-import ollama
-from threading import Thread, Event
-import queue
 import logging
 import sys
 import os
 import multiprocessing
-import re
 from contextlib import asynccontextmanager
+from ollama_client import get_client, get_async_client, get_registry, is_connection_error, start_host_pool
+from prompts import SYSTEM_PROMPT
+from generation_scheduler import GenerationScheduler, QueueFullError
+from state_store import create_state, STATE_BACKEND
+from prefix_cache import prefix_cache, PREFIX_CACHE_ENABLED
+from response_cache import response_cache, replay_chunks
+from model_lifecycle import get_lifecycle, DEFAULT_MODEL
+from model_router import model_router, is_auto
+from stream_coalescer import coalesce
+from think_parser import ThinkStreamParser, ANSWER
+from text_normalize import to_display, to_storage, replace_italic, replace_think_tags
+from cancellation import StopToken, watch_disconnect, iter_until_stopped, aclose_stream
+from stream_metrics import stream_metrics, StreamTimer, STOPPED, ERROR
 
 # Setup logging
 logging.basicConfig(
@@ -29,6 +39,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Max seconds without a chunk from Ollama before a stream is abandoned
+STREAM_IDLE_TIMEOUT = 30.0
+
+# Seconds between idle-session spill passes
+SESSION_SPILL_INTERVAL = 60.0
+
+# Uvicorn worker processes (inherited by every worker through the environment)
+WORKERS = int(os.getenv('CUTIE_WORKERS', 1))
+
 # Request models
 class ChatMessage(BaseModel):
     role: str
@@ -37,7 +56,8 @@ class ChatMessage(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
-    model: str = "deepseek-r1:1.5b"
+    model: str = DEFAULT_MODEL
+    session_id: Optional[str] = None
     conversation_history: List[ChatMessage] = []
     stream: bool = True
     max_tokens: Optional[int] = 512
@@ -48,6 +68,8 @@ class ChatResponse(BaseModel):
     model: str
     timestamp: str
     full_history: Optional[List[ChatMessage]] = None  # Added to return updated history
+    session_id: Optional[str] = None
+    history_delta: Optional[List[ChatMessage]] = None  # Only the new turn when using a server-side session
 
 class ModelInfo(BaseModel):
     name: str
@@ -65,7 +87,7 @@ class OllamaWorker:
         self.conversation_history = conversation_history.copy()
         self.num_threads = max(1, multiprocessing.cpu_count() // 2)
         self.model_name = model_name
-        self.stop_event = Event()
+        self.stop_token = StopToken()
         
     def run(self, chunk_callback=None, finish_callback=None):
         """Run the worker with callbacks"""
@@ -73,17 +95,8 @@ class OllamaWorker:
             logger.info(f"🤖 OllamaWorker running: {self.model_name}")
             logger.info(f"📝 History length: {len(self.conversation_history)}")
             
-            # Test connection first
-            try:
-                ollama.list()
-            except Exception as e:
-                error_msg = f"❌ Ollama tidak bisa diakses: {str(e)}"
-                if finish_callback:
-                    finish_callback(error_msg)
-                return error_msg
-            
-            # Start streaming
-            stream = ollama.chat(
+            # Start streaming (shared pooled client, no model-list probe)
+            stream = get_client().chat(
                 model=self.model_name,
                 messages=self.conversation_history,
                 stream=True,
@@ -104,13 +117,9 @@ class OllamaWorker:
             
             logger.info("🚀 Starting DeepSeek streaming...")
             
-            for chunk in stream:
+            # Stops between chunks and closes the HTTP stream, so Ollama aborts generation
+            for chunk in iter_until_stopped(stream, self.stop_token):
                 try:
-                    # Check if we should stop
-                    if self.stop_event.is_set():
-                        logger.info("⏹️ Stop event triggered")
-                        break
-                    
                     content = chunk.get('message', {}).get('content', '')
                     
                     if content:
@@ -151,6 +160,12 @@ class OllamaWorker:
             return final_response
 
         except Exception as e:
+            if is_connection_error(e):
+                get_registry().mark_unreachable(e)
+                error_msg = f"❌ Ollama tidak bisa diakses: {str(e)}"
+                if finish_callback:
+                    finish_callback(error_msg)
+                return error_msg
             error_msg = f"❌ DeepSeek Error: {str(e)}"
             logger.error(f"❌ OllamaWorker error: {e}")
             if finish_callback:
@@ -162,85 +177,48 @@ class OllamaWorker:
     
     def stop(self):
         """Stop the worker"""
-        self.stop_event.set()
+        self.stop_token.stop()
 
 # FIXED: Improved TextCleaner class
 class TextCleaner:
-    """Text cleaning and processing utilities"""
+    """Text cleaning and processing utilities (shared compiled transforms in text_normalize)"""
     
     def __init__(self, text):
         self.text_to_be_cleaned = text
 
     def replace_italic_text(self, text):
         """Replace italic markdown with HTML"""
-        return re.sub(r'\*(.*?)\*', r'<em>\1</em>', text)
+        return replace_italic(text)
 
     def replace_think_tags(self, text):
         """Clean and replace thinking tags"""
-        # Remove various HTML/XML tags that might appear
-        text = re.sub(r'<\s*/\s*div\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*response\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*button\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'---', '</think>', text)
-        text = re.sub(r'<\s*/\s*br\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*Compose\s*>', '</think>', text, flags=re.IGNORECASE)
-        
-        # Replace think tags with styled spans
-        text = re.sub(r'<\s*think\s*>', '<span style="font-style: italic; font-weight: 200;">', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*think\s*>', '</span><br><br>', text, flags=re.IGNORECASE)
-        
-        # Clean up malformed think tags
-        text = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', text, flags=re.IGNORECASE)
-        
-        return text
+        return replace_think_tags(text)
     
     def response_only(self, text):
         """Extract only the response content, removing thinking sections"""
-        if not text:
-            return text
-            
-        # Remove thinking sections
-        text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL | re.IGNORECASE)
-        text = re.sub(r'.*?</think>', '', text, flags=re.DOTALL)
-        
-        # Clean HTML tags
-        text = re.sub(r'<\s*/\s*div\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*br\s*>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*response\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'---', '', text)
-        
-        # Remove any remaining think tags
-        text = re.sub(r'<\s*think\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*think\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', text, flags=re.IGNORECASE)
-        
-        return text.strip()
+        return to_storage(text)
 
     def process_content(self, text):
         """Process content for display"""
-        if not text:
-            return text
-            
-        # Replace newlines with HTML breaks
-        processed = text.replace('\n', '<br>')
-        
-        # Process italic text
-        processed = self.replace_italic_text(processed)
-        
-        # Process think tags
-        processed = self.replace_think_tags(processed)
-        
-        return processed
+        return to_display(text)
+
+# Sessions and model status: in this process by default, or shared by every
+# worker / instance through SQLite-WAL or Postgres (CUTIE_STATE_BACKEND)
+conversation_sessions, model_status = create_state()
+STATE_SHARED = STATE_BACKEND not in ('', 'memory')
 
-# Global variables
-model_status = {
-    "deepseek-r1:1.5b": {"available": False, "loading": False},
-    "qwen": {"available": False, "loading": False},
-    "ollama": {"available": False, "loading": False}
-}
+async def state_call(fn, *args):
+    """Run a state-store call; shared backends do I/O, so keep it off the event loop"""
+    if STATE_SHARED:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
 
-# Store conversation sessions (in production, use Redis or database)
-conversation_sessions = {}
+# Admission control for generation (per model, fair across sessions)
+scheduler = GenerationScheduler()
+
+async def release_ticket(ticket):
+    """Release a scheduler ticket on the event loop (BackgroundTask runs sync callables in a threadpool)"""
+    scheduler.release(ticket)
 
 # FIXED: Improved startup/shutdown handling
 @asynccontextmanager
@@ -248,10 +226,34 @@ async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
     # Startup
     logger.info("🚀 Starting CutieChatter Backend Server...")
+    # First OLLAMA_HOSTS health check is blocking HTTP: keep it off the event loop
+    await asyncio.to_thread(start_host_pool)
+    get_registry()  # background model-list refresh
     await check_model_availability()
+    spill_task = asyncio.create_task(spill_idle_sessions())
+    # Preload the default model without blocking startup
+    get_lifecycle().warm_up(DEFAULT_MODEL)
     yield
     # Shutdown
     logger.info("👋 Shutting down CutieChatter Backend Server...")
+    spill_task.cancel()
+    await asyncio.to_thread(conversation_sessions.spill_all)
+    get_lifecycle().stop()
+    if WORKERS > 1:
+        # Sibling workers may still serve these models; Ollama's keep_alive expires them after the last use
+        logger.info("💤 Leaving models loaded for the other workers")
+    else:
+        await asyncio.to_thread(get_lifecycle().unload_all)
+    get_registry().stop()
+
+async def spill_idle_sessions():
+    """Periodically move idle sessions out of memory"""
+    while True:
+        await asyncio.sleep(SESSION_SPILL_INTERVAL)
+        try:
+            await asyncio.to_thread(conversation_sessions.spill_idle)
+        except Exception as e:
+            logger.error(f"Session spill error: {e}")
 
 # FastAPI app initialization with lifespan
 app = FastAPI(
@@ -285,18 +287,22 @@ async def root():
 async def health_check():
     """Health check endpoint"""
     try:
-        # Quick Ollama health check
-        ollama_healthy = False
-        try:
-            ollama.list()
-            ollama_healthy = True
-        except:
-            pass
+        # Cached Ollama health (refreshed in background by the model registry)
+        registry = get_registry()
+        ollama_healthy = registry.healthy
             
         return {
             "status": "healthy" if ollama_healthy else "degraded",
             "ollama_connection": ollama_healthy,
-            "models": model_status,
+            "registry": registry.status(),
+            "scheduler": scheduler.stats(),
+            "sessions": await state_call(conversation_sessions.stats),
+            "prefix_cache": prefix_cache.stats(),
+            "response_cache": response_cache.stats(),
+            "model_lifecycle": get_lifecycle().status(),
+            "router": model_router.stats(),
+            "stream_metrics": stream_metrics.snapshot()['models'],
+            "models": await state_call(model_status.snapshot),
             "timestamp": time.time()
         }
     except Exception as e:
@@ -307,14 +313,22 @@ async def health_check():
             "timestamp": time.time()
         }
 
+@app.get("/metrics")
+async def metrics():
+    """Per-stream latency / throughput metrics in the Prometheus text format"""
+    return PlainTextResponse(stream_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/models", response_model=Dict[str, Any])
 async def get_available_models():
     """Get list of available models"""
     available_models = []
     
     try:
-        ollama_models = ollama.list()
-        for model in ollama_models.get('models', []):
+        registry = get_registry()
+        if not registry.healthy:
+            raise ConnectionError(registry.last_error or "Ollama unreachable")
+            
+        for model in registry.models():
             model_name = model.get('name', '')
             if model_name:
                 available_models.append(ModelInfo(
@@ -326,78 +340,119 @@ async def get_available_models():
                 ))
                 
                 # Update global status
-                model_status[model_name] = {"available": True, "loading": False}
+                await state_call(model_status.set, model_name, True)
                 
     except Exception as e:
         logger.warning(f"Could not connect to Ollama: {e}")
         return {
             "models": [],
-            "status": model_status,
+            "status": await state_call(model_status.snapshot),
             "error": "Could not connect to Ollama server"
         }
     
     return {
         "models": [model.dict() for model in available_models],
-        "status": model_status,
+        "status": await state_call(model_status.snapshot),
         "total_models": len(available_models)
     }
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """Main chat endpoint with streaming support"""
     try:
         logger.info(f"📥 Chat request: {request.message[:50]}... (model: {request.model})")
         
+        if request.session_id and not conversation_sessions.is_valid_id(request.session_id):
+            raise HTTPException(status_code=400, detail="Invalid session_id")
+        
+        # "auto"/"ollama": let the router pick by prompt type, latency and load
+        if is_auto(request.model):
+            request.model = model_router.route(
+                request.message,
+                is_overloaded=scheduler.is_busy,
+                default=get_registry().find('deepseek') or DEFAULT_MODEL
+            )
+            logger.info(f"🧭 Routed to {request.model}")
+        
+        # Admission control: reserve a place in the model queue or push back with 429
+        session_key = request.session_id or (http_request.client.host if http_request.client else "anonymous")
+        try:
+            ticket = scheduler.submit(
+                request.model,
+                session_key,
+                priority=scheduler.is_interactive(request.message)
+            )
+        except QueueFullError as e:
+            logger.warning(f"🚦 {e}")
+            raise HTTPException(
+                status_code=429,
+                detail=f"Server busy, {e.depth} requests waiting for {e.model}",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        
         if request.stream:
             return StreamingResponse(
-                stream_chat_response(request),
+                stream_chat_response(request, http_request, ticket),
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
                     "Access-Control-Allow-Origin": "*",
                     "Access-Control-Allow-Headers": "*",
-                }
+                },
+                # Frees the slot even if the stream is never iterated
+                background=BackgroundTask(release_ticket, ticket)
             )
         else:
             # Non-streaming response
-            response = await generate_chat_response(request)
-            return response
+            return await generate_chat_response(request, ticket)
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Chat endpoint error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def stream_chat_response(request: ChatRequest):
+def resolve_history(request: ChatRequest):
+    """History for this turn: server-side when a session ID is given, else uploaded by the client"""
+    uploaded = [msg.dict() for msg in request.conversation_history]
+    if not request.session_id:
+        return uploaded, None
+    
+    history = conversation_sessions.get(request.session_id)
+    if history is None:
+        # Unknown session: start it, seeded with whatever history the client sent
+        conversation_sessions.create(request.session_id, uploaded)
+        history = uploaded
+    return history, request.session_id
+
+def build_messages(history, message):
+    """Ollama message list: system prompt (if missing) + history + new user message"""
+    messages = []
+    
+    # Add system prompt if not present
+    if not history or history[0].get('role') != 'system':
+        messages.append({'role': 'system', 'content': SYSTEM_PROMPT})
+    
+    # Add conversation history
+    for msg in history:
+        messages.append({'role': msg['role'], 'content': msg['content']})
+    
+    # Add current user message
+    messages.append({'role': 'user', 'content': message})
+    return messages
+
+async def stream_chat_response(request: ChatRequest, http_request: Optional[Request] = None, ticket=None):
     """FIXED: Stream chat response using Server-Sent Events with history tracking"""
+    # A client disconnect stops the generation and frees the model slot right away
+    stop = StopToken()
+    watcher = asyncio.create_task(watch_disconnect(http_request, stop)) if http_request is not None else None
+    timer = StreamTimer(request.model, 'api')
+    cached = None
     try:
-        # Format conversation history
-        messages = []
-        
-        # Add system prompt if not present
-        if not request.conversation_history or request.conversation_history[0].role != 'system':
-            messages.append({
-                'role': 'system',
-                'content': '''You're CutieChatter, your directive should be:
-                1. Playful.
-                2. Personally engaging with the user.
-                3. Maintain a consistent personal tone.
-                4. Avoid responding using double quotation marks.
-                5. Generate natural responses.'''
-            })
-        
-        # Add conversation history
-        for msg in request.conversation_history:
-            messages.append({
-                'role': msg.role,
-                'content': msg.content
-            })
-        
-        # Add current user message
-        messages.append({
-            'role': 'user',
-            'content': request.message
-        })
+        # Format conversation history (server-side when a session ID is given)
+        history, session_id = await state_call(resolve_history, request)
+        messages = build_messages(history, request.message)
 
         logger.info(f"📝 Conversation length: {len(messages)} messages")
 
@@ -407,341 +462,384 @@ async def stream_chat_response(request: ChatRequest):
         # Determine model and generate response
         model_name = request.model
         
-        if model_name == "deepseek-r1:1.5b" or "deepseek" in model_name.lower():
-            async for chunk in stream_deepseek_response(messages, request):
-                if chunk:  # Only yield non-empty chunks
-                    full_response += chunk
-                    yield f"data: {json.dumps({'content': chunk, 'model': model_name})}\n\n"
+        options = stream_options(request)
+        
+        with timer.stage('cache_lookup'):
+            cached = response_cache.get(messages, model_name, options)
+        if cached:
+            # Cache hit needs no model slot; replay it as a token stream
+            logger.info("⚡ Response cache hit")
+            if ticket is not None:
+                scheduler.release(ticket, generated=False)
+            stream = replay_cached_response(cached)
         else:
-            # Fallback to general Ollama
-            async for chunk in stream_ollama_response(messages, request):
-                if chunk:  # Only yield non-empty chunks
-                    full_response += chunk
-                    yield f"data: {json.dumps({'content': chunk, 'model': model_name})}\n\n"
+            # Wait for a model slot, reporting queue position to the client
+            if ticket is not None:
+                with timer.stage('queue_wait'):
+                    async for position in scheduler.wait_for_turn(ticket):
+                        if position:
+                            yield f"data: {json.dumps({'type': 'queue', 'position': position, 'model': request.model})}\n\n"
+            
+            if is_deepseek_model(model_name):
+                stream = stream_deepseek_response(messages, request, stop, timer)
+            else:
+                # Fallback to general Ollama
+                stream = stream_ollama_response(messages, request, stop, timer)
+        
+        # One SSE frame per coalesced batch instead of per token
+        async for chunk in coalesce(stream):
+            if chunk:  # Only yield non-empty chunks
+                full_response += chunk
+                yield f"data: {json.dumps({'content': chunk, 'model': model_name})}\n\n"
+        
+        if stop.stopped:
+            # Nobody is listening: a partial answer must not reach the cache or the session
+            logger.info(f"🛑 Generation stopped ({stop.reason}) after {len(full_response)} chars")
+            stream_metrics.record(timer.finish(STOPPED))
+            return
         
         # Send the complete conversation history including the new response
         if full_response:
             # Clean the response for history
-            text_cleaner = TextCleaner(full_response)
-            cleaned_response = text_cleaner.response_only(full_response)
+            with timer.stage('clean'):
+                text_cleaner = TextCleaner(full_response)
+                cleaned_response = text_cleaner.response_only(full_response)
+            if not cached:
+                response_cache.put(messages, cleaned_response, model_name, options)
             
-            # Build updated history
-            updated_history = []
+            # The new turn: user message + AI response
+            new_turn = [
+                {'role': 'user', 'content': request.message, 'timestamp': str(time.time())},
+                {'role': 'assistant', 'content': cleaned_response, 'timestamp': str(time.time())}
+            ]
             
-            # Keep existing history
-            for msg in request.conversation_history:
-                updated_history.append(msg.dict())
-            
-            # Add user message
-            updated_history.append({
-                'role': 'user',
-                'content': request.message,
-                'timestamp': str(time.time())
-            })
-            
-            # Add AI response
-            updated_history.append({
-                'role': 'assistant',
-                'content': cleaned_response,
-                'timestamp': str(time.time())
-            })
-            
-            # Send history update
-            yield f"data: {json.dumps({'type': 'history_update', 'history': updated_history})}\n\n"
+            if session_id:
+                # Delta protocol: the server keeps the history, send only what changed
+                length = await state_call(conversation_sessions.append, session_id, new_turn)
+                yield f"data: {json.dumps({'type': 'history_delta', 'session_id': session_id, 'messages': new_turn, 'length': length})}\n\n"
+            else:
+                # Legacy clients: send the complete conversation history
+                updated_history = history + new_turn
+                yield f"data: {json.dumps({'type': 'history_update', 'history': updated_history})}\n\n"
+        
+        if not cached:
+            # Replayed cache hits are not generations; they would skew TTFT and tokens/s
+            stream_metrics.record(timer.finish())
         
         # Send completion signal
         yield "data: [DONE]\n\n"
         
     except Exception as e:
         logger.error(f"Streaming error: {e}")
+        stream_metrics.record(timer.finish(ERROR))
         yield f"data: {json.dumps({'error': str(e), 'model': request.model})}\n\n"
-
-async def stream_deepseek_response(messages, request):
-    """FIXED: Stream response from DeepSeek-R1 model via Ollama"""
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        if ticket is not None:
+            scheduler.release(ticket)
+
+async def replay_cached_response(text):
+    """Replay a cached response as a token stream"""
+    for chunk in replay_chunks(text):
+        yield chunk
+
+async def _stream_ollama_chat(model_name, messages, options, stop=None, session_id=None, timer=None):
+    """Yield raw content chunks straight from the async Ollama client (no thread hop)"""
+    if stop is not None and stop.stopped:
+        return
+    if timer is None:
+        timer = StreamTimer(model_name, 'api')
+    
+    # Server-side sessions can reuse the KV prefix via the generate API's context;
+    # prepare() returns None when the turn has to go through /api/chat instead
+    prepared = None
+    if PREFIX_CACHE_ENABLED and session_id is not None:
+        prepared = prefix_cache.prepare(session_id, model_name, messages)
+        logger.info(f"♻️ Prefix cache {'hit' if prepared and prepared[2] else 'miss'} for session {session_id}")
+    use_prefix_cache = prepared is not None
+    
+    if use_prefix_cache:
+        prompt, system, context = prepared
+        stream = await get_async_client(session_id).generate(
+            model=model_name,
+            prompt=prompt,
+            system=system,
+            context=context,
+            stream=True,
+            options=options,
+            keep_alive=get_lifecycle().keep_alive
+        )
+    else:
+        stream = await get_async_client(session_id).chat(
+            model=model_name,
+            messages=messages,
+            stream=True,
+            options=options,
+            keep_alive=get_lifecycle().keep_alive
+        )
+    
+    # Race every read against the stop token, so a stop also lands during a long prefill
+    stopped = asyncio.ensure_future(stop.wait_async()) if stop is not None else None
+    read = None
     try:
-        response_queue = asyncio.Queue()
-        stop_event = Event()
-        
-        def ollama_stream_worker():
-            """Worker function to handle Ollama streaming in separate thread"""
+        while True:
+            read = asyncio.ensure_future(stream.__anext__())
+            waiters = {read} if stopped is None else {read, stopped}
+            done, _ = await asyncio.wait(waiters, timeout=STREAM_IDLE_TIMEOUT, return_when=asyncio.FIRST_COMPLETED)
+            
+            # A read still in flight is cancelled and awaited in the finally below
+            if read not in done:
+                if stopped is not None and stopped in done:
+                    logger.info(f"🛑 Cancelling generation ({stop.reason})")
+                    break
+                logger.warning("Ollama stream idle timeout - ending stream")
+                raise TimeoutError(f"Ollama stream idle for {STREAM_IDLE_TIMEOUT}s")
+            
             try:
-                logger.info("🤖 Starting DeepSeek-R1 streaming worker...")
-                
-                stream = ollama.chat(
-                    model="deepseek-r1:1.5b",
-                    messages=messages,
-                    stream=True,
-                    options={
-                        "temperature": request.temperature or 1.2,
-                        "num_ctx": 4096,
-                        "num_predict": request.max_tokens or 512,
-                        "top_k": 40,
-                        "top_p": 0.9,
-                        "repeat_penalty": 1.1,
-                    }
-                )
-                
-                for chunk in stream:
-                    if stop_event.is_set():
-                        break
-                        
-                    content = chunk.get('message', {}).get('content', '')
-                    if content:
-                        # Use asyncio-safe way to put into queue
-                        asyncio.run_coroutine_threadsafe(
-                            response_queue.put(('content', content)),
-                            asyncio.get_event_loop()
-                        )
-                
-                # Signal completion
-                asyncio.run_coroutine_threadsafe(
-                    response_queue.put(('done', None)),
-                    asyncio.get_event_loop()
-                )
-                
-            except Exception as e:
-                logger.error(f"Ollama streaming error: {e}")
-                asyncio.run_coroutine_threadsafe(
-                    response_queue.put(('error', str(e))),
-                    asyncio.get_event_loop()
-                )
-        
-        # Start Ollama in background thread
-        thread = Thread(target=ollama_stream_worker)
-        thread.daemon = True
-        thread.start()
-        
+                chunk = read.result()
+            except StopAsyncIteration:
+                break
+            if stop is not None and stop.stopped:
+                logger.info(f"🛑 Cancelling generation ({stop.reason})")
+                break
+            
+            if use_prefix_cache:
+                content = chunk.get('response', '')
+            else:
+                content = chunk.get('message', {}).get('content', '')
+            if content:
+                timer.tick()
+                yield content
+            
+            if chunk.get('done', False):
+                get_lifecycle().touch(model_name)
+                timer.done(chunk)
+                model_router.record(model_name, timer.ttft, chunk)
+                if use_prefix_cache:
+                    prefix_cache.store(session_id, model_name, messages, chunk.get('context'))
+                break
+    finally:
+        if stopped is not None:
+            stopped.cancel()
+        # Closing the generator closes the HTTP stream, so Ollama aborts generation;
+        # a client disconnect cancels this task, and that CancelledError propagates
+        await aclose_stream(stream, read)
+
+def _answer_text(text_cleaner, text, timer=None):
+    """Clean one answer segment, timing the first answer token and the cleaning stage"""
+    if timer is None:
+        return text_cleaner.process_content(text)
+    timer.answer()
+    with timer.stage('clean'):
+        return text_cleaner.process_content(text)
+
+def is_deepseek_model(model_name):
+    return model_name == "deepseek-r1:1.5b" or "deepseek" in model_name.lower()
+
+def stream_options(request: ChatRequest):
+    """Ollama options for a streamed generation (also part of the response cache key)"""
+    if is_deepseek_model(request.model):
+        return {
+            "temperature": request.temperature or 1.2,
+            "num_ctx": 4096,
+            "num_predict": request.max_tokens or 512,
+            "top_k": 40,
+            "top_p": 0.9,
+            "repeat_penalty": 1.1,
+        }
+    return {
+        "temperature": request.temperature or 1.0,
+        "num_ctx": 2048,
+        "num_predict": request.max_tokens or 256,
+    }
+
+async def stream_deepseek_response(messages, request, stop=None, timer=None):
+    """Stream response from DeepSeek-R1 model via the async Ollama client"""
+    try:
+        logger.info("🤖 Starting DeepSeek-R1 stream...")
         text_cleaner = TextCleaner("")
-        
-        try:
-            while True:
-                try:
-                    # Get from queue with timeout
-                    item_type, content = await asyncio.wait_for(response_queue.get(), timeout=30.0)
-                    
-                    if item_type == 'done':
-                        logger.info("✅ Streaming completed")
-                        break
-                    elif item_type == 'error':
-                        logger.error(f"Stream error: {content}")
-                        yield f"Error: {content}"
-                        break
-                    elif item_type == 'content' and content:
-                        # Process content with text cleaner
-                        text_cleaner.text_to_be_cleaned = content
-                        processed_content = text_cleaner.process_content(content)
-                        
-                        yield processed_content
-                    
-                    # Small delay to prevent overwhelming
-                    await asyncio.sleep(0.01)
-                    
-                except asyncio.TimeoutError:
-                    logger.warning("Queue timeout - ending stream")
-                    break
-        finally:
-            # Cleanup
-            stop_event.set()
+        # Tags may be split across chunks; DeepSeek-R1 often omits the opening <think>
+        parser = ThinkStreamParser(starts_in_reasoning=True)
+        raw = []
+        
+        async for content in _stream_ollama_chat(
+            request.model,
+            messages,
+            stream_options(request),
+            stop,
+            request.session_id,
+            timer
+        ):
+            raw.append(content)
+            for kind, text in parser.feed(content):
+                if kind == ANSWER:
+                    yield _answer_text(text_cleaner, text, timer)
+        
+        for kind, text in parser.close():
+            if kind == ANSWER:
+                yield _answer_text(text_cleaner, text, timer)
+        if not parser.saw_answer and not (stop is not None and stop.stopped):
+            # Stream ended inside the reasoning: fall back to the heuristic cleaner
+            yield text_cleaner.response_only(''.join(raw))
+        
+        logger.info("✅ Streaming completed")
         
     except Exception as e:
+        if is_connection_error(e):
+            get_registry().mark_unreachable(e)
         logger.error(f"DeepSeek streaming error: {e}")
-        yield f"Error: {str(e)}"
+        # Failures go up to the caller: they must not be cached or counted as answers
+        raise
 
-async def stream_ollama_response(messages, request):
-    """FIXED: Stream response from general Ollama models"""
+async def stream_ollama_response(messages, request, stop=None, timer=None):
+    """Stream response from general Ollama models via the async Ollama client"""
     try:
-        response_queue = asyncio.Queue()
-        stop_event = Event()
-        
-        def ollama_worker():
-            """Worker function for general Ollama models"""
-            try:
-                # Determine model name
-                model_name = request.model
-                if model_name == "ollama":
-                    # Try to find a good model
-                    try:
-                        models = ollama.list()
-                        available_models = [m['name'] for m in models.get('models', [])]
-                        
-                        # Prefer DeepSeek models
-                        for model in available_models:
-                            if 'deepseek' in model.lower():
-                                model_name = model
-                                break
-                        else:
-                            # Use first available model
-                            model_name = available_models[0] if available_models else "llama2"
-                    except:
-                        model_name = "llama2"
-                
-                logger.info(f"🤖 Using Ollama model: {model_name}")
-                
-                stream = ollama.chat(
-                    model=model_name,
-                    messages=messages,
-                    stream=True,
-                    options={
-                        "temperature": request.temperature or 1.0,
-                        "num_ctx": 2048,
-                        "num_predict": request.max_tokens or 256,
-                    }
-                )
-                
-                for chunk in stream:
-                    if stop_event.is_set():
-                        break
-                        
-                    content = chunk.get('message', {}).get('content', '')
-                    if content:
-                        asyncio.run_coroutine_threadsafe(
-                            response_queue.put(('content', content)),
-                            asyncio.get_event_loop()
-                        )
-                
-                asyncio.run_coroutine_threadsafe(
-                    response_queue.put(('done', None)),
-                    asyncio.get_event_loop()
-                )
-                
-            except Exception as e:
-                asyncio.run_coroutine_threadsafe(
-                    response_queue.put(('error', str(e))),
-                    asyncio.get_event_loop()
-                )
+        # "auto"/"ollama" was already resolved by the router in chat_endpoint
+        model_name = request.model
         
-        thread = Thread(target=ollama_worker)
-        thread.daemon = True
-        thread.start()
-        
-        try:
-            while True:
-                try:
-                    item_type, content = await asyncio.wait_for(response_queue.get(), timeout=30.0)
-                    
-                    if item_type == 'done':
-                        break
-                    elif item_type == 'error':
-                        yield f"Error: {content}"
-                        break
-                    elif item_type == 'content' and content:
-                        yield content
-                    
-                    await asyncio.sleep(0.01)
-                    
-                except asyncio.TimeoutError:
-                    logger.warning("Ollama stream timeout")
-                    break
-        finally:
-            stop_event.set()
+        logger.info(f"🤖 Using Ollama model: {model_name}")
+        parser = ThinkStreamParser()
+        
+        async for content in _stream_ollama_chat(
+            model_name,
+            messages,
+            stream_options(request),
+            stop,
+            request.session_id,
+            timer
+        ):
+            for kind, text in parser.feed(content):
+                if kind == ANSWER:
+                    if timer is not None:
+                        timer.answer()
+                    yield text
+        for kind, text in parser.close():
+            if kind == ANSWER:
+                yield text
         
     except Exception as e:
+        if is_connection_error(e):
+            get_registry().mark_unreachable(e)
         logger.error(f"Ollama streaming error: {e}")
-        yield f"Error: {str(e)}"
+        # Failures go up to the caller: they must not be cached or counted as answers
+        raise
 
-async def generate_chat_response(request: ChatRequest):
+async def generate_chat_response(request: ChatRequest, ticket=None):
     """FIXED: Generate non-streaming chat response with history tracking"""
+    timer = StreamTimer(request.model, 'api')
+    generating = False
+    cache_hit = False
     try:
-        messages = []
-        
-        # Add system prompt if not present
-        if not request.conversation_history or request.conversation_history[0].role != 'system':
-            messages.append({
-                'role': 'system',
-                'content': '''You're CutieChatter, your directive should be:
-                1. Playful.
-                2. Personally engaging with the user.
-                3. Maintain a consistent personal tone.
-                4. Avoid responding using double quotation marks.
-                5. Generate natural responses.'''
-            })
-        
-        # Add conversation history
-        for msg in request.conversation_history:
-            messages.append({'role': msg.role, 'content': msg.content})
-        
-        # Add current message
-        messages.append({'role': 'user', 'content': request.message})
+        history, session_id = await state_call(resolve_history, request)
+        messages = build_messages(history, request.message)
         
         # Use Ollama for response
-        model_name = request.model if request.model != "deepseek-r1:1.5b" else "deepseek-r1:1.5b"
-        
-        response = ollama.chat(
-            model=model_name,
-            messages=messages,
-            stream=False,
-            options={
-                "temperature": request.temperature or 1.2,
-                "num_ctx": 4096,
-                "num_predict": request.max_tokens or 512,
-            }
-        )
-        
-        content = response.get('message', {}).get('content', '')
-        
-        # Clean response
-        text_cleaner = TextCleaner(content)
-        cleaned_content = text_cleaner.response_only(content)
-        
-        # Build updated history
-        updated_history = []
+        model_name = request.model
         
-        # Keep existing history
-        for msg in request.conversation_history:
-            updated_history.append(msg)
+        options = {
+            "temperature": request.temperature or 1.2,
+            "num_ctx": 4096,
+            "num_predict": request.max_tokens or 512,
+        }
         
-        # Add user message
-        updated_history.append(ChatMessage(
-            role='user',
-            content=request.message,
-            timestamp=str(time.time())
-        ))
+        with timer.stage('cache_lookup'):
+            cleaned_content = response_cache.get(messages, model_name, options)
+        if cleaned_content:
+            logger.info("⚡ Response cache hit")
+            cache_hit = True
+        else:
+            # Wait for a model slot (a cache hit never takes one)
+            if ticket is not None:
+                with timer.stage('queue_wait'):
+                    async for _ in scheduler.wait_for_turn(ticket):
+                        pass
+            
+            generating = True
+            response = await asyncio.to_thread(
+                get_client(session_id).chat,
+                model=model_name,
+                messages=messages,
+                stream=False,
+                options=options,
+                keep_alive=get_lifecycle().keep_alive
+            )
+            get_lifecycle().touch(model_name)
+            model_router.record(model_name, done_chunk=response)
+            timer.done(response)
+            
+            content = response.get('message', {}).get('content', '')
+            
+            # Clean response
+            with timer.stage('clean'):
+                text_cleaner = TextCleaner(content)
+                cleaned_content = text_cleaner.response_only(content)
+            response_cache.put(messages, cleaned_content, model_name, options)
+            # No streaming here: the whole answer arrives at once (no TTFT)
+            generating = False
+            stream_metrics.record(timer.finish())
+        
+        # The new turn: user message + AI response
+        new_turn = [
+            ChatMessage(role='user', content=request.message, timestamp=str(time.time())),
+            ChatMessage(role='assistant', content=cleaned_content, timestamp=str(time.time()))
+        ]
         
-        # Add AI response
-        updated_history.append(ChatMessage(
-            role='assistant',
-            content=cleaned_content,
-            timestamp=str(time.time())
-        ))
+        if session_id:
+            await state_call(conversation_sessions.append, session_id, [msg.dict() for msg in new_turn])
+            return ChatResponse(
+                content=cleaned_content,
+                model=request.model,
+                timestamp=str(time.time()),
+                session_id=session_id,
+                history_delta=new_turn
+            )
         
         return ChatResponse(
             content=cleaned_content,
             model=request.model,
             timestamp=str(time.time()),
-            full_history=updated_history  # Return updated history
+            full_history=[ChatMessage(**msg) for msg in history] + new_turn  # Return updated history
         )
         
     except Exception as e:
         logger.error(f"Generate response error: {e}")
+        if generating:
+            stream_metrics.record(timer.finish(ERROR))
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+    finally:
+        if ticket is not None:
+            scheduler.release(ticket, generated=not cache_hit)
 
 async def check_model_availability():
     """Check model availability on startup"""
     logger.info("🔍 Checking model availability...")
     
     try:
-        models = ollama.list()
-        logger.info(f"Connected to Ollama. Available models: {len(models.get('models', []))}")
+        registry = get_registry()
+        if not await asyncio.to_thread(registry.refresh):
+            raise ConnectionError(registry.last_error or "Ollama unreachable")
+        models = registry.models()
+        logger.info(f"Connected to Ollama. Available models: {len(models)}")
         
         # Reset model status
-        for key in model_status:
-            model_status[key] = {"available": False, "loading": False}
+        await state_call(model_status.reset)
         
         # Update with actual models
-        for model in models.get('models', []):
+        for model in models:
             model_name = model.get('name', '')
             if model_name:
-                model_status[model_name] = {"available": True, "loading": False}
+                await state_call(model_status.set, model_name, True)
                 logger.info(f"✅ Found model: {model_name}")
         
         # Check specifically for DeepSeek-R1
         deepseek_models = [
-            m for m in models.get('models', []) 
+            m for m in models 
             if 'deepseek-r1' in m.get('name', '').lower()
         ]
         
         if deepseek_models:
-            model_status["deepseek-r1:1.5b"]["available"] = True
+            await state_call(model_status.set, "deepseek-r1:1.5b", True)
             logger.info("✅ DeepSeek-R1 model is available!")
         else:
             logger.warning("⚠️  DeepSeek-R1 model not found. Please install it with: ollama pull deepseek-r1:1.5b")
@@ -751,8 +849,7 @@ async def check_model_availability():
         logger.error("❌ Make sure Ollama is installed and running!")
         
         # Set all models as unavailable
-        for key in model_status:
-            model_status[key] = {"available": False, "loading": False}
+        await state_call(model_status.reset)
 
 # Additional utility endpoints
 @app.get("/models/refresh")
@@ -761,7 +858,7 @@ async def refresh_models():
     await check_model_availability()
     return {
         "message": "Model availability refreshed",
-        "models": model_status,
+        "models": await state_call(model_status.snapshot),
         "timestamp": time.time()
     }
 
@@ -771,10 +868,11 @@ async def pull_model(model_name: str):
     try:
         # This would typically be a background task
         # For now, just check if model exists
-        models = ollama.list()
-        existing_models = [m['name'] for m in models.get('models', [])]
+        registry = get_registry()
+        if not registry.healthy:
+            raise ConnectionError(registry.last_error or "Ollama unreachable")
         
-        if model_name in existing_models:
+        if registry.is_available(model_name):
             return {"message": f"Model {model_name} already exists", "status": "exists"}
         else:
             return {"message": f"Model {model_name} not found. Use 'ollama pull {model_name}' in terminal", "status": "not_found"}
@@ -786,18 +884,26 @@ async def pull_model(model_name: str):
 @app.post("/session/new")
 async def create_new_session():
     """Create a new conversation session"""
-    session_id = str(time.time())
-    conversation_sessions[session_id] = []
+    session_id = await state_call(conversation_sessions.create)
     return {"session_id": session_id, "created": time.time()}
 
 @app.get("/session/{session_id}")
 async def get_session(session_id: str):
     """Get conversation history for a session"""
-    if session_id in conversation_sessions:
-        return {"session_id": session_id, "history": conversation_sessions[session_id]}
+    history = await state_call(conversation_sessions.get, session_id)
+    if history is not None:
+        return {"session_id": session_id, "history": history}
     else:
         raise HTTPException(status_code=404, detail="Session not found")
 
+@app.delete("/session/{session_id}")
+async def delete_session(session_id: str):
+    """Delete a conversation session"""
+    prefix_cache.invalidate(session_id)
+    if not await state_call(conversation_sessions.delete, session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, "deleted": True}
+
 if __name__ == "__main__":
     print("🚀 Starting CutieChatter Backend Server...")
     print("=" * 50)
@@ -813,11 +919,20 @@ if __name__ == "__main__":
     print("   3. Run: ollama pull deepseek-r1:1.5b")
     print("=" * 50)
     
+    # Several workers need a shared state backend, otherwise each has its own sessions
+    if WORKERS > 1 and not STATE_SHARED:
+        print("⚠️  CUTIE_WORKERS > 1 without CUTIE_STATE_BACKEND=sqlite|postgres: sessions are per worker")
+    if WORKERS > 1:
+        # Only sessions and model status are shared; the scheduler and caches are not
+        print(f"⚠️  Generation scheduler, prefix cache and response cache are per worker: "
+              f"up to {WORKERS} x CUTIE_MAX_CONCURRENT_PER_MODEL generations per model")
+    
     uvicorn.run(
         "backend2:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
+        reload=WORKERS == 1,  # uvicorn cannot reload and fork workers at once
+        workers=WORKERS,
         log_level="info",
         access_log=True
     )
\ No newline at end of file
@@ -21,8 +21,19 @@ from PyQt6.QtCore import (
 from PyQt6.QtMultimedia import QMediaPlayer, QAudioOutput
 from PyQt6.QtGui import QIcon
 from ocr.docreader import TextExtractor
-from transformers import TextIteratorStreamer
-import multiprocessing, ollama, re, sys, os, subprocess, random, torch
+from ocr.docpipeline import document_pipeline, is_summary_request, DOC_NUM_CTX
+from ollama_client import get_client, get_registry, is_connection_error, chat_options
+from prefix_cache import prefix_cache, PREFIX_CACHE_ENABLED
+from response_cache import response_cache, replay_chunks
+from model_lifecycle import model_lifecycle
+from model_router import model_router
+from stream_metrics import stream_metrics, StreamTimer, STOPPED, ERROR
+from stream_coalescer import ChunkCoalescer
+from think_parser import ThinkStreamParser, ANSWER
+from text_normalize import to_display, replace_italic, replace_think_tags, extract_answer, strip_tokens_and_emoji
+from cancellation import StopToken, iter_until_stopped
+from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+import multiprocessing, re, sys, os, subprocess, random, torch
 import torch.nn.functional as F
 from threading import Thread
 import seaborn as sns
@@ -208,88 +219,24 @@ class ChatWidget(QWidget):
 '''
 
 class TextCleaner():
+    """Thin wrapper over the shared compiled transforms in text_normalize"""
+
     def __init__(self, text):
         self.text_to_be_cleaned = text
 
     def replace_italic_text(self, text):
-        return re.sub(r'\*(.*?)\*', r'<em>\1</em>', text)
+        return replace_italic(text)
 
     def replace_think_tags(self, text):
-        text = re.sub(r'<\s*/\s*div\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*response\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*button\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'---', '</think', text)
-        text = re.sub(r'<\s*/\s*br\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*Compose\s*>', '</think>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*think\s*>', '<span style="font-style: italic; font-weight: 200;">', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*think\s*>', '</span><br><br>', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', text, flags=re.IGNORECASE)
-        return text
+        return replace_think_tags(text)
     
     def response_only(self, text):
         """Extract only the response content, removing thinking sections - FIXED FOR DEEPSEEK"""
-        if not text:
-            return text
-        
-        # DeepSeek-R1 specific: Find the actual response after thinking
-        # Look for common patterns that indicate end of thinking
-        patterns = [
-            r'</think>\s*',
-            r'<think>.*?</think>',  # Remove think blocks
-            r'Alright,.*?\n\n',
-            r'I should.*?\n\n',
-            r'Let me.*?\n\n',
-            r'Hmm.*?\n\n',
-            r'Okay.*?\n\n',
-            r'I want to.*?\n\n',
-            r'I need to.*?\n\n',
-            r'Actually.*?\n\n',
-        ]
-        
-        cleaned_text = text
-        
-        # First, try to find </think> tag and get everything after it
-        think_end = cleaned_text.find('</think>')
-        if think_end != -1:
-            cleaned_text = cleaned_text[think_end + 8:].strip()
-            return cleaned_text
-        
-        # If no </think>, try to remove thinking patterns
-        for pattern in patterns:
-            cleaned_text = re.sub(pattern, '', cleaned_text, flags=re.IGNORECASE | re.DOTALL)
-        
-        # If text still looks like thinking, try to extract the last meaningful sentence
-        if any(keyword in cleaned_text.lower()[:50] for keyword in ['let me', 'i should', 'hmm', 'alright', 'actually']):
-            sentences = cleaned_text.split('. ')
-            # Find the last sentence that doesn't look like thinking
-            for i in range(len(sentences) - 1, -1, -1):
-                sentence = sentences[i].strip()
-                if sentence and not any(keyword in sentence.lower() for keyword in ['let me', 'i should', 'hmm']):
-                    cleaned_text = sentence
-                    if not cleaned_text.endswith('.'):
-                        cleaned_text += '.'
-                    break
-        
-        # Final cleanup
-        cleaned_text = re.sub(r'<[^>]+>', '', cleaned_text)  # Remove any HTML tags
-        cleaned_text = re.sub(r'\s+', ' ', cleaned_text)  # Normalize whitespace
-        cleaned_text = cleaned_text.strip()
-        
-        # If we end up with very short text, it might be an error
-        if len(cleaned_text) < 10 and len(text) > 100:
-            # Return a simple greeting as fallback
-            return "Halo! Ada yang bisa saya bantu?"
-        
-        return cleaned_text
+        return extract_answer(text)
 
     def process_content(self, text):
         """Process content for display"""
-        if not text:
-            return text
-        processed = self.text_to_be_cleaned.replace('\n', '<br>')
-        processed = self.replace_italic_text(processed)
-        processed = self.replace_think_tags(processed)
-        return processed
+        return to_display(text)
 
 '''
     Ollama Worker For direct conversation - FINAL FIXED VERSION
@@ -299,88 +246,103 @@ class OllamaWorker(QObject):
     chunk_received = pyqtSignal(str)
     finished = pyqtSignal(str)
 
-    def __init__(self, user_message, conversation_history, model_name):
+    def __init__(self, user_message, conversation_history, model_name, session_key="default", use_prefix_cache=PREFIX_CACHE_ENABLED):
         super().__init__()
         self.user_message = user_message
         self.conversation_history = conversation_history.copy()
         self.num_threads = max(1, multiprocessing.cpu_count() // 2)
         self.model_name = model_name
+        # Prefix/KV reuse: generate API + per-session context so only the new turn is prefilled
+        self.session_key = session_key
+        self.use_prefix_cache = use_prefix_cache
+        self.stop_token = StopToken()
+
+    def stop(self):
+        """Ask the stream to stop at the next chunk (callable from the GUI thread)"""
+        self.stop_token.stop()
 
     def run(self):
+        # Batch tokens into fewer signals so the GUI thread and WebChannel are not flooded
+        coalescer = ChunkCoalescer(self.chunk_received.emit, background=True)
+        timer = StreamTimer(self.model_name, 'desktop')
         try:
             print(f"🤖 OllamaWorker running: {self.model_name}")
             print(f"📝 Conversation history length: {len(self.conversation_history)}")
             
-            # Test connection first
-            try:
-                ollama.list()
-            except Exception as e:
-                error_msg = f"❌ Ollama tidak bisa diakses: {str(e)}"
-                print(error_msg)
-                self.chunk_received.emit(error_msg)
-                self.finished.emit(error_msg)
+            options = chat_options(self.model_name, self.num_threads)
+            
+            # Cached opener: replay it as a token stream so the UI path is unchanged
+            with timer.stage('cache_lookup'):
+                cached = response_cache.get(self.conversation_history, self.model_name, options)
+            if cached:
+                print("⚡ Response cache hit")
+                for piece in replay_chunks(cached):
+                    coalescer.push(piece)
+                coalescer.close()
+                self.finished.emit(cached)
                 return
             
             # Check if this is DeepSeek model
             is_deepseek = 'deepseek' in self.model_name.lower()
             
-            # Start streaming with appropriate options
-            stream = ollama.chat(
-                model=self.model_name,
-                messages=self.conversation_history,
-                stream=True,
-                options={
-                    "num_thread": self.num_threads,
-                    "temperature": 0.7 if is_deepseek else 1.1,
-                    "top_k": 40,
-                    "top_p": 0.9,
-                    "num_ctx": 2048,
-                    "num_batch": 512,
-                    "repeat_penalty": 1.1,
-                    "stop": ["</think>", "\nHuman:", "\nUser:"] if is_deepseek else []
-                }
-            )
+            # Start streaming with appropriate options (shared pooled client, no model-list probe);
+            # prepare() returns None when the turn has to go through /api/chat instead
+            prepared = None
+            if self.use_prefix_cache:
+                prepared = prefix_cache.prepare(self.session_key, self.model_name, self.conversation_history)
+                print(f"♻️ Prefix cache {'hit' if prepared and prepared[2] else 'miss'} for session {self.session_key}")
+            use_generate = prepared is not None
+            if use_generate:
+                prompt, system, context = prepared
+                stream = get_client(self.session_key).generate(
+                    model=self.model_name,
+                    prompt=prompt,
+                    system=system,
+                    context=context,
+                    stream=True,
+                    options=options,
+                    keep_alive=model_lifecycle.keep_alive
+                )
+            else:
+                stream = get_client(self.session_key).chat(
+                    model=self.model_name,
+                    messages=self.conversation_history,
+                    stream=True,
+                    options=options,
+                    keep_alive=model_lifecycle.keep_alive
+                )
             
             full_content = ''
             received_chunks = 0
-            buffer = ''
-            response_started = False
+            # DeepSeek-R1 often omits the opening <think>: everything before </think> is reasoning
+            parser = ThinkStreamParser(starts_in_reasoning=is_deepseek)
             
             print("🚀 Starting streaming...")
             
-            for chunk in stream:
+            # Closing the stream on stop drops the connection, so Ollama aborts generation
+            for chunk in iter_until_stopped(stream, self.stop_token):
                 try:
-                    content = chunk.get('message', {}).get('content', '')
+                    if use_generate:
+                        content = chunk.get('response', '')
+                    else:
+                        content = chunk.get('message', {}).get('content', '')
                     
                     if content:
+                        timer.tick()
                         full_content += content
                         received_chunks += 1
                         
-                        if is_deepseek:
-                            buffer += content
-                            
-                            # Check if we should start showing response
-                            if not response_started:
-                                if '</think>' in buffer or len(buffer) > 1000:
-                                    # Extract actual response
-                                    text_cleaner = TextCleaner(buffer)
-                                    actual_response = text_cleaner.response_only(buffer)
-                                    
-                                    if actual_response and len(actual_response) > 10:
-                                        response_started = True
-                                        self.chunk_received.emit(actual_response)
-                                        buffer = ''  # Clear buffer
+                        # Only the answer is shown; reasoning stays out of the chat bubble
+                        for kind, text in parser.feed(content):
+                            if kind != ANSWER:
+                                continue
+                            timer.answer()
+                            if is_deepseek:
+                                coalescer.push(text)
                             else:
-                                # We're in the response part, emit directly
-                                self.chunk_received.emit(content)
-                        else:
-                            # Non-DeepSeek models - process normally
-                            try:
-                                processor = TextCleaner(content)
-                                processed = processor.process_content(content)
-                                self.chunk_received.emit(processed)
-                            except:
-                                self.chunk_received.emit(content)
+                                with timer.stage('clean'):
+                                    text = TextCleaner(text).process_content(text)
+                                coalescer.push(text)
                         
                         # Log progress every 10 chunks
                         if received_chunks % 10 == 0:
@@ -389,6 +351,12 @@ class OllamaWorker(QObject):
                     # Check if done
                     if chunk.get('done', False):
                         print("✅ Stream completed")
+                        model_lifecycle.touch(self.model_name)
+                        timer.done(chunk)
+                        model_router.record(self.model_name, timer.ttft, chunk)
+                        if use_generate:
+                            # Keep the KV prefix warm for the next turn of this session
+                            prefix_cache.store(self.session_key, self.model_name, self.conversation_history, chunk.get('context'))
                         break
                         
                 except Exception as chunk_error:
@@ -397,24 +365,48 @@ class OllamaWorker(QObject):
             
             print(f"🏁 Total: {received_chunks} chunks, {len(full_content)} chars")
             
-            # Final processing for DeepSeek
-            if is_deepseek:
-                text_cleaner = TextCleaner(full_content)
-                final_response = text_cleaner.response_only(full_content)
-                
-                # If we never started response, emit the cleaned version now
-                if not response_started and final_response:
-                    self.chunk_received.emit(final_response)
+            for kind, text in parser.close():
+                if kind == ANSWER:
+                    coalescer.push(text)
+            
+            if self.stop_token.stopped:
+                # Partial answer only: nothing to cache and no fallback greeting
+                print(f"🛑 Generation stopped after {received_chunks} chunks")
+                stream_metrics.record(timer.finish(STOPPED))
+                coalescer.close()
+                self.finished.emit(parser.answer.strip())
+                return
+            
+            if parser.saw_answer:
+                final_response = parser.answer.strip()
             else:
-                final_response = full_content
+                # Stream ended inside the reasoning: fall back to the heuristic cleaner
+                final_response = TextCleaner(full_content).response_only(full_content)
+                if final_response:
+                    timer.answer()
+                    coalescer.push(final_response)
             
+            stream_metrics.record(timer.finish())
+
             # Emit the complete response
+            coalescer.close()
             if final_response and final_response.strip():
+                response_cache.put(self.conversation_history, final_response, self.model_name, options)
                 self.finished.emit(final_response)
             else:
                 self.finished.emit("Halo! Ada yang bisa saya bantu?")
 
         except Exception as e:
+            coalescer.close()
+            stream_metrics.record(timer.finish(ERROR))
+            if is_connection_error(e):
+                # Server down: let the registry re-check in the background
+                get_registry().mark_unreachable(e)
+                error_msg = f"❌ Ollama tidak bisa diakses: {str(e)}"
+                print(error_msg)
+                self.chunk_received.emit(error_msg)
+                self.finished.emit(error_msg)
+                return
             error_msg = f"❌ Error: {str(e)}"
             print(f"❌ OllamaWorker error: {e}")
             import traceback
@@ -439,6 +431,11 @@ class OllamaOCRWorker(QObject):
         self.text_extractor = TextExtractor()
         self.file_path = None
         self.model_name = model_name
+        self.stop_token = StopToken()
+
+    def stop(self):
+        """Ask the stream to stop at the next chunk"""
+        self.stop_token.stop()
 
     def set_file_path(self, path):
         self.file_path = path
@@ -455,47 +452,60 @@ class OllamaOCRWorker(QObject):
                 self.finished.emit("")
                 return
             
-            pdf_name = os.path.basename(self.file_path)
-            
             if not os.path.exists(self.file_path):
                 self.chunk_received.emit("The file does not exist.")
                 self.finished.emit("")
                 return
-            
-            extracted_text = self.text_extractor.extract_text_from_pdf(self.file_path)
-            
-            if not extracted_text:
+
+            # OCR + chunk index, reused from the cache when the same file comes back
+            try:
+                index = document_pipeline.load(self.file_path, self.text_extractor)
+            except ValueError as e:
+                print(f"❌ OCR failed: {e}")
                 self.chunk_received.emit("Failed to extract text from PDF.")
                 self.finished.emit("")
                 return
 
-            self.conversation_history.append({
-                'role': 'user', 
-                'content': f"File : {pdf_name}, Content : {extracted_text}"
-            })
+            # Only the relevant chunks (or the map-reduced summary) go into the prompt
+            if is_summary_request(self.user_message):
+                messages = document_pipeline.summary_messages(
+                    index, self.conversation_history, self.user_message, self.model_name, self.stop_token
+                )
+            else:
+                messages = document_pipeline.question_messages(index, self.conversation_history, self.user_message)
+            if self.stop_token.stopped:
+                self.finished.emit("")
+                return
 
-            stream = ollama.chat(
+            stream = get_client().chat(
                 model=self.model_name,
-                messages=self.conversation_history,
+                messages=messages,
                 stream=True,
                 options={
                     "num_thread": self.num_threads,
                     "temperature": 2.52,
                     "top_n": 121,
                     "f16_kv": True,
-                    "num_ctx": 1024*2,
+                    "num_ctx": DOC_NUM_CTX,
                     "num_batch": 8,
                     "num_prediction": 1024*2
-                }
+                },
+                keep_alive=model_lifecycle.keep_alive
             )            
             full_content = ''
-            for chunk in stream:
-                content = chunk['message']['content']
-                full_content += content
-                string_processor = TextCleaner(content)
-                processed_content = string_processor.process_content(content)
-                self.chunk_received.emit(processed_content)
+            coalescer = ChunkCoalescer(self.chunk_received.emit, background=True)
+            try:
+                for chunk in iter_until_stopped(stream, self.stop_token):
+                    content = chunk['message']['content']
+                    full_content += content
+                    string_processor = TextCleaner(content)
+                    processed_content = string_processor.process_content(content)
+                    coalescer.push(processed_content)
+            finally:
+                coalescer.close()
             
+            if not self.stop_token.stopped:
+                model_lifecycle.touch(self.model_name)
             self.finished.emit(full_content)
 
         except Exception as e:
@@ -507,6 +517,15 @@ class OllamaOCRWorker(QObject):
     QWEN WORKER [Research]
 '''
 
+class StopTokenCriteria(StoppingCriteria):
+    """Ends model.generate() at the next token once the stop token is set"""
+
+    def __init__(self, stop_token):
+        self.stop_token = stop_token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.stop_token.stopped, dtype=torch.bool, device=input_ids.device)
+
 class QwenWorker(QObject):
     chunk_received = pyqtSignal(str)
     finished = pyqtSignal(str)
@@ -527,9 +546,14 @@ class QwenWorker(QObject):
         self.hook_handles = []
         self.num_amplification = vector_amplification
         self.bias_embedding = None
+        self.stop_token = StopToken()
         if self.injection_vectors is not None:
             self._precompute_bias_embedding()
 
+    def stop(self):
+        """Stop generation after the current token"""
+        self.stop_token.stop()
+
     def _precompute_bias_embedding(self):
         try:
             amplified_injection_vectors = [vec for vec in self.injection_vectors for _ in range(self.num_amplification)]
@@ -591,6 +615,7 @@ class QwenWorker(QObject):
                 'no_repeat_ngram_size': 5,
                 'repetition_penalty': 1.1,
                 'streamer': streamer,
+                'stopping_criteria': StoppingCriteriaList([StopTokenCriteria(self.stop_token)]),
                 'top_k': 10,
                 'top_p': 0.15,
                 'early_stopping': True,
@@ -605,22 +630,28 @@ class QwenWorker(QObject):
             thread.start()
 
             full_content = []
-            for new_text in streamer:
-                content = new_text.get('content', '') if isinstance(new_text, dict) else new_text
-
-                if not self.response_started:
-                    match = assistant_pattern.search(content)
-                    if match:
-                        content = content[match.end():]
-                        self.response_started = True
-                    else:
-                        continue
+            coalescer = ChunkCoalescer(self.chunk_received.emit, background=True)
+            try:
+                for new_text in streamer:
+                    if self.stop_token.stopped:
+                        break
+                    content = new_text.get('content', '') if isinstance(new_text, dict) else new_text
 
-                if content:   
-                    full_content.append(content)
-                    cleaned_content = self._clean_response(content)
-                    if cleaned_content:
-                        self.chunk_received.emit(cleaned_content)
+                    if not self.response_started:
+                        match = assistant_pattern.search(content)
+                        if match:
+                            content = content[match.end():]
+                            self.response_started = True
+                        else:
+                            continue
+
+                    if content:   
+                        full_content.append(content)
+                        cleaned_content = self._clean_response(content)
+                        if cleaned_content:
+                            coalescer.push(cleaned_content)
+            finally:
+                coalescer.close()
 
             self._cleanup_hooks()
     
@@ -743,22 +774,4 @@ class QwenWorker(QObject):
 
     def _clean_response(self, text):
         """Clean response text by removing special tokens and emojis"""
-        text = re.sub(r'<\|[^|]+\|>', '', text)
-        emoji_pattern = re.compile(
-            "["
-            u"\U0001F600-\U0001F64F"  # Emoticons
-            u"\U0001F300-\U0001F5FF"  # Symbols & Pictographs
-            u"\U0001F680-\U0001F6FF"  # Transport & Map Symbols
-            u"\U0001F700-\U0001F77F"  # Alchemical Symbols
-            u"\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
-            u"\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
-            u"\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
-            u"\U0001FA00-\U0001FA6F"  # Chess Symbols
-            u"\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
-            u"\U00002702-\U000027B0"  # Dingbats
-            u"\U000024C2-\U0001F251"  # Enclosed Characters
-            "]+", flags=re.UNICODE
-        )
-        text = emoji_pattern.sub(r'', text)
-        
-        return text
\ No newline at end of file
+        return strip_tokens_and_emoji(text)
\ No newline at end of file
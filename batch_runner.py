@@ -0,0 +1,262 @@
+"""
+Headless batch generation over JSONL for CutieChatter (evals / regression checks)
+Ribuan prompt lewat jalur yang sama dengan OllamaWorker, concurrency dibatasi,
+bisa ke beberapa host Ollama (HostPool yang sama dengan aplikasi), dan bisa
+dilanjutkan (resume) setelah terhenti
+
+Usage:
+    python batch_runner.py prompts.jsonl results.jsonl [--model deepseek-r1:1.5b]
+        [--host http://localhost:11434 --host http://gpu-box:11434] [--concurrency 4]
+
+Input lines:  {"id": "q1", "messages": [{"role": "user", "content": "..."}], "model": "..."}
+              {"id": "q2", "prompt": "..."}           (id and model are optional)
+Output lines: {"id", "model", "host", "response", "ttft", "seconds", "eval_count",
+               "tokens_per_second", "error"}; rows without error are skipped on resume
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+
+from ollama_client import OLLAMA_HOST, HostPool, NoHealthyHostError, host_pool, chat_options, is_connection_error
+from prompts import SYSTEM_PROMPT
+from model_lifecycle import DEFAULT_MODEL, KEEP_ALIVE
+from think_parser import ThinkStreamParser
+from text_normalize import extract_answer
+
+# Configuration (environment overrides)
+BATCH_CONCURRENCY = int(os.getenv('CUTIE_BATCH_CONCURRENCY', 4))
+BATCH_RETRIES = int(os.getenv('CUTIE_BATCH_RETRIES', 2))
+BATCH_TIMEOUT = float(os.getenv('CUTIE_BATCH_TIMEOUT', 300))
+
+
+def load_jobs(path, default_model):
+    """Parse the input JSONL into job dicts (id, model, messages)"""
+    jobs = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            messages = record.get('messages')
+            if messages is None:
+                messages = [{'role': 'user', 'content': record['prompt']}]
+            if not messages or messages[0].get('role') != 'system':
+                messages = [{'role': 'system', 'content': SYSTEM_PROMPT}] + messages
+            jobs.append({
+                'id': str(record.get('id', f"line-{line_number}")),
+                'model': record.get('model') or default_model,
+                'messages': messages
+            })
+    return jobs
+
+
+def trim_partial_line(path):
+    """Drop a torn last line left by a killed run, so appends start on a fresh line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+
+def completed_ids(path):
+    """IDs already written without error (the output file is the checkpoint)"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not record.get('error'):
+                done.add(str(record.get('id')))
+    return done
+
+
+def make_pool(urls):
+    """--host URLs, else the OLLAMA_HOSTS pool, else the single default host (same routing as the app)"""
+    if urls:
+        return HostPool(urls)
+    if host_pool is not None:
+        return host_pool
+    return HostPool([OLLAMA_HOST])
+
+
+async def generate(client, job, num_threads=None):
+    """Stream one conversation like OllamaWorker does; returns the cleaned answer and timings"""
+    model = job['model']
+    started = time.perf_counter()
+    ttft = None
+    done_chunk = {}
+    raw = []
+    parser = ThinkStreamParser(starts_in_reasoning='deepseek' in model.lower())
+
+    stream = await client.chat(
+        model=model,
+        messages=job['messages'],
+        stream=True,
+        options=chat_options(model, num_threads),
+        keep_alive=KEEP_ALIVE
+    )
+    async for chunk in stream:
+        content = chunk.get('message', {}).get('content', '')
+        if content:
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            raw.append(content)
+            parser.feed(content)
+        if chunk.get('done', False):
+            done_chunk = chunk
+            break
+    parser.close()
+
+    # Same final answer as the GUI: text after </think>, else the heuristic cleaner
+    full_content = ''.join(raw)
+    response = parser.answer.strip() if parser.saw_answer else extract_answer(full_content)
+
+    eval_count = done_chunk.get('eval_count') or 0
+    eval_seconds = (done_chunk.get('eval_duration') or 0) / 1e9
+    return {
+        'response': response,
+        'ttft': round(ttft, 3) if ttft is not None else None,
+        'seconds': round(time.perf_counter() - started, 3),
+        'eval_count': eval_count,
+        'tokens_per_second': round(eval_count / eval_seconds, 2) if eval_seconds else None
+    }
+
+
+async def run_job(hosts, job, retries, timeout):
+    """Run one job, moving to another host on connection errors"""
+    tried = []
+    for attempt in range(retries + 1):
+        # With every other host tried (or down) retry the same one rather than give up
+        exclude = tried if hosts.has_alternative(job['model'], tried) else ()
+        try:
+            host = hosts.acquire(job['model'], exclude=exclude)
+        except NoHealthyHostError as e:
+            if attempt == retries:
+                return {'id': job['id'], 'model': job['model'], 'host': None, 'response': None, 'error': f"{type(e).__name__}: {e}"}
+            # Every host is cooling off; the pool's health check may bring one back
+            await asyncio.sleep(hosts.check_interval)
+            continue
+        error = None
+        try:
+            result = await asyncio.wait_for(generate(host.async_client, job), timeout=timeout)
+            return {'id': job['id'], 'model': job['model'], 'host': host.url, **result, 'error': None}
+        except Exception as e:
+            error = e
+            tried.append(host)
+            if not (is_connection_error(e) or isinstance(e, asyncio.TimeoutError)) or attempt == retries:
+                return {'id': job['id'], 'model': job['model'], 'host': host.url, 'response': None, 'error': f"{type(e).__name__}: {e}"}
+        finally:
+            hosts.release(host, error)
+
+
+async def run_batch(jobs, output_path, hosts, concurrency=BATCH_CONCURRENCY, retries=BATCH_RETRIES, timeout=BATCH_TIMEOUT):
+    """Run jobs with bounded concurrency, appending one flushed line per finished job"""
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+
+    results = []
+    started = time.perf_counter()
+    # First health check of every host is blocking HTTP
+    await asyncio.to_thread(hosts.start)
+
+    with open(output_path, 'a', encoding='utf-8') as out:
+        async def worker():
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await run_job(hosts, job, retries, timeout)
+                # Written as soon as it finishes: an interrupted run loses at most the jobs in flight
+                out.write(json.dumps(result, ensure_ascii=False) + '\n')
+                out.flush()
+                results.append(result)
+                status = '❌' if result['error'] else '✅'
+                print(f"{status} [{len(results)}/{len(jobs)}] {result['id']} ({result.get('seconds', '-')}s via {result['host']})")
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall_seconds):
+    """Aggregate timing stats for the finished jobs"""
+    ok = [r for r in results if not r['error']]
+
+    def percentile(values, q):
+        values = sorted(v for v in values if v is not None)
+        if not values:
+            return None
+        return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+    ttfts = [r['ttft'] for r in ok]
+    seconds = [r['seconds'] for r in ok]
+    rates = [r['tokens_per_second'] for r in ok if r['tokens_per_second']]
+    return {
+        'jobs': len(results),
+        'succeeded': len(ok),
+        'failed': len(results) - len(ok),
+        'wall_seconds': round(wall_seconds, 2),
+        'jobs_per_minute': round(len(ok) / wall_seconds * 60, 2) if wall_seconds else None,
+        'ttft_p50': percentile(ttfts, 0.5),
+        'ttft_p95': percentile(ttfts, 0.95),
+        'seconds_p50': percentile(seconds, 0.5),
+        'seconds_p95': percentile(seconds, 0.95),
+        'tokens_per_second_mean': round(statistics.mean(rates), 2) if rates else None,
+        'per_host': {host: sum(1 for r in ok if r['host'] == host) for host in {r['host'] for r in results}}
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run JSONL conversations through Ollama like OllamaWorker")
+    parser.add_argument('input', help="input JSONL (id, messages or prompt, optional model)")
+    parser.add_argument('output', help="output JSONL, appended to and used as the resume checkpoint")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help="model for lines without one")
+    parser.add_argument('--host', action='append', default=[], help="Ollama host (repeat for several; default OLLAMA_HOSTS)")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY, help="requests in flight in total")
+    parser.add_argument('--retries', type=int, default=BATCH_RETRIES, help="retries on connection errors / timeouts")
+    parser.add_argument('--timeout', type=float, default=BATCH_TIMEOUT, help="seconds per request")
+    parser.add_argument('--stats', help="write the summary JSON here as well")
+    args = parser.parse_args(argv)
+
+    jobs = load_jobs(args.input, args.model)
+    trim_partial_line(args.output)
+    done = completed_ids(args.output)
+    pending = [job for job in jobs if job['id'] not in done]
+    print(f"📦 {len(jobs)} jobs, {len(done)} already done, {len(pending)} to run")
+    if not pending:
+        return 0
+
+    hosts = make_pool(args.host)
+    print(f"🚀 Running on {len(hosts.hosts)} host(s) with concurrency {args.concurrency}")
+    try:
+        results, wall = asyncio.run(run_batch(pending, args.output, hosts, args.concurrency, args.retries, args.timeout))
+    except KeyboardInterrupt:
+        print(f"⏸️ Interrupted - rerun the same command to resume from {args.output}")
+        return 130
+    finally:
+        hosts.stop()
+
+    summary = summarize(results, wall)
+    print(json.dumps(summary, indent=2))
+    if args.stats:
+        with open(args.stats, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Throughput of EmotionClassifier.classify_batch at batch sizes 1-64 (CPU by default)
+
+Usage:
+    python benchmarks/bench_emotion_batch.py                       # local stardust_6 model
+    python benchmarks/bench_emotion_batch.py --model path/or/hub-id
+    python benchmarks/bench_emotion_batch.py --tiny                # random small BERT, fully offline
+
+Reports texts/second per batch size against batch size 1, then the
+MicroBatcher with concurrent callers against the same callers running one
+forward pass each.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+
+from sentiment.sentient import EmotionClassifier, CompositeDictionary  # noqa: E402
+from sentiment.batching import MicroBatcher  # noqa: E402
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "CoreDynamics", "models", "stardust_6")
+
+WORDS = (
+    "aku kamu hari ini senang sedih marah takut kaget sayang banget kok sih ya dong "
+    "i feel so happy sad angry scared surprised today my mom friend work school movie "
+    "rain sun night tired excited love hate miss you really very little bit again"
+).split()
+
+
+def make_texts(count, seed):
+    rng = random.Random(seed)
+    # Chat-like lengths: mostly short messages, some long replies
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.choice((4, 8, 12, 20, 40, 80)))) for _ in range(count)]
+
+
+def tiny_model():
+    """Random 4-layer BERT + word-level tokenizer, no download needed"""
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import BertConfig, BertForSequenceClassification, PreTrainedTokenizerFast
+
+    vocab = {token: i for i, token in enumerate(['[PAD]', '[UNK]'] + sorted(set(WORDS)))}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token='[UNK]'))
+    backend.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, pad_token='[PAD]', unk_token='[UNK]', model_max_length=512)
+    config = BertConfig(vocab_size=len(vocab), hidden_size=256, num_hidden_layers=4, num_attention_heads=4,
+                        intermediate_size=1024, num_labels=6)
+    return BertForSequenceClassification(config).eval(), tokenizer
+
+
+def load_model(path):
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(path, use_fast=True, model_max_length=512)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token or tokenizer.unk_token
+    model = AutoModelForSequenceClassification.from_pretrained(path, num_labels=6).eval()
+    return model, tokenizer
+
+
+def bench_batch_sizes(classifier, texts, sizes, repeat):
+    print(f"{'batch':>6} {'texts/s':>10} {'ms/batch':>10} {'speedup':>8}")
+    baseline = None
+    for size in sizes:
+        classifier.classify_batch(texts[:size], batch_size=size)  # warm-up
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for start in range(0, len(texts), size):
+                classifier.classify_batch(texts[start:start + size], batch_size=size)
+            best = min(best, time.perf_counter() - started)
+        rate = len(texts) / best
+        baseline = baseline or rate
+        print(f"{size:>6} {rate:>10.1f} {best / (len(texts) / size) * 1000:>10.2f} {rate / baseline:>7.1f}x")
+
+
+def bench_concurrent(classifier, texts, callers, wait_ms):
+    """`callers` threads classifying their share of texts one at a time"""
+    def run(classify):
+        shares = [texts[i::callers] for i in range(callers)]
+        threads = [threading.Thread(target=lambda share=share: [classify(text) for text in share]) for share in shares]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(texts) / (time.perf_counter() - started)
+
+    lock = threading.Lock()
+
+    def single(text):
+        with lock:  # one model, one forward pass at a time (as before batching)
+            return classifier.GetEmotionForClassification(text)
+
+    unbatched = run(single)
+    batcher = MicroBatcher(classifier.classify_batch, max_batch=64, max_wait_ms=wait_ms)
+    batched = run(batcher.classify)
+    stats = batcher.stats()
+    batcher.close()
+    print(f"{callers:>3} callers  per-call {unbatched:8.1f} texts/s   micro-batched {batched:8.1f} texts/s "
+          f"({batched / unbatched:4.1f}x, mean batch {stats['mean_batch']}, wait {wait_ms} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emotion classifier batch throughput")
+    parser.add_argument('--model', default=DEFAULT_MODEL, help="model directory or hub id")
+    parser.add_argument('--tiny', action='store_true', help="random small BERT instead of a real model (offline)")
+    parser.add_argument('--composites', action='store_true', help="score the composite emotions as well")
+    parser.add_argument('--texts', type=int, default=256, help="texts per measurement")
+    parser.add_argument('--sizes', default='1,2,4,8,16,32,64', help="comma-separated batch sizes")
+    parser.add_argument('--callers', default='1,4,16', help="concurrent callers for the MicroBatcher run")
+    parser.add_argument('--wait-ms', type=float, default=5.0, help="MicroBatcher collection window")
+    parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads")
+    parser.add_argument('--repeat', type=int, default=3, help="repeats per size (best is reported)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model, tokenizer = tiny_model() if args.tiny else load_model(args.model)
+    classifier = EmotionClassifier(model, tokenizer, torch.device('cpu'), composite_dictionary=CompositeDictionary if args.composites else None)
+    texts = make_texts(args.texts, args.seed)
+    print(f"{'tiny BERT' if args.tiny else args.model}: {len(texts)} texts, torch threads {torch.get_num_threads()}\n")
+
+    bench_batch_sizes(classifier, texts, [int(size) for size in args.sizes.split(',')], args.repeat)
+    print()
+    for callers in (int(count) for count in args.callers.split(',')):
+        bench_concurrent(classifier, texts, callers, args.wait_ms)
+
+
+if __name__ == '__main__':
+    main()
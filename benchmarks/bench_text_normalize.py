@@ -0,0 +1,169 @@
+"""
+Micro-benchmark: text_normalize vs the per-call regex pipelines it replaced
+
+Usage:
+    python benchmarks/bench_text_normalize.py [--chars 4000] [--repeat 3] [--number 10]
+
+Reports per-chunk cost (streaming display path) and per-message cost
+(storage / classifier / TTS / Qwen cleanup) on a long synthetic response.
+The legacy response_only is quadratic in the response length, so large
+--chars values take minutes (12000 chars ~ 0.5 s per legacy call).
+"""
+
+import os
+import re
+import sys
+import argparse
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import text_normalize  # noqa: E402
+
+
+# --- Legacy pipelines (as they were before text_normalize) -----------------
+
+def legacy_process_content(text):
+    processed = text.replace('\n', '<br>')
+    processed = re.sub(r'\*(.*?)\*', r'<em>\1</em>', processed)
+    processed = re.sub(r'<\s*/\s*div\s*>', '</think>', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'<\s*/\s*response\s*>', '</think>', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'<\s*/\s*button\s*>', '</think>', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'---', '</think>', processed)
+    processed = re.sub(r'<\s*/\s*br\s*>', '</think>', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'<\s*/\s*Compose\s*>', '</think>', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'<\s*think\s*>', '<span style="font-style: italic; font-weight: 200;">', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'<\s*/\s*think\s*>', '</span><br><br>', processed, flags=re.IGNORECASE)
+    processed = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', processed, flags=re.IGNORECASE)
+    return processed
+
+
+def legacy_response_only(text):
+    text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL | re.IGNORECASE)
+    text = re.sub(r'.*?</think>', '', text, flags=re.DOTALL)
+    text = re.sub(r'<\s*/\s*div\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/\s*br\s*>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/\s*response\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'---', '', text)
+    text = re.sub(r'<\s*think\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/\s*think\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', text, flags=re.IGNORECASE)
+    return text.strip()
+
+
+def legacy_naked_text(text):
+    text = re.sub(r'<\s*/\s*div\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/\s*response\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'---', '', text)
+    text = re.sub(r'<\s*think\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/\s*think\s*>', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', text, flags=re.IGNORECASE)
+    return text
+
+
+def legacy_qwen_clean(text):
+    text = re.sub(r'<\|[^|]+\|>', '', text)
+    emoji_pattern = re.compile(
+        "["
+        "\U0001F600-\U0001F64F"
+        "\U0001F300-\U0001F5FF"
+        "\U0001F680-\U0001F6FF"
+        "\U0001F700-\U0001F77F"
+        "\U0001F780-\U0001F7FF"
+        "\U0001F800-\U0001F8FF"
+        "\U0001F900-\U0001F9FF"
+        "\U0001FA00-\U0001FA6F"
+        "\U0001FA70-\U0001FAFF"
+        "\U00002702-\U000027B0"
+        "\U000024C2-\U0001F251"
+        "]+", flags=re.UNICODE
+    )
+    return emoji_pattern.sub(r'', text)
+
+
+def legacy_tts(text):
+    text = re.sub(r'<[^>]+>', '', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+# --- Workload ---------------------------------------------------------------
+
+def make_response(chars):
+    reasoning = "Hmm, the user greets me. Let me think about a *playful* reply.\n"
+    answer = "Halo! Aku senang banget ketemu kamu 😊 *senyum* --- ada yang bisa aku bantu? <|im_end|>\n"
+    body = ''
+    while len(body) < chars // 3:
+        body += reasoning
+    text = f"<think>\n{body}</think>\n\n"
+    while len(text) < chars:
+        text += answer
+    return text
+
+
+# Edge cases of the Qwen emoji class: range boundaries, CJK/Hangul inside
+# U+24C2..U+1F251, misc symbols, ZWJ sequences and special tokens
+QWEN_PARITY_CASES = (
+    "Halo 😊👋 <|im_start|>assistant<|im_end|>",
+    "\u24c2 \u2600 \u2764\ufe0f \u2702 \u27b0 \u27b1",
+    "\U0001F251 \U0001F252 \U0001FAFF \U0001FB00",
+    "你好 안녕 こんにちは Halo",
+    "👨\u200d👩\u200d👧 keluarga",
+    "<|endoftext|>plain ascii <b>tag</b> <|x|y|>",
+)
+
+
+def chunked(text, size=4):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def bench(label, legacy, current, payload, repeat, number):
+    legacy_time = min(timeit.repeat(lambda: legacy(payload), repeat=repeat, number=number)) / number
+    current_time = min(timeit.repeat(lambda: current(payload), repeat=repeat, number=number)) / number
+    print(f"{label:<34} legacy {legacy_time * 1e6:10.1f} us   new {current_time * 1e6:10.1f} us   x{legacy_time / current_time:5.1f}")
+
+
+def bench_chunks(label, legacy, current, chunks, repeat):
+    def run(fn):
+        for chunk in chunks:
+            fn(chunk)
+    legacy_time = min(timeit.repeat(lambda: run(legacy), repeat=repeat, number=1)) / len(chunks)
+    current_time = min(timeit.repeat(lambda: run(current), repeat=repeat, number=1)) / len(chunks)
+    print(f"{label:<34} legacy {legacy_time * 1e6:10.2f} us   new {current_time * 1e6:10.2f} us   x{legacy_time / current_time:5.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text_normalize against the legacy regex pipelines")
+    parser.add_argument('--chars', type=int, default=4000, help="length of the synthetic response")
+    parser.add_argument('--repeat', type=int, default=3, help="timeit repeats (best is reported)")
+    parser.add_argument('--number', type=int, default=10, help="calls per timeit repeat for the per-message rows")
+    args = parser.parse_args()
+
+    response = make_response(args.chars)
+    chunks = chunked(response)
+    print(f"Response: {len(response)} chars, {len(chunks)} chunks of 4 chars\n")
+
+    print("Per chunk (streaming display path)")
+    bench_chunks("  process_content / to_display", legacy_process_content, text_normalize.to_display, chunks, args.repeat)
+    bench_chunks("  _clean_response / strip_tokens", legacy_qwen_clean, text_normalize.strip_tokens_and_emoji, chunks, args.repeat)
+
+    print("\nPer message")
+    number = args.number
+    bench("  process_content / to_display", legacy_process_content, text_normalize.to_display, response, args.repeat, number)
+    bench("  response_only / to_storage", legacy_response_only, text_normalize.to_storage, response, args.repeat, number)
+    bench("  naked_text / strip_markers", legacy_naked_text, text_normalize.strip_markers, response, args.repeat, number)
+    bench("  _preprocess_text / to_tts", legacy_tts, text_normalize.to_tts, response, args.repeat, number)
+    bench("  _clean_response / strip_tokens", legacy_qwen_clean, text_normalize.strip_tokens_and_emoji, response, args.repeat, number)
+
+    # Output parity on the workload where behaviour is meant to be identical
+    print("\nParity")
+    print(f"  to_storage == response_only:    {text_normalize.to_storage(response) == legacy_response_only(response)}")
+    print(f"  strip_markers == naked_text:    {text_normalize.strip_markers(response) == legacy_naked_text(response)}")
+    print(f"  to_display == process_content:  {text_normalize.to_display(response) == legacy_process_content(response)}")
+    print(f"  strip_tokens == _clean_response: {text_normalize.strip_tokens_and_emoji(response) == legacy_qwen_clean(response)}")
+    for case in QWEN_PARITY_CASES:
+        same = text_normalize.strip_tokens_and_emoji(case) == legacy_qwen_clean(case)
+        print(f"    {ascii(case):<56} {same}")
+
+
+if __name__ == '__main__':
+    main()
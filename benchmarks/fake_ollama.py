@@ -0,0 +1,340 @@
+"""
+Offline stand-in for the Ollama HTTP API (benchmarks / CI, no model needed)
+
+Usage:
+    python benchmarks/fake_ollama.py [--port 11435] [--prefill 0.3] [--tps 40]
+        [--think-tokens 60] [--answer-tokens 40] [--error-rate 0.0] [--drop-rate 0.0]
+
+    OLLAMA_HOST=http://127.0.0.1:11435 python backend2.py
+
+Implements the streaming NDJSON formats of /api/chat and /api/generate
+(including the final chunk with eval_count / eval_duration / prompt_eval_duration
+and the generate API's context), plus /api/tags, /api/ps and /api/version.
+Generation is simulated: a prefill delay (fixed + per prompt token), then tokens at
+a fixed rate, an optional reasoning block (<think>...</think>) before the answer,
+and injected failures (HTTP 500 before the stream or a dropped connection mid-stream).
+Slots limits how many generations run at once; the rest wait like in Ollama's queue.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+THINK_WORDS = ("hmm", "the", "user", "wants", "a", "playful", "reply", "let", "me", "think", "about", "it")
+ANSWER_WORDS = ("halo", "aku", "senang", "ketemu", "kamu", "ada", "yang", "bisa", "aku", "bantu", "hari", "ini")
+
+
+@dataclass
+class FakeConfig:
+    """Simulated model behaviour (all delays in seconds)"""
+    prefill: float = 0.3               # fixed time to first token
+    prefill_per_token: float = 0.0005  # extra prefill per prompt token
+    load: float = 0.0                  # one-off load time of a model on first use
+    tokens_per_second: float = 40.0
+    think_tokens: int = 60             # reasoning tokens before </think> (0 = no reasoning block)
+    answer_tokens: int = 40
+    error_rate: float = 0.0            # probability of HTTP 500 before streaming
+    drop_rate: float = 0.0             # probability of dropping the connection mid-stream
+    slots: int = 1                     # generations in parallel (OLLAMA_NUM_PARALLEL)
+    models: tuple = ("deepseek-r1:1.5b", "llama3.2:1b")
+    seed: int = None
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _prompt_tokens(body):
+    """Rough prompt size: words of every message / prompt / system"""
+    text = ' '.join(m.get('content', '') for m in body.get('messages') or [])
+    text += ' ' + (body.get('prompt') or '') + ' ' + (body.get('system') or '')
+    return len(text.split()) + len(body.get('context') or [])
+
+
+def _tokens(config, rng):
+    """Token pieces of one response: optional reasoning block, then the answer"""
+    pieces = []
+    if config.think_tokens > 0:
+        pieces.append("<think>\n")
+        pieces += [rng.choice(THINK_WORDS) + ' ' for _ in range(config.think_tokens)]
+        pieces.append("\n</think>\n\n")
+    pieces += [rng.choice(ANSWER_WORDS) + ' ' for _ in range(config.answer_tokens)]
+    return pieces
+
+
+class FakeOllama:
+    """Threaded fake Ollama server; start() returns the base URL"""
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or FakeConfig()
+        self.rng = random.Random(self.config.seed)
+        self.rng_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max(1, self.config.slots))
+        self.loaded = set()
+        self.stats = {'requests': 0, 'errors_injected': 0, 'drops_injected': 0, 'disconnects': 0}
+        self.stats_lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def roll(self, probability):
+        with self.rng_lock:
+            return probability > 0 and self.rng.random() < probability
+
+    def drop_point(self, length):
+        """Token index at which to drop the connection, or None"""
+        if not length or not self.roll(self.config.drop_rate):
+            return None
+        with self.rng_lock:
+            return self.rng.randrange(length)
+
+    def response_tokens(self):
+        with self.rng_lock:
+            return _tokens(self.config, self.rng)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(_FakeOllamaHandler):
+            server_state = fake
+
+        return Handler
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive + chunked, like Ollama
+    server_state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- plumbing ---------------------------------------------------------
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + '\n').encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    # --- endpoints --------------------------------------------------------
+
+    def do_GET(self):
+        fake = self.server_state
+        if self.path == '/api/tags':
+            self._send_json({'models': [
+                {'name': name, 'model': name, 'modified_at': _now(), 'size': 1_000_000_000, 'digest': f"fake-{i}",
+                 'details': {'format': 'gguf', 'family': name.split(':')[0], 'parameter_size': '1.5B', 'quantization_level': 'Q4_K_M'}}
+                for i, name in enumerate(fake.config.models)
+            ]})
+        elif self.path == '/api/ps':
+            self._send_json({'models': [{'name': name, 'model': name, 'size': 1_000_000_000} for name in sorted(fake.loaded)]})
+        elif self.path == '/api/version':
+            self._send_json({'version': '0.0.0-fake'})
+        elif self.path in ('/', ''):
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        if self.path == '/api/chat':
+            self._generate(chat=True)
+        elif self.path == '/api/generate':
+            self._generate(chat=False)
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def _generate(self, chat):
+        fake = self.server_state
+        config = fake.config
+        body = self._read_body()
+        model = body.get('model', '')
+        fake.count('requests')
+
+        if model not in config.models:
+            self._send_json({'error': f"model '{model}' not found"}, 404)
+            return
+        if fake.roll(config.error_rate):
+            fake.count('errors_injected')
+            self._send_json({'error': 'injected failure'}, 500)
+            return
+
+        stream = body.get('stream', True)
+        started = time.perf_counter()
+        with fake.slots:
+            load_seconds = 0.0
+            if model not in fake.loaded:
+                time.sleep(config.load)
+                load_seconds = config.load
+                fake.loaded.add(model)
+
+            # Warm-up call (generate with an empty prompt): load only, no tokens
+            if not chat and not body.get('prompt'):
+                self._send_json({'model': model, 'created_at': _now(), 'response': '', 'done': True,
+                                 'done_reason': 'load', 'load_duration': int(load_seconds * 1e9)})
+                return
+
+            prompt_tokens = _prompt_tokens(body)
+            prefill = config.prefill + config.prefill_per_token * prompt_tokens
+            time.sleep(prefill)
+
+            pieces = fake.response_tokens()
+            num_predict = (body.get('options') or {}).get('num_predict')
+            if num_predict and num_predict > 0:
+                pieces = pieces[:num_predict]
+            interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+            drop_at = fake.drop_point(len(pieces))
+
+            try:
+                if stream:
+                    self._start_stream()
+                eval_started = time.perf_counter()
+                for i, piece in enumerate(pieces):
+                    if i == drop_at:
+                        fake.count('drops_injected')
+                        self.close_connection = True
+                        self.connection.shutdown(2)  # socket.SHUT_RDWR
+                        return
+                    time.sleep(interval)
+                    if stream:
+                        self._write_chunk(self._frame(chat, model, piece, False))
+                eval_seconds = time.perf_counter() - eval_started
+
+                done = self._frame(chat, model, '' if stream else ''.join(pieces), True)
+                done.update({
+                    'done_reason': 'length' if num_predict and len(pieces) >= num_predict else 'stop',
+                    'total_duration': int((time.perf_counter() - started) * 1e9),
+                    'load_duration': int(load_seconds * 1e9),
+                    'prompt_eval_count': prompt_tokens,
+                    'prompt_eval_duration': int(prefill * 1e9),
+                    'eval_count': len(pieces),
+                    'eval_duration': int(eval_seconds * 1e9)
+                })
+                if not chat:
+                    done['context'] = list(body.get('context') or []) + list(range(prompt_tokens + len(pieces)))
+                if stream:
+                    self._write_chunk(done)
+                    self._end_stream()
+                else:
+                    self._send_json(done)
+            except (BrokenPipeError, ConnectionResetError):
+                # Client went away (stop button / disconnect): Ollama aborts the generation too
+                fake.count('disconnects')
+                self.close_connection = True
+
+    @staticmethod
+    def _frame(chat, model, text, done):
+        if chat:
+            return {'model': model, 'created_at': _now(), 'message': {'role': 'assistant', 'content': text}, 'done': done}
+        return {'model': model, 'created_at': _now(), 'response': text, 'done': done}
+
+
+def add_config_arguments(parser):
+    """CLI flags for FakeConfig (shared with loadtest.py)"""
+    defaults = FakeConfig()
+    parser.add_argument('--prefill', type=float, default=defaults.prefill, help="seconds before the first token")
+    parser.add_argument('--prefill-per-token', type=float, default=defaults.prefill_per_token, help="extra prefill seconds per prompt token")
+    parser.add_argument('--load', type=float, default=defaults.load, help="one-off model load seconds")
+    parser.add_argument('--tps', type=float, default=defaults.tokens_per_second, help="generated tokens per second")
+    parser.add_argument('--think-tokens', type=int, default=defaults.think_tokens, help="reasoning tokens (0 = no <think> block)")
+    parser.add_argument('--answer-tokens', type=int, default=defaults.answer_tokens, help="answer tokens")
+    parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help="probability of HTTP 500")
+    parser.add_argument('--drop-rate', type=float, default=defaults.drop_rate, help="probability of a dropped stream")
+    parser.add_argument('--slots', type=int, default=defaults.slots, help="generations in parallel")
+    parser.add_argument('--serve-model', action='append', default=[], help="model name to serve (repeatable)")
+    parser.add_argument('--seed', type=int, default=None, help="random seed for tokens and injected failures")
+
+
+def config_from_args(args):
+    return FakeConfig(
+        prefill=args.prefill,
+        prefill_per_token=args.prefill_per_token,
+        load=args.load,
+        tokens_per_second=args.tps,
+        think_tokens=args.think_tokens,
+        answer_tokens=args.answer_tokens,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        slots=args.slots,
+        models=tuple(args.serve_model) or FakeConfig.models,
+        seed=args.seed
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake Ollama server for offline benchmarks")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama(config_from_args(args), args.host, args.port)
+    print(f"🧪 Fake Ollama on {fake.url} serving {', '.join(fake.config.models)}")
+    print(f"   OLLAMA_HOST={fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        print(f"📊 {json.dumps(fake.stats)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
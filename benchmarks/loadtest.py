@@ -0,0 +1,280 @@
+"""
+Concurrency load test for the backend2 /chat endpoint (SSE streaming)
+
+Usage:
+    # Fully offline (CI): fake Ollama + backend2 are started for the run
+    python benchmarks/loadtest.py --spawn --sessions 16 --turns 3 --tps 80 --slots 2
+
+    # Against a running backend2 (real or fake Ollama behind it)
+    python benchmarks/loadtest.py --url http://localhost:8000 --sessions 8 --turns 5
+
+N sessions run concurrently, each sending `turns` messages one after another
+(server-side session history with --server-sessions, else the history is uploaded).
+Reports TTFT (first content frame), request time, queue frames, 429s and
+throughput percentiles; --max-error-rate turns it into a CI gate.
+Only the standard library is used on the client side.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import FakeOllama, add_config_arguments, config_from_args  # noqa: E402
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROMPTS = (
+    "Halo! Apa kabar hari ini?",
+    "Ceritakan lelucon singkat dong",
+    "Aku lagi sedih, hibur aku ya",
+    "Apa rekomendasi film untuk akhir pekan?",
+    "Jelaskan cara kerja fotosintesis dengan singkat",
+    "Tulis puisi pendek tentang hujan",
+)
+
+
+def percentile(values, q):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def chat_request(base_url, payload, timeout):
+    """One streamed /chat call; returns the per-request record"""
+    parts = urlsplit(base_url)
+    record = {'status': 'ok', 'http_status': None, 'ttft': None, 'seconds': None, 'chars': 0,
+              'queue_frames': 0, 'max_queue_position': 0, 'history': None, 'error': None}
+    started = time.perf_counter()
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    try:
+        conn.request('POST', '/chat', body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        record['http_status'] = response.status
+        if response.status != 200:
+            record['status'] = 'rejected' if response.status == 429 else 'http_error'
+            record['error'] = response.read().decode(errors='replace')[:200]
+            return record
+
+        while True:
+            line = response.readline()
+            if not line:
+                break
+            line = line.decode('utf-8', errors='replace').strip()
+            if not line.startswith('data: '):
+                continue
+            data = line[6:]
+            if data == '[DONE]':
+                break
+            frame = json.loads(data)
+            if 'error' in frame:
+                record['status'] = 'error'
+                record['error'] = frame['error']
+            elif frame.get('type') == 'queue':
+                record['queue_frames'] += 1
+                record['max_queue_position'] = max(record['max_queue_position'], frame.get('position') or 0)
+            elif frame.get('type') in ('history_update', 'history_delta'):
+                record['history'] = frame
+            elif 'content' in frame:
+                if record['ttft'] is None:
+                    record['ttft'] = time.perf_counter() - started
+                record['chars'] += len(frame['content'])
+        if record['status'] == 'ok' and record['history'] is None:
+            # Stream ended without the history frame: treat as a broken response
+            record['status'] = 'incomplete'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        record['seconds'] = time.perf_counter() - started
+        conn.close()
+    return record
+
+
+def run_session(index, args, results, lock, rng):
+    """One user: `turns` messages in a row, carrying the conversation forward"""
+    session_id = f"load-{uuid.uuid4().hex[:12]}" if args.server_sessions else None
+    history = []
+    for turn in range(args.turns):
+        message = f"{rng.choice(PROMPTS)} (sesi {index}, pesan {turn + 1})"
+        payload = {
+            'message': message,
+            'model': args.model,
+            'stream': True,
+            'max_tokens': args.max_tokens,
+            'session_id': session_id,
+            'conversation_history': [] if session_id else history
+        }
+        record = chat_request(args.url, payload, args.timeout)
+        frame = record.pop('history')
+        if frame and frame.get('type') == 'history_update':
+            history = frame.get('history', history)
+        record.update({'session': index, 'turn': turn + 1})
+        with lock:
+            results.append(record)
+            done = len(results)
+        if args.verbose:
+            ttft = f"{record['ttft']:.3f}s" if record['ttft'] is not None else '-'
+            print(f"{'✅' if record['status'] == 'ok' else '❌'} [{done}] session {index} turn {turn + 1}: "
+                  f"{record['status']} ttft {ttft} total {record['seconds']:.3f}s")
+        if record['status'] == 'rejected' and args.think_time <= 0:
+            time.sleep(0.5)  # back off on 429 like a client honouring Retry-After
+        if args.think_time > 0:
+            time.sleep(rng.uniform(0, args.think_time))
+
+
+def run_load(args):
+    results = []
+    lock = threading.Lock()
+    seed_rng = random.Random(args.seed)
+    threads = []
+    started = time.perf_counter()
+    for index in range(args.sessions):
+        thread = threading.Thread(
+            target=run_session,
+            args=(index, args, results, lock, random.Random(seed_rng.random())),
+            daemon=True
+        )
+        threads.append(thread)
+        thread.start()
+        if args.ramp > 0:
+            time.sleep(args.ramp / args.sessions)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall_seconds):
+    ok = [r for r in results if r['status'] == 'ok']
+    statuses = {}
+    for r in results:
+        statuses[r['status']] = statuses.get(r['status'], 0) + 1
+    ttfts = [r['ttft'] for r in ok]
+    seconds = [r['seconds'] for r in ok]
+    chars = sum(r['chars'] for r in ok)
+    return {
+        'requests': len(results),
+        'succeeded': len(ok),
+        'statuses': statuses,
+        'error_rate': round(1 - len(ok) / len(results), 4) if results else None,
+        'wall_seconds': round(wall_seconds, 3),
+        'requests_per_second': round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        'chars_per_second': round(chars / wall_seconds, 1) if wall_seconds else None,
+        'ttft_p50': percentile(ttfts, 0.5),
+        'ttft_p95': percentile(ttfts, 0.95),
+        'ttft_p99': percentile(ttfts, 0.99),
+        'seconds_p50': percentile(seconds, 0.5),
+        'seconds_p95': percentile(seconds, 0.95),
+        'seconds_p99': percentile(seconds, 0.99),
+        'queued_requests': sum(1 for r in results if r['queue_frames']),
+        'max_queue_position': max((r['max_queue_position'] for r in results), default=0),
+        'errors': sorted({r['error'] for r in results if r['error']})[:5]
+    }
+
+
+def wait_for_health(url, timeout):
+    """Poll /health until backend2 answers (its lifespan checks Ollama first)"""
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=2)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def spawn_backend(ollama_url, port, cache):
+    """Start backend2 under uvicorn, pointed at the fake Ollama"""
+    env = dict(os.environ, OLLAMA_HOST=ollama_url, CUTIE_RESPONSE_CACHE='1' if cache else '0')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'backend2:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=REPO_ROOT,
+        env=env
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent /chat load test with TTFT / throughput percentiles")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="backend2 base URL (ignored with --spawn)")
+    parser.add_argument('--spawn', action='store_true', help="start a fake Ollama and backend2 for this run (offline)")
+    parser.add_argument('--cache', action='store_true', help="keep the response cache on in the spawned backend")
+    parser.add_argument('--sessions', type=int, default=8, help="concurrent sessions")
+    parser.add_argument('--turns', type=int, default=3, help="messages per session")
+    parser.add_argument('--model', default='deepseek-r1:1.5b')
+    parser.add_argument('--max-tokens', type=int, default=512)
+    parser.add_argument('--server-sessions', action='store_true', help="use server-side session history (session_id)")
+    parser.add_argument('--ramp', type=float, default=0.0, help="seconds over which sessions are started")
+    parser.add_argument('--think-time', type=float, default=0.0, help="max random pause between turns")
+    parser.add_argument('--timeout', type=float, default=120.0, help="seconds per request")
+    parser.add_argument('--startup-timeout', type=float, default=60.0, help="seconds to wait for the spawned backend")
+    parser.add_argument('--max-error-rate', type=float, default=None, help="exit 1 if the error rate is higher (CI gate)")
+    parser.add_argument('--json', help="write the summary JSON here as well")
+    parser.add_argument('--verbose', action='store_true', help="one line per request")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    fake = backend = None
+    try:
+        if args.spawn:
+            config = config_from_args(args)
+            if args.model not in config.models:
+                config.models = config.models + (args.model,)
+            fake = FakeOllama(config)
+            ollama_url = fake.start()
+            port = free_port()
+            args.url = f"http://127.0.0.1:{port}"
+            print(f"🧪 Fake Ollama on {ollama_url}, backend2 on {args.url}")
+            backend = spawn_backend(ollama_url, port, args.cache)
+            if not wait_for_health(args.url, args.startup_timeout):
+                print("❌ backend2 did not become healthy")
+                return 2
+
+        print(f"🚀 {args.sessions} sessions x {args.turns} turns against {args.url} ({args.model})")
+        results, wall = run_load(args)
+        summary = summarize(results, wall)
+        if fake is not None:
+            summary['fake_ollama'] = dict(fake.stats)
+        print(json.dumps(summary, indent=2))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+
+        if args.max_error_rate is not None and (summary['error_rate'] or 0) > args.max_error_rate:
+            print(f"❌ Error rate {summary['error_rate']} above {args.max_error_rate}")
+            return 1
+        return 0
+    finally:
+        if backend is not None:
+            backend.terminate()
+            try:
+                backend.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                backend.kill()
+        if fake is not None:
+            fake.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Cooperative cancellation for generations in CutieChatter
+Stop token dicek di antara chunk; stream HTTP ditutup supaya Ollama langsung
+berhenti generate dan slot model bebas
+"""
+
+import os
+import asyncio
+import threading
+
+# Configuration (environment overrides)
+DISCONNECT_POLL_INTERVAL = float(os.getenv('CUTIE_DISCONNECT_POLL', 0.25))
+STOP_POLL_INTERVAL = 0.05
+
+
+class StopToken:
+    """Thread-safe stop flag shared by a generation and whoever may cancel it"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def stop(self, reason="stopped"):
+        """Request a stop; safe from any thread, only the first reason is kept"""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def stopped(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    async def wait_async(self):
+        """Resolve once stop() was called (from any thread)"""
+        while not self._event.is_set():
+            await asyncio.sleep(STOP_POLL_INTERVAL)
+        return self.reason
+
+
+def close_stream(stream):
+    """Close a streaming response; the dropped connection makes Ollama abort generation"""
+    close = getattr(stream, 'close', None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def iter_until_stopped(stream, token):
+    """Yield from a sync stream until token is stopped, then close the stream"""
+    try:
+        for chunk in stream:
+            if token.stopped:
+                break
+            yield chunk
+            if token.stopped:
+                break
+    finally:
+        close_stream(stream)
+
+
+async def watch_disconnect(http_request, token, interval=DISCONNECT_POLL_INTERVAL):
+    """Stop token as soon as the HTTP client goes away (runs as a background task)"""
+    while not token.stopped:
+        if await http_request.is_disconnected():
+            token.stop("client disconnected")
+            return
+        await asyncio.sleep(interval)
+
+
+async def aclose_stream(iterator, pending=None):
+    """Cancel a pending __anext__() and close an async stream, even from a cancelled task
+
+    aclose() raises "asynchronous generator is already running" while a read is
+    still in flight, so the read is cancelled and awaited first. The cleanup runs
+    as its own shielded task: a cancel scope re-cancels the caller at every await,
+    and the stream still gets closed after the caller's CancelledError propagates.
+    """
+    async def close():
+        if pending is not None:
+            if not pending.done():
+                # Let the source see the cancellation before closing it
+                pending.cancel()
+            try:
+                await pending
+            except BaseException:
+                pass
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
+
+    task = asyncio.ensure_future(close())
+    task.add_done_callback(_consume_close_error)
+    await asyncio.shield(task)
+
+
+def _consume_close_error(task):
+    """Retrieve a cleanup failure so it is never reported as unretrieved"""
+    if not task.cancelled():
+        task.exception()
@@ -1,6 +1,6 @@
 # web_ui/chat_bridge.py
 
-from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot, QThread
+from PyQt6.QtCore import QObject, pyqtSignal, pyqtSlot
 import json
 import sys
 import os
@@ -10,6 +10,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 try:
     from backends import OllamaWorker
+    from generation_pool import GenerationPool
     BACKENDS_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Could not import OllamaWorker from backends: {e}")
@@ -30,9 +31,24 @@ class ChatBridge(QObject):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent_app = parent
-        self.ollama_worker = None
-        self.ollama_thread = None
-        self.is_streaming = False
+        self.job_id = None
+        self.job_model = None
+        self._pool = None
+    
+    @property
+    def generation_pool(self):
+        """The app's shared generation pool, or a private one for standalone use"""
+        pool = getattr(self.parent_app, 'generation_pool', None)
+        if pool is not None:
+            return pool
+        if self._pool is None:
+            self._pool = GenerationPool(parent=self)
+        return self._pool
+    
+    @property
+    def is_streaming(self):
+        # This bridge drives one conversation history, so one job at a time
+        return self.job_id is not None and self.generation_pool.is_active(self.job_id)
         
     @pyqtSlot(str)
     def sendMessage(self, message):
@@ -68,69 +84,61 @@ class ChatBridge(QObject):
                 'content': message
             })
             
-            # Sentiment analysis if available
-            if hasattr(self.parent_app, 'classifier') and self.parent_app.classifier:
-                try:
-                    sentiment = self.parent_app.GetSentimentOnPrimary(message)
-                    print(f"📊 User sentiment: {sentiment}")
-                    self.parent_app.user_text_metadata.append(message)
-                    self.parent_app.user_features_metadata.append(sentiment)
-                except Exception as e:
-                    print(f"Sentiment analysis error: {e}")
+            # Sentiment analysis if available, in the background so streaming starts right away
+            user_sentiment = None
+            if hasattr(self.parent_app, 'analyze_turn_async'):
+                user_sentiment = self.parent_app.analyze_turn_async(message, 'user')
             
             # Start Ollama streaming
-            self.startOllamaStreaming()
+            self.startOllamaStreaming(user_sentiment)
             
         except Exception as e:
             print(f"❌ Error in processMessageStreaming: {e}")
             self.errorOccurred.emit(str(e))
             self.streamFinished.emit("")
     
-    def startOllamaStreaming(self):
+    def startOllamaStreaming(self, user_sentiment=None):
         """Start Ollama worker for streaming response"""
         try:
-            # Stop existing worker if any
-            if self.ollama_thread and self.ollama_thread.isRunning():
-                print("🛑 Stopping existing thread...")
-                self.ollama_thread.quit()
-                self.ollama_thread.wait(2000)
-            
-            # Disconnect previous signals
-            if self.ollama_worker:
-                try:
-                    self.ollama_worker.chunk_received.disconnect()
-                    self.ollama_worker.finished.disconnect()
-                except:
-                    pass
-            
-            self.is_streaming = True
-            
-            # Create new worker and thread
-            self.ollama_thread = QThread()
-            self.ollama_worker = OllamaWorker(
+            # Cancel an existing job if any (closes its Ollama stream, nothing more is delivered)
+            if self.job_id is not None and self.generation_pool.cancel(self.job_id):
+                print("🛑 Cancelled existing generation")
+            self.job_id = None
+            
+            history = self.parent_app.conversation_history
+            if hasattr(self.parent_app, 'context_window'):
+                history = self.parent_app.context_window.build(history)
+            if hasattr(self.parent_app, 'condition_on_sentiment'):
+                history = self.parent_app.condition_on_sentiment(history, user_sentiment)
+            
+            # Under --model auto the router picks the model; the summary reuses that pick
+            self.job_model = (
+                self.parent_app.resolve_model(self.parent_app.conversation_history[-1]['content'])
+                if hasattr(self.parent_app, 'resolve_model') else self.parent_app.model_name
+            )
+            worker = OllamaWorker(
                 self.parent_app.conversation_history[-1]['content'],
-                self.parent_app.conversation_history.copy(),
-                self.parent_app.model_name
+                history,
+                self.job_model
             )
             
-            # Move worker to thread
-            self.ollama_worker.moveToThread(self.ollama_thread)
-            
-            # Connect signals
-            self.ollama_worker.chunk_received.connect(self.onChunkReceived)
-            self.ollama_worker.finished.connect(self.onResponseComplete)
-            self.ollama_thread.started.connect(self.ollama_worker.run)
-            
-            # Start thread
-            self.ollama_thread.start()
+            # Persistent pool thread; chunks and the result come back on the GUI thread
+            self.job_id = self.generation_pool.submit(worker, self.onChunkReceived, self.onResponseComplete)
             print("🚀 Ollama streaming started")
             
         except Exception as e:
             print(f"❌ Error starting Ollama: {e}")
-            self.is_streaming = False
+            self.job_id = None
             self.errorOccurred.emit(str(e))
             self.streamFinished.emit("")
     
+    @pyqtSlot()
+    def stopGeneration(self):
+        """Stop button from JavaScript: the worker finishes with the partial answer"""
+        if self.is_streaming:
+            print("🛑 Stop requested")
+            self.generation_pool.stop(self.job_id)
+    
     def onChunkReceived(self, chunk):
         """Handle chunk received from Ollama"""
         # Emit to JavaScript
@@ -142,30 +150,24 @@ class ChatBridge(QObject):
             # Clean response
             cleaned_response = self.cleanResponse(full_response)
             
-            # Add to conversation history
-            self.parent_app.conversation_history.append({
-                'role': 'assistant',
-                'content': cleaned_response
-            })
-            
-            # Sentiment analysis for AI response
-            if hasattr(self.parent_app, 'classifier') and self.parent_app.classifier:
-                try:
-                    ai_sentiment = self.parent_app.GetSentimentOnPrimary(cleaned_response)
-                    print(f"🤖 AI sentiment: {ai_sentiment}")
-                    self.parent_app.ai_text_metadata.append(cleaned_response)
-                    self.parent_app.ai_features_metadata.append(ai_sentiment)
-                except Exception as e:
-                    print(f"AI sentiment analysis error: {e}")
-            
-            # Clean up thread
-            if self.ollama_thread:
-                self.ollama_thread.quit()
-                self.ollama_thread.wait()
-                self.ollama_thread = None
-            
-            self.ollama_worker = None
-            self.is_streaming = False
+            # Add to conversation history (a response stopped before any answer adds nothing)
+            if cleaned_response.strip():
+                self.parent_app.conversation_history.append({
+                    'role': 'assistant',
+                    'content': cleaned_response
+                })
+            if hasattr(self.parent_app, 'context_window'):
+                self.parent_app.context_window.refresh_summary(
+                    self.parent_app.conversation_history,
+                    self.job_model or self.parent_app.model_name
+                )
+            
+            # Sentiment analysis for AI response (background)
+            if hasattr(self.parent_app, 'analyze_turn_async'):
+                self.parent_app.analyze_turn_async(cleaned_response, 'ai')
+            
+            # The pool already released the job; its thread is free, nothing to join
+            self.job_id = None
             
             # Emit finished signal
             self.streamFinished.emit(cleaned_response)
@@ -173,7 +175,7 @@ class ChatBridge(QObject):
             
         except Exception as e:
             print(f"❌ Error in response completion: {e}")
-            self.is_streaming = False
+            self.job_id = None
             self.errorOccurred.emit(str(e))
     
     def cleanResponse(self, text):
@@ -190,13 +192,21 @@ class ChatBridge(QObject):
                 "model_name": self.parent_app.model_name if self.parent_app else "unknown",
                 "dark_theme": self.parent_app.is_dark_theme if hasattr(self.parent_app, 'is_dark_theme') else True,
                 "backends_available": BACKENDS_AVAILABLE,
-                "sentiment_available": hasattr(self.parent_app, 'classifier') and self.parent_app.classifier is not None
+                "sentiment_available": hasattr(self.parent_app, 'classifier') and self.parent_app.classifier is not None,
+                "models": self._model_states()
             }
             return json.dumps(info)
         except Exception as e:
             print(f"Error getting system info: {e}")
             return json.dumps({"error": str(e)})
     
+    def _model_states(self):
+        """Warm/cold state of the Ollama models used by this app"""
+        if not BACKENDS_AVAILABLE:
+            return {}
+        from model_lifecycle import model_lifecycle
+        return model_lifecycle.status()
+    
     @pyqtSlot()
     def toggleTheme(self):
         """Toggle theme from JavaScript"""
@@ -0,0 +1,184 @@
+"""
+Token-budgeted sliding context window for CutieChatter
+System prompt tetap di-pin, turn terbaru dimasukkan sesuai budget token,
+turn lama diganti ringkasan (rolling summary) yang dihitung di background
+"""
+
+import os
+import re
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CUTIE_CONTEXT_TOKENS', 1536))
+SUMMARY_MAX_TOKENS = int(os.getenv('CUTIE_SUMMARY_TOKENS', 160))
+MESSAGE_OVERHEAD_TOKENS = 4  # role / separator tokens per chat message
+TOKEN_CACHE_SIZE = 4096
+
+_THINK_BLOCK = re.compile(r'<think>.*?</think>', re.DOTALL | re.IGNORECASE)
+
+SUMMARY_INSTRUCTION = (
+    "Summarize the conversation below in at most 5 short sentences. "
+    "Keep names, facts, preferences and open questions. Reply with the summary only."
+)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token) when no tokenizer is available"""
+    return len(text) // 4 + 1
+
+
+class ContextWindow:
+    """Builds the message list sent to Ollama within a token budget"""
+
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, token_counter=estimate_tokens):
+        self.token_budget = token_budget
+        self.token_counter = token_counter
+        self._token_cache = {}
+        self._lock = threading.Lock()
+        self._summary = ''
+        self._summarized_upto = 0        # number of turns covered by the summary
+        self._summarized_fingerprint = None
+        self._dropped = 0                 # turns left out by the last build()
+        self._epoch = 0                   # bumped on reset so stale summaries are discarded
+        self._summary_thread = None
+
+    def count_tokens(self, message):
+        """Token count of one message, computed once per distinct message"""
+        key = (message.get('role', ''), message.get('content', ''))
+        count = self._token_cache.get(key)
+        if count is None:
+            if len(self._token_cache) >= TOKEN_CACHE_SIZE:
+                self._token_cache.clear()
+            count = self.token_counter(key[1]) + MESSAGE_OVERHEAD_TOKENS
+            self._token_cache[key] = count
+        return count
+
+    @staticmethod
+    def _split(history):
+        if history and history[0].get('role') == 'system':
+            return history[0], history[1:]
+        return None, list(history)
+
+    @staticmethod
+    def _fingerprint(turns):
+        return hash(tuple((msg.get('role'), msg.get('content')) for msg in turns))
+
+    def _summary_message(self):
+        return {'role': 'system', 'content': f"Summary of the earlier conversation: {self._summary}"}
+
+    def build(self, history, token_budget=None):
+        """Pinned system prompt + rolling summary + most recent turns that fit the budget"""
+        budget = token_budget or self.token_budget
+        system, turns = self._split(history)
+
+        with self._lock:
+            # History was edited or replaced underneath the summary: forget it
+            if self._summarized_upto and (
+                len(turns) < self._summarized_upto
+                or self._fingerprint(turns[:self._summarized_upto]) != self._summarized_fingerprint
+            ):
+                self._reset_locked()
+            summary = self._summary_message() if self._summary else None
+
+        remaining = budget
+        if system:
+            remaining -= self.count_tokens(system)
+        if summary:
+            remaining -= self.count_tokens(summary)
+
+        # Pack newest turns first; the latest message is always kept
+        start = len(turns)
+        for index in range(len(turns) - 1, -1, -1):
+            cost = self.count_tokens(turns[index])
+            if cost > remaining and index < len(turns) - 1:
+                break
+            remaining -= cost
+            start = index
+
+        with self._lock:
+            self._dropped = start
+
+        messages = [system] if system else []
+        if summary and start > 0:
+            messages.append(summary)
+        messages.extend(turns[start:])
+        return messages
+
+    def refresh_summary(self, history, model_name, client=None):
+        """Fold newly dropped turns into the rolling summary in a background thread"""
+        with self._lock:
+            dropped = self._dropped
+            pending = dropped > self._summarized_upto
+            busy = self._summary_thread is not None and self._summary_thread.is_alive()
+        if not pending or busy:
+            return
+
+        _, turns = self._split(history)
+        self._summary_thread = threading.Thread(
+            target=self._summarize,
+            args=(list(turns[:dropped]), model_name, client),
+            name="context-summary",
+            daemon=True
+        )
+        self._summary_thread.start()
+
+    def _summarize(self, turns, model_name, client):
+        try:
+            if client is None:
+                from ollama_client import get_client
+                client = get_client()
+
+            with self._lock:
+                previous = self._summary
+                start = self._summarized_upto
+                epoch = self._epoch
+
+            lines = [f"{msg['role']}: {msg['content']}" for msg in turns[start:]]
+            if previous:
+                lines.insert(0, f"Earlier summary: {previous}")
+
+            response = client.chat(
+                model=model_name,
+                messages=[
+                    {'role': 'system', 'content': SUMMARY_INSTRUCTION},
+                    {'role': 'user', 'content': "\n".join(lines)}
+                ],
+                stream=False,
+                options={"num_predict": SUMMARY_MAX_TOKENS, "temperature": 0.3}
+            )
+            summary = _THINK_BLOCK.sub('', response['message']['content']).strip()
+
+            with self._lock:
+                # Only commit if nobody reset or replaced the history meanwhile
+                if self._epoch == epoch and summary:
+                    self._summary = summary
+                    self._summarized_upto = len(turns)
+                    self._summarized_fingerprint = self._fingerprint(turns)
+            logger.info(f"Context summary updated ({len(turns)} turns folded)")
+
+        except Exception as e:
+            logger.warning(f"Context summary failed: {e}")
+
+    def _reset_locked(self):
+        self._epoch += 1
+        self._summary = ''
+        self._summarized_upto = 0
+        self._summarized_fingerprint = None
+
+    def reset(self):
+        """Forget the summary (e.g. when the conversation is cleared)"""
+        with self._lock:
+            self._reset_locked()
+            self._dropped = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'token_budget': self.token_budget,
+                'dropped_turns': self._dropped,
+                'summarized_turns': self._summarized_upto,
+                'summary_tokens': estimate_tokens(self._summary) if self._summary else 0
+            }
@@ -8,7 +8,6 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import (
     Qt, 
-    QThread,
     QSettings,
     QUrl,
     pyqtSlot,
@@ -24,6 +23,12 @@ from PyQt6.QtGui import (
 from PyQt6.QtWebEngineWidgets import QWebEngineView
 from PyQt6.QtWebChannel import QWebChannel
 from auth_bridge import AuthBridge  # SUDAH ADA - ditambahkan import json
+from context_window import ContextWindow
+from generation_pool import GenerationPool
+from stream_metrics import stream_metrics
+from response_cache import response_cache, TextSimilarityEmbedder, SEMANTIC_CACHE_ENABLED
+from text_normalize import strip_markers, to_classifier
+from prompts import SYSTEM_PROMPT
 import json  # DITAMBAHKAN
 
 # Import dengan error handling yang lebih detail
@@ -74,6 +79,10 @@ try:
         EmotionClassifier,
         L2S
     )
+    from sentiment.batching import MicroBatcher
+    from sentiment.background import InferenceExecutor
+    from sentiment.quantized import load_optimized
+    from sentiment.shared_encoder import SharedEncoderModel, is_shared_encoder, embedding_similarity
     from sentiment.memory.textsimilarity import TextSimilaritySearch
     SENTIMENT_AVAILABLE = True
     print("✅ Sentiment analysis available")
@@ -105,13 +114,13 @@ except ImportError:
 # Test Ollama connection
 print("🔍 Testing Ollama connection...")
 try:
-    import ollama
+    from ollama_client import get_registry
     print("✅ ollama module imported")
     
-    # Test server connection
-    try:
-        models = ollama.list()
-        available_models = [m['name'] for m in models['models']]
+    # Test server connection (shared registry, refreshed in background afterwards)
+    model_registry = get_registry()
+    if model_registry.healthy:
+        available_models = model_registry.names()
         print(f"✅ Ollama server running! Available models: {available_models}")
         
         # Check for DeepSeek
@@ -120,9 +129,8 @@ try:
             print(f"🤖 DeepSeek models found: {deepseek_models}")
         else:
             print("❌ No DeepSeek models found! Run: ollama pull deepseek-r1:1.5b")
-            
-    except Exception as e:
-        print(f"❌ Ollama server connection failed: {e}")
+    else:
+        print(f"❌ Ollama server connection failed: {model_registry.last_error}")
         print("❌ Make sure to run: ollama serve")
         
 except ImportError as e:
@@ -146,12 +154,14 @@ class ChatBridge(QObject):
     responseReady = pyqtSignal(str)
     streamChunk = pyqtSignal(str)  # Signal untuk streaming
     streamFinished = pyqtSignal(str)  # Signal ketika streaming selesai
+    chatStreamChunk = pyqtSignal(str, str)  # (chat_id, chunk) - satu stream per chat
+    chatStreamFinished = pyqtSignal(str, str)  # (chat_id, response)
+    chatStreamQueued = pyqtSignal(str)  # chat_id - menunggu thread generate yang kosong
+    chatStreamStarted = pyqtSignal(str)  # chat_id - keluar dari antrian, mulai generate
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent_app = parent
-        self.ollama_worker = None
-        self.ollama_thread = None
     
     @pyqtSlot(str, result=str)
     def sendMessage(self, message):
@@ -196,8 +206,54 @@ class ChatBridge(QObject):
         except Exception as e:
             print(f"❌ Error in DeepSeek-R1 streaming with history: {e}")
             self.streamFinished.emit(f"❌ Error DeepSeek-R1: {str(e)}")
+    
+    @pyqtSlot(str, str, str)
+    def sendMessageStreamingForChat(self, chatId, message, historyJSON):
+        """Streaming untuk satu chat; chat lain tetap bisa streaming bersamaan"""
+        try:
+            print(f"🚀 Starting DeepSeek-R1 streaming for chat {chatId}: {message}")
+            
+            if self.parent_app:
+                self.parent_app.process_message_streaming(message, self, chatId, json.loads(historyJSON))
+            else:
+                self.chatStreamFinished.emit(chatId, "❌ ERROR: Parent app not available")
+            
+        except Exception as e:
+            print(f"❌ Error in DeepSeek-R1 streaming for chat {chatId}: {e}")
+            self.chatStreamFinished.emit(chatId, f"❌ Error DeepSeek-R1: {str(e)}")
+    
+    @pyqtSlot()
+    def stopGeneration(self):
+        """Stop button: hentikan generate yang sedang berjalan"""
+        if self.parent_app:
+            self.parent_app.stop_generation()
+    
+    @pyqtSlot(str)
+    def stopGenerationForChat(self, chatId):
+        """Stop button untuk satu chat"""
+        if self.parent_app:
+            self.parent_app.stop_generation(chatId)
+    
+    @pyqtSlot(str)
+    def closeChat(self, chatId):
+        """Chat dihapus: hentikan generate dan lupakan context window-nya"""
+        if self.parent_app:
+            self.parent_app.close_chat(chatId)
+    
+    @pyqtSlot()
+    def closeAllChats(self):
+        """Semua chat dihapus (logout / pindah mode guest)"""
+        if self.parent_app:
+            self.parent_app.close_all_chats()
             
     
+    @pyqtSlot(result=str)
+    def getDiagnostics(self):
+        """Metrik performa (TTFT, token/s, durasi stage) + status pool dan cache"""
+        if not self.parent_app:
+            return json.dumps({"stream_metrics": stream_metrics.snapshot()})
+        return json.dumps(self.parent_app.get_memory_stats(), default=str)
+    
     @pyqtSlot(result=str)
     def getSystemInfo(self):
         """Memberikan info sistem ke JavaScript"""
@@ -290,21 +346,28 @@ class CutieTheCutest(QMainWindow):
         self.conversation_history = [
             {
                 'role': 'system',
-                'content': """You're CutieChatter, your directive should be :
-                            1. Playful.
-                            2. Personally engaging with the user.
-                            3. Maintain a consistent personal tone.
-                            4. Avoid responding using double quotation marks.
-                            5. Generate natural responses.
-                            """
+                'content': SYSTEM_PROMPT
             }
         ]
         self.is_ollama_thread_running = False
-        self.ollama_thread = None
-        self.ollama_worker = None
+        
+        # Persistent generation threads; one running job per chat (key None = the single legacy chat)
+        self.generation_pool = GenerationPool(parent=self)
+        self.generation_jobs = {}
+        self.chat_context_windows = {}
+        
+        # Token-budgeted view of conversation_history sent to the model
+        self.context_window = ContextWindow()
+        
+        # Load the chat model in the background so the first message skips the cold start
+        if BACKENDS_AVAILABLE:
+            from model_lifecycle import get_lifecycle
+            get_lifecycle().warm_up(self.resolve_model())
         
         # Initialize sentiment analysis components
         self.classifier = None
+        self.emotion_batcher = None  # micro-batches classifier calls from every thread
+        self.inference_executor = InferenceExecutor() if SENTIMENT_AVAILABLE else None  # keeps them off the GUI thread
         self.ModelForSentimentScoring = None
         self.ModelForCS = None
         self.tokenizer = None
@@ -1539,31 +1602,18 @@ class CutieTheCutest(QMainWindow):
             # Add to conversation history
             self.conversation_history.append({'role': 'user', 'content': message})
             
-            # Sentiment analysis (if available)
-            if self.classifier is not None:
-                try:
-                    user_sentiment_score = self.GetSentimentOnPrimary(message)
-                    print(f"User Sentiment Score: {user_sentiment_score}")
-                    self.user_text_metadata.append(message)
-                    self.user_features_metadata.append(user_sentiment_score)
-                except Exception as e:
-                    print(f"Error in sentiment analysis: {e}")
+            # Sentiment analysis (if available), in the background: generation does not wait for it
+            user_sentiment = self.analyze_turn_async(message, 'user')
             
             # HANYA menggunakan DeepSeek-R1:1.5b model, TIDAK ADA fallback dummy response
-            response = self.generate_ollama_response_sync(message)
+            response = self.generate_ollama_response_sync(message, user_sentiment)
             
             # Add AI response to conversation history
             self.conversation_history.append({'role': 'assistant', 'content': response})
+            self.context_window.refresh_summary(self.conversation_history, self.resolve_model())
             
             # AI sentiment analysis
-            if self.classifier is not None:
-                try:
-                    ai_sentiment_score = self.GetSentimentOnPrimary(response)
-                    print(f"AI Sentiment Score: {ai_sentiment_score}")
-                    self.ai_text_metadata.append(response)
-                    self.ai_features_metadata.append(ai_sentiment_score)
-                except Exception as e:
-                    print(f"Error in AI sentiment analysis: {e}")
+            self.analyze_turn_async(response, 'ai')
             
             return response
             
@@ -1571,34 +1621,51 @@ class CutieTheCutest(QMainWindow):
             print(f"Error processing message: {e}")
             return f"Maaf, terjadi kesalahan saat berkomunikasi dengan DeepSeek-R1: {str(e)}"
 
-    def process_message_streaming(self, message, bridge):
-        """Process pesan dengan streaming response LANGSUNG dari DeepSeek-R1"""
+    def process_message_streaming(self, message, bridge, chat_key=None, history=None):
+        """Process pesan dengan streaming response LANGSUNG dari DeepSeek-R1
+
+        With a chat_key the given history belongs to that chat only, so other
+        chats can keep streaming meanwhile.
+        """
+        emit_chunk, emit_finished = self._stream_emitters(bridge, chat_key)
         try:
             print(f"🤖 Processing with DeepSeek-R1 streaming: {message}")
+            if history is None:
+                history = self.conversation_history
             
-            # Add to conversation history
-            self.conversation_history.append({'role': 'user', 'content': message})
+            # Add to conversation history (the web UI already sends it as the last message)
+            if not history or history[-1].get('role') != 'user' or history[-1].get('content') != message:
+                history.append({'role': 'user', 'content': message})
             
-            # Sentiment analysis (if available)
-            if self.classifier is not None:
-                try:
-                    user_sentiment_score = self.GetSentimentOnPrimary(message)
-                    print(f"User Sentiment Score: {user_sentiment_score}")
-                    self.user_text_metadata.append(message)
-                    self.user_features_metadata.append(user_sentiment_score)
-                except Exception as e:
-                    print(f"Error in sentiment analysis: {e}")
+            # Sentiment analysis (if available), in the background: generation does not wait for it
+            user_sentiment = self.analyze_turn_async(message, 'user')
             
             # LANGSUNG ke DeepSeek-R1 streaming, TIDAK ADA fallback
             print(f"🔄 Starting DeepSeek-R1 OllamaWorker with model: {self.model_name}")
-            self.start_ollama_streaming(bridge)
+            self.start_ollama_streaming(bridge, chat_key, history, user_sentiment)
             
         except Exception as e:
             print(f"❌ CRITICAL Error in DeepSeek-R1 processing: {e}")
-            bridge.streamFinished.emit(f"❌ CRITICAL: Tidak dapat memproses dengan DeepSeek-R1: {str(e)}")
+            emit_finished(f"❌ CRITICAL: Tidak dapat memproses dengan DeepSeek-R1: {str(e)}")
 
-    def start_ollama_streaming(self, bridge):
-        """Start Ollama worker LANGSUNG dari DeepSeek-R1:1.5b - FIXED VERSION"""
+    def resolve_model(self, message=""):
+        """Model for this message: the configured one, or the router's pick for --model auto"""
+        if not BACKENDS_AVAILABLE:
+            return self.model_name
+        from model_router import model_router, is_auto
+        if not is_auto(self.model_name):
+            return self.model_name
+        return model_router.route(message, default="deepseek-r1:1.5b")
+
+    def start_ollama_streaming(self, bridge, chat_key=None, history=None, user_sentiment=None):
+        """Start Ollama worker LANGSUNG dari DeepSeek-R1:1.5b on the generation pool
+
+        chat_key None is the single legacy conversation (streamChunk / streamFinished);
+        any other key is one open chat of the web UI (chatStreamChunk / chatStreamFinished),
+        and several chats can generate at the same time. user_sentiment is the pending
+        analysis of the message; it only conditions the prompt if it is ready in time.
+        """
+        emit_chunk, emit_finished = self._stream_emitters(bridge, chat_key)
         try:
             print(f"🚀 STARTING DeepSeek-R1 streaming with model: {self.model_name}")
             
@@ -1606,81 +1673,55 @@ class CutieTheCutest(QMainWindow):
             if not BACKENDS_AVAILABLE:
                 error_msg = f"❌ CRITICAL: backends module tidak tersedia!"
                 print(error_msg)
-                bridge.streamFinished.emit(error_msg)
+                emit_finished(error_msg)
                 return
             
             # Import OllamaWorker PAKSA dari backends yang benar
             try:
                 from backends import OllamaWorker
-                print("✅ OllamaWorker imported successfully from backends.py")
             except ImportError as e:
                 error_msg = f"❌ CRITICAL: Cannot import OllamaWorker: {e}"
                 print(error_msg)
-                bridge.streamFinished.emit(error_msg)
+                emit_finished(error_msg)
                 return
             
-            # Stop existing worker jika ada
-            if hasattr(self, 'ollama_thread') and self.ollama_thread and self.ollama_thread.isRunning():
-                print("🛑 Stopping existing DeepSeek-R1 thread")
-                self.ollama_thread.quit()
-                self.ollama_thread.wait(3000)
-            
-            # Reset thread status
-            self.is_ollama_thread_running = False
+            if history is None:
+                history = self.conversation_history
             
-            # Check jika masih ada thread yang running
-            if self.is_ollama_thread_running:
-                print("⚠️ Thread already running, aborting")
-                return
-
-            # Disconnect previous worker signals
-            if hasattr(self, 'ollama_worker') and self.ollama_worker:
-                try:
-                    self.ollama_worker.chunk_received.disconnect()
-                    self.ollama_worker.finished.disconnect()
-                    print("🔌 Disconnected previous worker signals")
-                except:
-                    pass
+            # A new message in the same chat replaces its running generation; other chats keep going
+            previous = self.generation_jobs.pop(chat_key, None)
+            if previous is not None and self.generation_pool.cancel(previous):
+                print(f"🛑 Cancelled previous generation for chat {chat_key or 'default'}")
 
+            model_name = self.resolve_model(history[-1]['content'])  # router pick for --model auto
             print(f"🎯 Creating OllamaWorker with:")
-            print(f"   - Model: {self.model_name}")
-            print(f"   - Last message: {self.conversation_history[-1]['content']}")
-            print(f"   - History length: {len(self.conversation_history)}")
-            
-            # Set status SEBELUM membuat thread
-            self.is_ollama_thread_running = True
-            
-            # Create worker dan thread seperti di backends.py original
-            self.ollama_thread = QThread()
-            self.ollama_worker = OllamaWorker(
-                self.conversation_history[-1]['content'],  # user_message
-                self.conversation_history.copy(),          # conversation_history  
-                self.model_name                           # model_name
+            print(f"   - Model: {model_name}")
+            print(f"   - Last message: {history[-1]['content']}")
+            print(f"   - History length: {len(history)}")
+            
+            worker = OllamaWorker(
+                history[-1]['content'],                                   # user_message
+                self.condition_on_sentiment(self._context_window_for(chat_key).build(history), user_sentiment),
+                model_name,
+                session_key=chat_key or "default"                         # per-chat KV prefix reuse
             )
             
-            # Move worker to thread
-            self.ollama_worker.moveToThread(self.ollama_thread)
-            print("📦 Moved OllamaWorker to thread")
-            
-            # Connect signals - PENTING: connect sebelum start!
-            def on_chunk_received(chunk):
-                print(f"📥 Chunk received: {chunk[:50]}...")
-                bridge.streamChunk.emit(chunk)
-            
             def on_finished(response):
                 print(f"✅ Response finished, length: {len(response)}")
-                self.on_ollama_response_complete_web(response, bridge)
-            
-            self.ollama_worker.chunk_received.connect(on_chunk_received)
-            self.ollama_worker.finished.connect(on_finished)
-            self.ollama_thread.started.connect(self.ollama_worker.run)
-            
-            print("🔗 Connected all signals")
-            
-            # START THREAD
-            self.ollama_thread.start()
+                self.on_ollama_response_complete_web(response, bridge, chat_key, history)
+            
+            # Queued on the persistent pool: no QThread per message, no wait() on the GUI thread.
+            # With every pool thread busy the chat is told it is waiting, and again once it starts
+            on_queued = on_started = None
+            if chat_key is not None:
+                on_queued = lambda: bridge.chatStreamQueued.emit(chat_key)
+                on_started = lambda: bridge.chatStreamStarted.emit(chat_key)
+            self.generation_jobs[chat_key] = self.generation_pool.submit(
+                worker, emit_chunk, on_finished, on_queued=on_queued, on_started=on_started
+            )
+            self.is_ollama_thread_running = True
             
-            print(f"🟢 DeepSeek-R1 streaming STARTED successfully!")
+            print(f"🟢 DeepSeek-R1 streaming STARTED successfully! ({self.generation_pool.active_jobs} active)")
             
         except Exception as e:
             error_msg = f"❌ CRITICAL ERROR starting DeepSeek-R1: {e}"
@@ -1690,14 +1731,64 @@ class CutieTheCutest(QMainWindow):
             print(f"   - Exception details: {type(e).__name__}: {e}")
             
             # Reset status on error
-            self.is_ollama_thread_running = False
-            bridge.streamFinished.emit(error_msg)
+            self.is_ollama_thread_running = bool(self.generation_jobs)
+            emit_finished(error_msg)
+
+    def _stream_emitters(self, bridge, chat_key):
+        """(emit_chunk, emit_finished) for the legacy conversation or one chat of the web UI"""
+        if chat_key is None:
+            return bridge.streamChunk.emit, bridge.streamFinished.emit
+        return (
+            lambda chunk: bridge.chatStreamChunk.emit(chat_key, chunk),
+            lambda response: bridge.chatStreamFinished.emit(chat_key, response)
+        )
+
+    def _context_window_for(self, chat_key):
+        """Each chat keeps its own rolling summary"""
+        if chat_key is None:
+            return self.context_window
+        if chat_key not in self.chat_context_windows:
+            self.chat_context_windows[chat_key] = ContextWindow()
+        return self.chat_context_windows[chat_key]
+
+    def close_chat(self, chat_key):
+        """A web UI chat was deleted: stop its generation, drop its context window and KV prefix"""
+        self.stop_generation(chat_key)
+        self.chat_context_windows.pop(chat_key, None)
+        if BACKENDS_AVAILABLE:
+            from prefix_cache import prefix_cache
+            prefix_cache.invalidate(chat_key)
+
+    def close_all_chats(self):
+        """Every web UI chat was cleared (logout / guest switch)"""
+        for chat_key in list(self.chat_context_windows) + [key for key in self.generation_jobs if key is not None]:
+            self.close_chat(chat_key)
+
+    def stop_generation(self, chat_key=None, all_chats=False):
+        """Stop a running generation; the worker closes the HTTP stream and finishes with the partial answer"""
+        if not hasattr(self, 'generation_pool'):
+            return
+        if all_chats:
+            print("🛑 Stop requested for all chats")
+            self.generation_pool.stop_all()
+            return
+        job_id = self.generation_jobs.get(chat_key)
+        if job_id is not None:
+            print(f"🛑 Stop requested for chat {chat_key or 'default'}")
+            self.generation_pool.stop(job_id)
 
-    def on_ollama_response_complete_web(self, response, bridge):
+    def on_ollama_response_complete_web(self, response, bridge, chat_key=None, history=None):
         """Handle completion of Ollama response untuk web interface - FIXED"""
+        emit_chunk, emit_finished = self._stream_emitters(bridge, chat_key)
+        if history is None:
+            history = self.conversation_history
         try:
             print(f"🏁 Ollama response complete, cleaning response...")
             
+            # The job is done; nothing to join, its pool thread already picks up the next one
+            self.generation_jobs.pop(chat_key, None)
+            self.is_ollama_thread_running = bool(self.generation_jobs)
+            
             # Clean response menggunakan TextCleaner dari backends
             try:
                 from backends import TextCleaner
@@ -1711,67 +1802,25 @@ class CutieTheCutest(QMainWindow):
             
             # Add to conversation history
             if final_response.strip():  # Only add non-empty responses
-                self.conversation_history.append({'role': 'assistant', 'content': final_response})
+                history.append({'role': 'assistant', 'content': final_response})
                 print(f"📝 Added to conversation history")
+                # Fold turns that no longer fit the context budget into the rolling summary
+                # (a chat closed while generating has no window left to refresh)
+                window = self.context_window if chat_key is None else self.chat_context_windows.get(chat_key)
+                if window is not None:
+                    window.refresh_summary(history, self.resolve_model())
 
-            # Sentiment analysis (if available) - dari original code
-            if self.classifier is not None and SENTIMENT_AVAILABLE:
-                try:
-                    self.ai_sentiment_score = self.GetSentimentOnPrimary(final_response)
-                    print(f"📊 AI Sentiment Score: {self.ai_sentiment_score}")
-                    
-                    self.ai_text_metadata.append(final_response)
-                    self.ai_features_metadata.append(self.ai_sentiment_score)
-                    
-                    # Calculate text similarity if models are available
-                    if self.ModelForCS is not None and len(self.user_text_metadata) > 0:
-                        try:
-                            from sentiment.memory.textsimilarity import TextSimilaritySearch
-                            text_similarity_search = TextSimilaritySearch(
-                                self.ModelForCS, 
-                                self.tokenizer, 
-                                self.device
-                            )
-                            
-                            # Get similarity between latest user and AI messages
-                            latest_user_text = self.user_text_metadata[-1] if self.user_text_metadata else ""
-                            similarity_score = text_similarity_search.calculate_similarity(
-                                latest_user_text, 
-                                final_response
-                            )
-                            
-                            self.cosine_of_text_metadata.append(similarity_score)
-                            print(f"🔗 Text Similarity Score: {similarity_score}")
-                            
-                        except Exception as e:
-                            print(f"⚠️ Error calculating text similarity: {e}")
-                            
-                except Exception as e:
-                    print(f"⚠️ Error in AI sentiment analysis: {e}")
-            else:
-                print("📊 AI sentiment analysis disabled - classifier not available")
-
-            # Clean up thread seperti original
-            if hasattr(self, 'ollama_thread') and self.ollama_thread:
-                print("🧹 Cleaning up thread...")
-                self.ollama_thread.quit()
-                self.ollama_thread.wait(3000)  # Wait max 3 seconds
-                self.ollama_thread = None
+            # Sentiment + similarity (if available) - dari original code, now in the background
+            self.analyze_turn_async(final_response, 'ai')
 
-            if hasattr(self, 'ollama_worker'):
-                self.ollama_worker = None
-                
-            self.is_ollama_thread_running = False
-            
             # Emit signal untuk web interface dengan cleaned response
-            bridge.streamFinished.emit(final_response)
+            emit_finished(final_response)
             print(f"✅ Web interface notified with final response")
                 
         except Exception as e:
             error_msg = f"❌ Error in response completion: {e}"
             print(error_msg)
-            self.is_ollama_thread_running = False
-            bridge.streamFinished.emit(error_msg)
+            emit_finished(error_msg)
 
     def run_ollama_chat(self):
         """Run Ollama chat with error handling - dari original code"""
@@ -1779,102 +1828,41 @@ class CutieTheCutest(QMainWindow):
             print("Backends not available - cannot run Ollama chat")
             return
             
-        if self.is_ollama_thread_running:
+        if None in self.generation_jobs:
             return
 
-        # Disconnect previous worker signals
-        if hasattr(self, 'ollama_worker') and self.ollama_worker:
-            try:
-                self.ollama_worker.chunk_received.disconnect()
-                self.ollama_worker.finished.disconnect()
-            except:
-                pass
-
-        self.is_ollama_thread_running = True
-
         try:
             from backends import OllamaWorker
             
-            self.ollama_thread = QThread()
-            self.ollama_worker = OllamaWorker(
+            worker = OllamaWorker(
                 self.conversation_history[-1]['content'], 
-                self.conversation_history, 
-                self.model_name
+                self.context_window.build(self.conversation_history), 
+                self.resolve_model(self.conversation_history[-1]['content'])
             )
             
-            self.ollama_worker.moveToThread(self.ollama_thread)
-
             # Connect signals - untuk desktop mode jika ada
-            if hasattr(self, 'chat_widget'):
-                self.ollama_worker.chunk_received.connect(self.chat_widget.append_to_ai_message)
-                
-            self.ollama_worker.finished.connect(self.on_ollama_response_complete)
-            self.ollama_thread.started.connect(self.ollama_worker.run)
-            self.ollama_thread.start()
+            on_chunk = self.chat_widget.append_to_ai_message if hasattr(self, 'chat_widget') else None
+            self.generation_jobs[None] = self.generation_pool.submit(worker, on_chunk, self.on_ollama_response_complete)
+            self.is_ollama_thread_running = True
             
         except Exception as e:
             print(f"Error starting Ollama chat: {e}")
-            self.is_ollama_thread_running = False
+            self.is_ollama_thread_running = bool(self.generation_jobs)
 
     def on_ollama_response_complete(self, response):
         """Handle completion of Ollama response - dari original code"""
+        # Job done: its pool thread is already free for the next one
+        self.generation_jobs.pop(None, None)
+        self.is_ollama_thread_running = bool(self.generation_jobs)
         self.conversation_history.append({'role': 'assistant', 'content': response})
+        self.context_window.refresh_summary(self.conversation_history, self.resolve_model())
 
-        # Sentiment analysis (if available)
-        if self.classifier is not None and SENTIMENT_AVAILABLE:
-            try:
-                self.ai_sentiment_score = self.GetSentimentOnPrimary(response)
-                print(f"AI Sentiment Score: {self.ai_sentiment_score}")
-                
-                self.ai_text_metadata.append(response)
-                self.ai_features_metadata.append(self.ai_sentiment_score)
-                
-                # Calculate text similarity if models are available
-                if self.ModelForCS is not None and len(self.user_text_metadata) > 0:
-                    try:
-                        from sentiment.memory.textsimilarity import TextSimilaritySearch
-                        text_similarity_search = TextSimilaritySearch(
-                            self.ModelForCS, 
-                            self.tokenizer, 
-                            self.device
-                        )
-                        
-                        # Get similarity between latest user and AI messages
-                        latest_user_text = self.user_text_metadata[-1] if self.user_text_metadata else ""
-                        similarity_score = text_similarity_search.calculate_similarity(
-                            latest_user_text, 
-                            response
-                        )
-                        
-                        self.cosine_of_text_metadata.append(similarity_score)
-                        print(f"Text Similarity Score: {similarity_score}")
-                        
-                    except Exception as e:
-                        print(f"Error calculating text similarity: {e}")
-                        
-            except Exception as e:
-                print(f"Error in AI sentiment analysis: {e}")
-        else:
-            print("AI sentiment analysis disabled - classifier not available")
-
-        # Clean up thread
-        if self.ollama_thread:
-            self.ollama_thread.quit()
-            self.ollama_thread.wait()
-            self.ollama_thread = None
-
-        self.ollama_worker = None
-        self.is_ollama_thread_running = False
+        # Sentiment + similarity (if available), in the background
+        self.analyze_turn_async(response, 'ai')
 
     def naked_text(self, text):
         """Clean text from HTML and special markers"""
-        text = re.sub(r'<\s*/\s*div\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*response\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'---', '', text)
-        text = re.sub(r'<\s*think\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/\s*think\s*>', '', text, flags=re.IGNORECASE)
-        text = re.sub(r'<\s*/?\s*th?i?n?k?\s*/?>', '', text, flags=re.IGNORECASE)
-        return text
+        return strip_markers(text)
 
     def process_message(self, message):
         """Process pesan dari web interface dengan DeepSeek-R1:1.5b"""
@@ -1884,31 +1872,18 @@ class CutieTheCutest(QMainWindow):
             # Add to conversation history
             self.conversation_history.append({'role': 'user', 'content': message})
             
-            # Sentiment analysis (if available)
-            if self.classifier is not None:
-                try:
-                    user_sentiment_score = self.GetSentimentOnPrimary(message)
-                    print(f"User Sentiment Score: {user_sentiment_score}")
-                    self.user_text_metadata.append(message)
-                    self.user_features_metadata.append(user_sentiment_score)
-                except Exception as e:
-                    print(f"Error in sentiment analysis: {e}")
+            # Sentiment analysis (if available), in the background: generation does not wait for it
+            user_sentiment = self.analyze_turn_async(message, 'user')
             
             # HANYA menggunakan DeepSeek-R1:1.5b, TIDAK ADA fallback
-            response = self.generate_ollama_response_sync(message)
+            response = self.generate_ollama_response_sync(message, user_sentiment)
             
             # Add AI response to conversation history
             self.conversation_history.append({'role': 'assistant', 'content': response})
+            self.context_window.refresh_summary(self.conversation_history, self.resolve_model())
             
             # AI sentiment analysis
-            if self.classifier is not None:
-                try:
-                    ai_sentiment_score = self.GetSentimentOnPrimary(response)
-                    print(f"AI Sentiment Score: {ai_sentiment_score}")
-                    self.ai_text_metadata.append(response)
-                    self.ai_features_metadata.append(ai_sentiment_score)
-                except Exception as e:
-                    print(f"Error in AI sentiment analysis: {e}")
+            self.analyze_turn_async(response, 'ai')
             
             return response
             
@@ -1916,12 +1891,13 @@ class CutieTheCutest(QMainWindow):
             print(f"Error processing message: {e}")
             return f"Maaf, terjadi kesalahan saat berkomunikasi dengan DeepSeek-R1: {str(e)}"
 
-    def generate_ollama_response_sync(self, message):
+    def generate_ollama_response_sync(self, message, user_sentiment=None):
         """Generate response menggunakan DeepSeek-R1:1.5b secara synchronous"""
         try:
             # Pastikan ollama module tersedia
             try:
-                import ollama
+                from ollama_client import get_client
+                from model_lifecycle import model_lifecycle
             except ImportError:
                 raise Exception("Ollama Python library tidak tersedia. Install dengan: pip install ollama")
             
@@ -1934,9 +1910,12 @@ class CutieTheCutest(QMainWindow):
             print(f"📝 Conversation history length: {len(self.conversation_history)}")
             
             # Call Ollama API secara synchronous dengan DeepSeek-R1
-            response = ollama.chat(
-                model=self.model_name,
-                messages=self.conversation_history,
+            model_name = self.resolve_model(message)
+            response = get_client().chat(
+                model=model_name,
+                messages=self.condition_on_sentiment(
+                    self.context_window.build(self.conversation_history, token_budget=768), user_sentiment
+                ),
                 stream=False,  # Non-streaming untuk WebChannel
                 options={
                     "num_thread": num_threads,
@@ -1947,8 +1926,10 @@ class CutieTheCutest(QMainWindow):
                     "num_ctx": 1024,
                     "num_batch": 32,
                     "num_prediction": 12
-                }
+                },
+                keep_alive=model_lifecycle.keep_alive
             )
+            model_lifecycle.touch(model_name)
             
             # Extract response content dari DeepSeek-R1
             full_content = response['message']['content']
@@ -2040,16 +2021,27 @@ class CutieTheCutest(QMainWindow):
                             self.tokenizer.add_special_tokens({'pad_token': '[PAD]'})
                             print("Added new pad_token: [PAD]")
                     
-                    # Load sentiment model
-                    self.ModelForSentimentScoring = AutoModelForSequenceClassification.from_pretrained(
-                        model_path,
-                        num_labels=6,
-                        trust_remote_code=True
-                    ).to(self.device)
-                    
-                    # Resize embeddings if needed
-                    if hasattr(self.tokenizer, 'pad_token') and self.tokenizer.pad_token == '[PAD]':
-                        self.ModelForSentimentScoring.resize_token_embeddings(len(self.tokenizer))
+                    # Load sentiment model: one backbone for logits and embeddings
+                    # (quantized CPU export from sentiment.quantized when present)
+                    self.ModelForSentimentScoring = None
+                    if SENTIMENT_AVAILABLE:
+                        self.ModelForSentimentScoring = (
+                            load_optimized(model_path, 'shared', self.device)
+                            or load_optimized(model_path, 'classifier', self.device)
+                        )
+                    if self.ModelForSentimentScoring is None:
+                        self.ModelForSentimentScoring = AutoModelForSequenceClassification.from_pretrained(
+                            model_path,
+                            num_labels=6,
+                            trust_remote_code=True
+                        ).to(self.device)
+                        
+                        # Resize embeddings if needed
+                        if hasattr(self.tokenizer, 'pad_token') and self.tokenizer.pad_token == '[PAD]':
+                            self.ModelForSentimentScoring.resize_token_embeddings(len(self.tokenizer))
+                        
+                        if SENTIMENT_AVAILABLE:
+                            self.ModelForSentimentScoring = SharedEncoderModel(self.ModelForSentimentScoring).eval()
                     
                     # Initialize classifier
                     if SENTIMENT_AVAILABLE:
@@ -2059,16 +2051,23 @@ class CutieTheCutest(QMainWindow):
                             self.device,
                             composite_dictionary=None
                         )
+                        self.emotion_batcher = MicroBatcher(self.classifier.classify_batch)
                     
-                    # Load similarity model
+                    # Load similarity model (the shared encoder already is one: no second copy of the weights)
                     try:
-                        self.ModelForCS = AutoModel.from_pretrained(
-                            model_path,
-                            trust_remote_code=True
-                        ).to(self.device)
-                        
-                        if hasattr(self.tokenizer, 'pad_token') and self.tokenizer.pad_token == '[PAD]':
-                            self.ModelForCS.resize_token_embeddings(len(self.tokenizer))
+                        self.ModelForCS = None
+                        if SENTIMENT_AVAILABLE and is_shared_encoder(self.ModelForSentimentScoring):
+                            self.ModelForCS = self.ModelForSentimentScoring
+                        elif SENTIMENT_AVAILABLE:
+                            self.ModelForCS = load_optimized(model_path, 'encoder', self.device)
+                        if self.ModelForCS is None:
+                            self.ModelForCS = AutoModel.from_pretrained(
+                                model_path,
+                                trust_remote_code=True
+                            ).to(self.device)
+                            
+                            if hasattr(self.tokenizer, 'pad_token') and self.tokenizer.pad_token == '[PAD]':
+                                self.ModelForCS.resize_token_embeddings(len(self.tokenizer))
                             
                     except Exception as e:
                         print(f"Could not load CS model from {model_path}: {e}")
@@ -2079,6 +2078,13 @@ class CutieTheCutest(QMainWindow):
                             print("Could not load fallback similarity model")
                             self.ModelForCS = None
                     
+                    # Semantic tier of the response cache reuses the similarity encoder
+                    if self.ModelForCS is not None and SEMANTIC_CACHE_ENABLED:
+                        try:
+                            response_cache.set_embedder(TextSimilarityEmbedder(self.ModelForCS, self.tokenizer, self.device))
+                        except Exception as e:
+                            print(f"Semantic response cache disabled: {e}")
+                    
                     print(f"Successfully loaded model from: {model_path}")
                     model_loaded = True
                     break
@@ -2090,6 +2096,7 @@ class CutieTheCutest(QMainWindow):
             if not model_loaded:
                 print("Could not load any model - sentiment analysis will be disabled")
                 self.classifier = None
+                self.emotion_batcher = None
                 self.ModelForSentimentScoring = None
                 self.ModelForCS = None
                 self.tokenizer = None
@@ -2097,10 +2104,77 @@ class CutieTheCutest(QMainWindow):
         except Exception as e:
             print(f"Error in model loading setup: {e}")
             self.classifier = None
+            self.emotion_batcher = None
             self.ModelForSentimentScoring = None
             self.ModelForCS = None
             self.tokenizer = None
 
+    def analyze_turn_async(self, text, role='user'):
+        """Sentiment (plus similarity to the latest user message for AI turns) on the inference executor
+
+        The text goes into the turn metadata right away; its score fills the same
+        slot when the analysis finishes. Returns the future, or None without a classifier.
+        """
+        if self.classifier is None or self.inference_executor is None:
+            return None
+        if role == 'user':
+            texts, features = self.user_text_metadata, self.user_features_metadata
+        else:
+            texts, features = self.ai_text_metadata, self.ai_features_metadata
+        texts.append(text)
+        features.append(None)
+        slot = len(features) - 1
+        latest_user_text = self.user_text_metadata[-1] if role == 'ai' and self.user_text_metadata else None
+        user_features, user_slot = self.user_features_metadata, len(self.user_features_metadata) - 1
+
+        def analyze():
+            score = self.GetSentimentOnPrimary(text)
+            similarity = None
+            if latest_user_text is not None:
+                # Shared encoder: both turns already carry their sentence embedding, no extra pass
+                user_score = user_features[user_slot] if 0 <= user_slot < len(user_features) else None
+                similarity = embedding_similarity(
+                    getattr(user_score, 'sentence_embedding', None),
+                    getattr(score, 'sentence_embedding', None)
+                )
+                if similarity is None and self.ModelForCS is not None:
+                    similarity = self._text_similarity(latest_user_text, text)
+            return score, similarity
+
+        def attach(result):
+            score, similarity = result
+            # The chat may have been cleared meanwhile: only fill our own slot
+            if slot < len(texts) and texts[slot] is text:
+                features[slot] = score
+                if similarity is not None:
+                    self.cosine_of_text_metadata.append(similarity)
+            if role == 'ai':
+                self.ai_sentiment_score = score
+            print(f"📊 {'User' if role == 'user' else 'AI'} Sentiment Score: {score}")
+            if similarity is not None:
+                print(f"🔗 Text Similarity Score: {similarity}")
+
+        return self.inference_executor.submit(analyze, callback=attach)
+
+    def condition_on_sentiment(self, messages, user_sentiment):
+        """Add the user's emotion to the prompt if CUTIE_SENTIMENT_CONDITIONING is on and it is ready in time"""
+        if user_sentiment is None or self.inference_executor is None:
+            return messages
+        return self.inference_executor.condition(messages, user_sentiment)
+
+    def _text_similarity(self, user_text, ai_text):
+        """Cosine similarity between a user message and the reply (None on failure)"""
+        try:
+            from sentiment.memory.textsimilarity import TextSimilaritySearch
+            text_similarity_search = TextSimilaritySearch()
+            with stream_metrics.timed('similarity'):
+                # Both texts in one encoder pass
+                embeddings = text_similarity_search.get_embedding([user_text, ai_text], self.ModelForCS, self.tokenizer, self.device)
+                return float(text_similarity_search.cosine_similarity(embeddings[:1], embeddings[1:]))
+        except Exception as e:
+            print(f"⚠️ Error calculating text similarity: {e}")
+            return None
+
     def GetSentimentOnPrimary(self, text):
         """Get sentiment analysis for given text"""
         if self.classifier is None:
@@ -2109,10 +2183,14 @@ class CutieTheCutest(QMainWindow):
             
         try:
             # Clean the text
-            cleaned_text = self.naked_text(text)
+            cleaned_text = to_classifier(text)
             
-            # Get sentiment prediction
-            sentiment_result = self.classifier.predict_emotion(cleaned_text)
+            # Get sentiment prediction (batched with concurrent callers)
+            with stream_metrics.timed('sentiment'):
+                if self.emotion_batcher is not None:
+                    sentiment_result = self.emotion_batcher.classify(cleaned_text)
+                else:
+                    sentiment_result = self.classifier.GetEmotionForClassification(cleaned_text)
             
             # Convert to appropriate format (adjust based on your classifier output)
             if isinstance(sentiment_result, dict):
@@ -2131,6 +2209,12 @@ class CutieTheCutest(QMainWindow):
         try:
             stats = {
                 'conversation_length': len(self.conversation_history),
+                'context_window': self.context_window.stats(),
+                'response_cache': response_cache.stats(),
+                'generation_pool': self.generation_pool.stats(),
+                'stream_metrics': stream_metrics.snapshot(),
+                'sentiment_batcher': self.emotion_batcher.stats() if self.emotion_batcher is not None else None,
+                'sentiment_executor': self.inference_executor.stats() if self.inference_executor is not None else None,
                 'user_metadata_count': len(self.user_text_metadata),
                 'ai_metadata_count': len(self.ai_text_metadata),
                 'similarity_scores_count': len(self.cosine_of_text_metadata)
@@ -2152,6 +2236,10 @@ class CutieTheCutest(QMainWindow):
         try:
             # Keep only the system message
             self.conversation_history = [self.conversation_history[0]] if self.conversation_history else []
+            self.context_window.reset()
+            if BACKENDS_AVAILABLE:
+                from prefix_cache import prefix_cache
+                prefix_cache.invalidate("default")
             
             # Clear metadata
             self.ai_features_metadata.clear()
@@ -2267,6 +2355,13 @@ class CutieTheCutest(QMainWindow):
             # Save current theme setting
             self.settings.setValue("dark_theme", self.is_dark_theme)
             
+            # Abort running generations so Ollama does not keep generating for nobody
+            self.generation_pool.shutdown()
+            if self.inference_executor is not None:
+                self.inference_executor.shutdown()
+            if self.emotion_batcher is not None:
+                self.emotion_batcher.close()
+            
             # Clean up models to free memory
             if hasattr(self, 'ModelForSentimentScoring') and self.ModelForSentimentScoring is not None:
                 del self.ModelForSentimentScoring
@@ -0,0 +1,177 @@
+"""
+Persistent worker pool for streamed generations in CutieChatter
+Thread tetap hidup dan dipakai ulang (QThreadPool + job queue); chunk dan hasil
+dirutekan per job ID ke GUI thread, tanpa QThread baru atau wait() per pesan
+"""
+
+import os
+import uuid
+import itertools
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal, pyqtSlot
+
+# Configuration (environment overrides)
+# One thread per generation Ollama runs in parallel (OLLAMA_NUM_PARALLEL, Ollama's default is 4);
+# more would only queue inside Ollama, fewer leaves a chat waiting while Ollama has a free slot
+OLLAMA_NUM_PARALLEL = int(os.getenv('OLLAMA_NUM_PARALLEL', 4))
+GENERATION_WORKERS = int(os.getenv('CUTIE_GENERATION_WORKERS', OLLAMA_NUM_PARALLEL))
+
+
+class GenerationJob(QRunnable):
+    """Runs one worker's blocking run() on a pool thread"""
+
+    def __init__(self, job_id, worker, started=None):
+        super().__init__()
+        self.job_id = job_id
+        self.worker = worker
+        self.started = started
+        self.setAutoDelete(True)
+
+    def run(self):
+        stop_token = getattr(self.worker, 'stop_token', None)
+        if stop_token is not None and stop_token.stopped:
+            # Cancelled while still queued: never open the Ollama stream
+            self.worker.finished.emit("")
+            return
+        if self.started is not None:
+            self.started(self.job_id)
+        try:
+            self.worker.run()
+        except Exception as e:
+            print(f"❌ Generation job {self.job_id} failed: {e}")
+            self.worker.finished.emit(f"❌ Error: {str(e)}")
+
+
+class GenerationPool(QObject):
+    """Small pool of long-lived generation threads fed by a job queue.
+
+    submit() takes any worker with chunk_received / finished signals, a run()
+    method and (optionally) stop(). The callbacks of a job are called on the
+    thread that owns the pool (the GUI thread), so several chats can stream at
+    once without sharing a single "is streaming" flag.
+
+    With every thread busy a job waits in the pool queue: on_queued is called
+    right away and on_started once a thread picks the job up, so the UI can
+    show the wait instead of an idle typing indicator.
+    """
+
+    # (job_id, text), emitted from pool threads and delivered queued to this object's thread
+    job_chunk = pyqtSignal(str, str)
+    job_finished = pyqtSignal(str, str)
+    job_started = pyqtSignal(str)
+
+    def __init__(self, max_workers=GENERATION_WORKERS, parent=None):
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max(1, max_workers))
+        self._pool.setExpiryTimeout(-1)  # threads stay alive between messages
+        self._jobs = {}  # job_id -> (worker, on_chunk, on_finished)
+        self._waiting = {}  # job_id -> on_started, for jobs queued behind busy threads
+        self._ids = itertools.count(1)
+        self._prefix = uuid.uuid4().hex[:6]
+        self.completed = 0
+        self.cancelled = 0
+        self.job_chunk.connect(self._route_chunk)
+        self.job_finished.connect(self._route_finished)
+        self.job_started.connect(self._route_started)
+
+    def submit(self, worker, on_chunk=None, on_finished=None, on_queued=None, on_started=None):
+        """Queue a worker; returns its job ID"""
+        job_id = f"{self._prefix}-{next(self._ids)}"
+        self._jobs[job_id] = (worker, on_chunk, on_finished)
+
+        # Direct connections run on the pool thread and only re-emit with the job ID
+        worker.chunk_received.connect(
+            lambda text, job_id=job_id: self.job_chunk.emit(job_id, text),
+            Qt.ConnectionType.DirectConnection
+        )
+        worker.finished.connect(
+            lambda text, job_id=job_id: self.job_finished.emit(job_id, text),
+            Qt.ConnectionType.DirectConnection
+        )
+
+        job = GenerationJob(job_id, worker, started=self.job_started.emit)
+        if not self._pool.tryStart(job):
+            # Every thread is streaming: the job waits for the next free one
+            self._waiting[job_id] = on_started
+            self._pool.start(job)
+            if on_queued is not None:
+                on_queued()
+        return job_id
+
+    def cancel(self, job_id):
+        """Stop a job and drop its callbacks; nothing more is delivered for it"""
+        entry = self._jobs.pop(job_id, None)
+        if entry is None:
+            return False
+        self._waiting.pop(job_id, None)
+        worker = entry[0]
+        if hasattr(worker, 'stop'):
+            worker.stop()
+        self.cancelled += 1
+        return True
+
+    def stop(self, job_id):
+        """Stop a job but still deliver its partial answer to on_finished"""
+        entry = self._jobs.get(job_id)
+        if entry is None:
+            return False
+        worker = entry[0]
+        if hasattr(worker, 'stop'):
+            worker.stop()
+        return True
+
+    def stop_all(self):
+        for job_id in list(self._jobs):
+            self.stop(job_id)
+
+    def is_active(self, job_id):
+        return job_id in self._jobs
+
+    def is_queued(self, job_id):
+        """True while the job waits for a free thread"""
+        return job_id in self._waiting
+
+    @property
+    def active_jobs(self):
+        return len(self._jobs)
+
+    @pyqtSlot(str)
+    def _route_started(self, job_id):
+        if job_id not in self._waiting:
+            return
+        on_started = self._waiting.pop(job_id)
+        if on_started is not None and job_id in self._jobs:
+            on_started()
+
+    @pyqtSlot(str, str)
+    def _route_chunk(self, job_id, text):
+        entry = self._jobs.get(job_id)
+        if entry is not None and entry[1] is not None:
+            entry[1](text)
+
+    @pyqtSlot(str, str)
+    def _route_finished(self, job_id, text):
+        self._waiting.pop(job_id, None)
+        entry = self._jobs.pop(job_id, None)
+        if entry is None:
+            return
+        self.completed += 1
+        if entry[2] is not None:
+            entry[2](text)
+
+    def shutdown(self, timeout_ms=3000):
+        """Stop every job and wait for the threads (application exit only)"""
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        return self._pool.waitForDone(timeout_ms)
+
+    def stats(self):
+        return {
+            "max_workers": self._pool.maxThreadCount(),
+            "running_threads": self._pool.activeThreadCount(),
+            "active_jobs": len(self._jobs),
+            "queued_jobs": len(self._waiting),
+            "completed": self.completed,
+            "cancelled": self.cancelled
+        }
@@ -0,0 +1,236 @@
+"""
+Generation scheduler for CutieChatter backend
+Admission control per model: batas concurrency, round-robin antar session,
+priority lane untuk prompt pendek, dan backpressure (429 + Retry-After)
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+MAX_CONCURRENT_PER_MODEL = int(os.getenv('CUTIE_MAX_CONCURRENT_PER_MODEL', 2))
+MAX_QUEUE_DEPTH = int(os.getenv('CUTIE_MAX_QUEUE_DEPTH', 32))
+SHORT_PROMPT_CHARS = int(os.getenv('CUTIE_SHORT_PROMPT_CHARS', 200))
+PRIORITY_BURST = int(os.getenv('CUTIE_PRIORITY_BURST', 4))
+DEFAULT_SERVICE_SECONDS = 10.0
+
+
+class QueueFullError(Exception):
+    """Raised when a model queue is too deep to accept more work"""
+
+    def __init__(self, model, depth, retry_after):
+        super().__init__(f"Queue for {model} is full ({depth} waiting)")
+        self.model = model
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One admitted generation request waiting for (or holding) a model slot"""
+
+    def __init__(self, model, session_id, priority):
+        self.model = model
+        self.session_id = session_id
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self.granted = False
+        self.released = False
+        self.moved = asyncio.Event()
+
+
+class ModelQueue:
+    """Slots and waiting tickets for a single model"""
+
+    def __init__(self, model, max_concurrency, max_queue_depth):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.active = 0
+        self.lanes = {True: OrderedDict(), False: OrderedDict()}  # priority -> {session_id: deque[Ticket]}
+        self.priority_streak = 0
+        self.avg_service_seconds = DEFAULT_SERVICE_SECONDS
+
+    @property
+    def depth(self):
+        return sum(len(tickets) for lane in self.lanes.values() for tickets in lane.values())
+
+    def retry_after(self):
+        """Seconds until a new request would likely get a slot"""
+        waves = (self.depth + 1) / max(1, self.max_concurrency)
+        return max(1, math.ceil(waves * self.avg_service_seconds))
+
+    def enqueue(self, ticket):
+        lane = self.lanes[ticket.priority]
+        lane.setdefault(ticket.session_id, deque()).append(ticket)
+
+    def remove(self, ticket):
+        lane = self.lanes[ticket.priority]
+        tickets = lane.get(ticket.session_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del lane[ticket.session_id]
+            return True
+        return False
+
+    def _pick_lane(self):
+        has_priority = bool(self.lanes[True])
+        has_normal = bool(self.lanes[False])
+        if has_priority and (not has_normal or self.priority_streak < PRIORITY_BURST):
+            return True
+        return False if has_normal else None
+
+    def _pop_round_robin(self, lane):
+        # Take the head ticket of the first session, then rotate that session to the back
+        session_id, tickets = next(iter(lane.items()))
+        ticket = tickets.popleft()
+        del lane[session_id]
+        if tickets:
+            lane[session_id] = tickets
+        return ticket
+
+    def pop_next(self):
+        priority = self._pick_lane()
+        if priority is None:
+            return None
+        self.priority_streak = self.priority_streak + 1 if priority else 0
+        return self._pop_round_robin(self.lanes[priority])
+
+    def service_order(self):
+        """Waiting tickets in the order they would be granted"""
+        lanes = {
+            priority: OrderedDict((sid, deque(tickets)) for sid, tickets in lane.items())
+            for priority, lane in self.lanes.items()
+        }
+        streak = self.priority_streak
+        order = []
+        while lanes[True] or lanes[False]:
+            use_priority = bool(lanes[True]) and (not lanes[False] or streak < PRIORITY_BURST)
+            streak = streak + 1 if use_priority else 0
+            lane = lanes[use_priority]
+            session_id, tickets = next(iter(lane.items()))
+            order.append(tickets.popleft())
+            del lane[session_id]
+            if tickets:
+                lane[session_id] = tickets
+        return order
+
+    def record_service_time(self, seconds):
+        # EWMA keeps Retry-After estimates tracking the current load
+        self.avg_service_seconds = 0.8 * self.avg_service_seconds + 0.2 * seconds
+
+
+class GenerationScheduler:
+    """Per-model fair scheduler used by backend2 before calling Ollama"""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENT_PER_MODEL, max_queue_depth=MAX_QUEUE_DEPTH):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.queues = {}
+
+    def _queue(self, model):
+        if model not in self.queues:
+            self.queues[model] = ModelQueue(model, self.max_concurrency, self.max_queue_depth)
+        return self.queues[model]
+
+    @staticmethod
+    def is_interactive(message):
+        """Short prompts go through the priority lane"""
+        return len(message or '') <= SHORT_PROMPT_CHARS
+
+    def submit(self, model, session_id, priority=False):
+        """Admit a request or raise QueueFullError (caller turns it into a 429)"""
+        queue = self._queue(model)
+        ticket = Ticket(model, session_id, priority)
+
+        if queue.active < queue.max_concurrency and queue.depth == 0:
+            self._grant(queue, ticket)
+            return ticket
+
+        if queue.depth >= queue.max_queue_depth:
+            raise QueueFullError(model, queue.depth, queue.retry_after())
+
+        queue.enqueue(ticket)
+        logger.info(f"⏳ Queued request for {model} (session {session_id}, depth {queue.depth})")
+        return ticket
+
+    def is_busy(self, model):
+        """True if a new request for this model would have to wait"""
+        queue = self.queues.get(model)
+        return queue is not None and (queue.active >= queue.max_concurrency or queue.depth > 0)
+
+    def position(self, ticket):
+        """1-based queue position, 0 once the ticket holds a slot"""
+        if ticket.granted:
+            return 0
+        order = self._queue(ticket.model).service_order()
+        return order.index(ticket) + 1 if ticket in order else 0
+
+    async def wait_for_turn(self, ticket):
+        """Async generator yielding queue positions until the ticket is granted"""
+        last_position = None
+        while not ticket.granted:
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            ticket.moved.clear()
+            await ticket.moved.wait()
+
+    def release(self, ticket, generated=True):
+        """Give back a slot or leave the queue (idempotent, call on the event loop)
+
+        generated=False for a slot that was never used (e.g. a response cache hit),
+        so its near-zero hold time does not drag down the Retry-After estimate.
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        queue = self._queue(ticket.model)
+
+        if ticket.granted:
+            queue.active -= 1
+            if generated:
+                queue.record_service_time(time.monotonic() - ticket.granted_at)
+        else:
+            queue.remove(ticket)
+
+        self._dispatch(queue)
+
+    def _grant(self, queue, ticket):
+        queue.active += 1
+        ticket.granted = True
+        ticket.granted_at = time.monotonic()
+        ticket.moved.set()
+
+    def _dispatch(self, queue):
+        while queue.active < queue.max_concurrency:
+            ticket = queue.pop_next()
+            if ticket is None:
+                break
+            self._grant(queue, ticket)
+
+        # Everyone still waiting moved up (or the order changed)
+        for lane in queue.lanes.values():
+            for tickets in lane.values():
+                for waiting in tickets:
+                    waiting.moved.set()
+
+    def stats(self):
+        """Snapshot for health endpoints"""
+        return {
+            model: {
+                "active": queue.active,
+                "queued": queue.depth,
+                "max_concurrency": queue.max_concurrency,
+                "avg_service_seconds": round(queue.avg_service_seconds, 2)
+            }
+            for model, queue in self.queues.items()
+        }
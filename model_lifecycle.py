@@ -0,0 +1,173 @@
+"""
+Model lifecycle manager for CutieChatter
+Warm-up model secara async saat startup, keep_alive eksplisit, dan unload
+model yang benar-benar dipakai saat idle atau saat aplikasi keluar; dengan
+OLLAMA_HOSTS warm-up dan unload dikirim ke setiap host yang punya model itu
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ollama_client import host_clients
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+DEFAULT_MODEL = os.getenv('CUTIE_MODEL', 'deepseek-r1:1.5b')
+KEEP_ALIVE = os.getenv('CUTIE_KEEP_ALIVE', '30m')
+IDLE_UNLOAD_SECONDS = float(os.getenv('CUTIE_IDLE_UNLOAD_SECONDS', 1800))
+IDLE_CHECK_INTERVAL = float(os.getenv('CUTIE_IDLE_CHECK_INTERVAL', 60))
+
+COLD, WARMING, WARM, FAILED = 'cold', 'warming', 'warm', 'failed'
+
+
+class ModelLifecycle:
+    """Tracks which models are loaded in Ollama and keeps them warm or unloads them"""
+
+    def __init__(self, clients_factory=host_clients, keep_alive=KEEP_ALIVE, idle_unload_seconds=IDLE_UNLOAD_SECONDS):
+        self._clients_factory = clients_factory
+        self.keep_alive = keep_alive
+        self.idle_unload_seconds = idle_unload_seconds
+        self._models = {}  # model -> {'state', 'last_used', 'load_seconds', 'error'}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _entry(self, model_name):
+        # Caller holds the lock
+        if model_name not in self._models:
+            self._models[model_name] = {'state': COLD, 'last_used': None, 'load_seconds': None, 'error': None}
+        return self._models[model_name]
+
+    def state(self, model_name):
+        with self._lock:
+            entry = self._models.get(model_name)
+            return entry['state'] if entry else COLD
+
+    def warm_up(self, model_name, block=False):
+        """Load a model with a zero-token request (background thread unless block=True)"""
+        with self._lock:
+            entry = self._entry(model_name)
+            if entry['state'] in (WARMING, WARM):
+                return
+            entry['state'] = WARMING
+
+        if block:
+            self._warm_up(model_name)
+        else:
+            threading.Thread(target=self._warm_up, args=(model_name,), name="ollama-warm-up", daemon=True).start()
+
+    def _each_host(self, model_name, keep_alive):
+        """Empty-prompt generate with `keep_alive` on every host that has the model, in parallel"""
+        clients = self._clients_factory(model_name)
+        if not clients:
+            raise ConnectionError(f"No Ollama host has {model_name}")
+
+        def send(client):
+            try:
+                client.generate(model=model_name, prompt='', keep_alive=keep_alive)
+                return None
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            errors = [error for error in pool.map(send, clients) if error is not None]
+        if len(errors) == len(clients):
+            raise errors[0]
+        for error in errors:
+            logger.warning(f"{model_name} keep_alive={keep_alive} failed on one host: {error}")
+
+    def _warm_up(self, model_name):
+        started = time.monotonic()
+        try:
+            # An empty prompt makes Ollama load the weights without generating
+            self._each_host(model_name, self.keep_alive)
+            load_seconds = time.monotonic() - started
+            with self._lock:
+                entry = self._entry(model_name)
+                entry.update(state=WARM, load_seconds=round(load_seconds, 2), error=None)
+                entry['last_used'] = entry['last_used'] or time.time()
+            logger.info(f"🔥 {model_name} warm in {load_seconds:.1f}s")
+        except Exception as e:
+            with self._lock:
+                self._entry(model_name).update(state=FAILED, error=str(e))
+            logger.warning(f"Warm-up of {model_name} failed: {e}")
+
+    def touch(self, model_name):
+        """Record that a generation just used this model (it is loaded now)"""
+        with self._lock:
+            entry = self._entry(model_name)
+            entry.update(state=WARM, last_used=time.time(), error=None)
+
+    def unload(self, model_name):
+        """Ask Ollama to drop a model from memory now"""
+        try:
+            self._each_host(model_name, 0)
+            logger.info(f"💤 Unloaded {model_name}")
+        except Exception as e:
+            logger.warning(f"Unload of {model_name} failed: {e}")
+        with self._lock:
+            self._entry(model_name)['state'] = COLD
+
+    def used_models(self):
+        """Models this process loaded or generated with"""
+        with self._lock:
+            return [name for name, entry in self._models.items() if entry['state'] in (WARMING, WARM)]
+
+    def unload_idle(self):
+        """Unload every used model idle for longer than idle_unload_seconds; returns count"""
+        cutoff = time.time() - self.idle_unload_seconds
+        with self._lock:
+            idle = [
+                name for name, entry in self._models.items()
+                if entry['state'] == WARM and entry['last_used'] and entry['last_used'] < cutoff
+            ]
+        for model_name in idle:
+            self.unload(model_name)
+        return len(idle)
+
+    def unload_all(self):
+        """Unload every model this process used (called on exit)"""
+        for model_name in self.used_models():
+            self.unload(model_name)
+
+    def status(self):
+        """Warm/cold snapshot for health endpoints and the desktop UI"""
+        now = time.time()
+        with self._lock:
+            return {
+                name: {
+                    'state': entry['state'],
+                    'idle_seconds': round(now - entry['last_used'], 1) if entry['last_used'] else None,
+                    'load_seconds': entry['load_seconds'],
+                    'error': entry['error']
+                }
+                for name, entry in self._models.items()
+            }
+
+    def start(self):
+        """Start the idle-unload thread (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._idle_loop, name="ollama-idle-unload", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _idle_loop(self):
+        while not self._stop.wait(IDLE_CHECK_INTERVAL):
+            self.unload_idle()
+
+
+model_lifecycle = ModelLifecycle()
+
+
+def get_lifecycle():
+    """Get the process-wide lifecycle manager, starting the idle-unload thread on first use"""
+    model_lifecycle.start()
+    return model_lifecycle
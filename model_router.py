@@ -0,0 +1,162 @@
+"""
+Latency-aware model router for CutieChatter
+Menyimpan statistik TTFT dan tokens/sec per model, prompt pendek/santai ke model
+terkecil, prompt reasoning ke model lebih besar selama masih di bawah target latency
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque
+from statistics import median
+
+from ollama_client import get_registry
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+TTFT_TARGET_SECONDS = float(os.getenv('CUTIE_ROUTER_TTFT_TARGET', 3.0))
+CASUAL_PROMPT_CHARS = int(os.getenv('CUTIE_ROUTER_CASUAL_CHARS', 160))
+ROUTER_MODELS = [m.strip() for m in os.getenv('CUTIE_ROUTER_MODELS', '').split(',') if m.strip()]
+STATS_WINDOW = int(os.getenv('CUTIE_ROUTER_STATS_WINDOW', 32))
+AUTO_MODELS = ('auto', 'ollama')
+
+# Installed models that cannot chat
+_NON_CHAT_MODEL = re.compile(r'embed|minilm|bge-|nomic', re.IGNORECASE)
+_REASONING_HINT = re.compile(
+    r'```|\b(why|how|explain|analy[sz]e|compare|prove|calculate|solve|code|debug|step by step|'
+    r'kenapa|mengapa|bagaimana|jelaskan|bandingkan|hitung|analisis|langkah)\b',
+    re.IGNORECASE
+)
+
+
+def is_auto(model_name):
+    """True if the caller asked the router to pick the model"""
+    return (model_name or '').lower() in AUTO_MODELS
+
+
+class ModelStats:
+    """Rolling TTFT and decode speed samples for one model"""
+
+    def __init__(self, window=STATS_WINDOW):
+        self.ttft = deque(maxlen=window)
+        self.tokens_per_second = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, ttft=None, tokens_per_second=None):
+        self.requests += 1
+        if ttft is not None:
+            self.ttft.append(ttft)
+        if tokens_per_second:
+            self.tokens_per_second.append(tokens_per_second)
+
+    @property
+    def ttft_p50(self):
+        return median(self.ttft) if self.ttft else None
+
+    @property
+    def tokens_per_second_p50(self):
+        return median(self.tokens_per_second) if self.tokens_per_second else None
+
+
+class ModelRouter:
+    """Picks a model per prompt from the installed Ollama models"""
+
+    def __init__(self, registry_factory=get_registry, ttft_target=TTFT_TARGET_SECONDS, allowed=ROUTER_MODELS):
+        self._registry_factory = registry_factory
+        self.ttft_target = ttft_target
+        self.allowed = allowed
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        """Chat-capable installed models, smallest first"""
+        models = [
+            model for model in self._registry_factory().models()
+            if not _NON_CHAT_MODEL.search(model['name'])
+            and (not self.allowed or model['name'] in self.allowed)
+        ]
+        return [model['name'] for model in sorted(models, key=lambda model: model['size'])]
+
+    @staticmethod
+    def is_casual(message):
+        """Short prompts without reasoning cues go to the smallest model"""
+        message = message or ''
+        return len(message) <= CASUAL_PROMPT_CHARS and not _REASONING_HINT.search(message)
+
+    def expected_ttft(self, model_name):
+        with self._lock:
+            stats = self._stats.get(model_name)
+            return stats.ttft_p50 if stats else None
+
+    def _within_target(self, model_name):
+        # No samples yet counts as fast enough so every model gets measured
+        ttft = self.expected_ttft(model_name)
+        return ttft is None or ttft <= self.ttft_target
+
+    def route(self, message, is_overloaded=None, default=None):
+        """Model name for this prompt.
+
+        `is_overloaded(model)` lets the caller veto models whose slots are full;
+        the router then falls back to the next model in preference order.
+        """
+        candidates = self.candidates()
+        if not candidates:
+            return default
+
+        # Casual: smallest first; reasoning: biggest first
+        preference = candidates if self.is_casual(message) else list(reversed(candidates))
+        available = [m for m in preference if not (is_overloaded and is_overloaded(m))] or preference
+
+        for model_name in available:
+            if self._within_target(model_name):
+                return model_name
+
+        # Everything is over target: take the fastest one we have measured
+        return min(available, key=lambda m: self.expected_ttft(m) or 0.0)
+
+    def record(self, model_name, ttft=None, done_chunk=None):
+        """Feed back one finished generation (TTFT in seconds, final Ollama chunk)"""
+        tokens_per_second = None
+        if done_chunk:
+            # Ollama durations are nanoseconds
+            eval_count = done_chunk.get('eval_count') or 0
+            eval_duration = done_chunk.get('eval_duration') or 0
+            if eval_count and eval_duration:
+                tokens_per_second = eval_count / (eval_duration / 1e9)
+            if ttft is None and done_chunk.get('prompt_eval_duration'):
+                # Non-streaming call: load + prefill is what the first token waits for
+                ttft = ((done_chunk.get('load_duration') or 0) + done_chunk['prompt_eval_duration']) / 1e9
+
+        with self._lock:
+            stats = self._stats.setdefault(model_name, ModelStats())
+            stats.record(ttft, tokens_per_second)
+
+    def stats(self):
+        """Snapshot for health endpoints / diagnostics"""
+        with self._lock:
+            return {
+                name: {
+                    'requests': stats.requests,
+                    'ttft_p50': round(stats.ttft_p50, 3) if stats.ttft_p50 is not None else None,
+                    'tokens_per_second_p50': round(stats.tokens_per_second_p50, 1) if stats.tokens_per_second_p50 else None
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+class TTFTClock:
+    """Measures time to first token for one generation"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.ttft = None
+
+    def tick(self):
+        if self.ttft is None:
+            self.ttft = time.monotonic() - self.started
+
+
+model_router = ModelRouter()
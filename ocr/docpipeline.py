@@ -0,0 +1,379 @@
+"""
+Document pipeline for large OCR files in CutieChatter
+Teks hasil OCR dipotong jadi chunk, di-embed dan di-index; tiap pertanyaan hanya
+membawa top-k chunk yang relevan, ringkasan dokumen memakai map-reduce paralel.
+Hasil OCR, embedding dan ringkasan per chunk di-cache per hash file
+"""
+
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ollama_client import get_client, get_registry
+from model_lifecycle import model_lifecycle
+
+# Configuration (environment overrides)
+DOC_CHUNK_CHARS = int(os.getenv('CUTIE_DOC_CHUNK_CHARS', 1500))
+DOC_CHUNK_OVERLAP = int(os.getenv('CUTIE_DOC_CHUNK_OVERLAP', 200))
+DOC_TOP_K = int(os.getenv('CUTIE_DOC_TOP_K', 4))
+DOC_DIRECT_CHARS = int(os.getenv('CUTIE_DOC_DIRECT_CHARS', 4000))  # smaller documents go into the prompt whole
+DOC_MAP_WORKERS = int(os.getenv('CUTIE_DOC_MAP_WORKERS', 4))
+DOC_REDUCE_CHARS = int(os.getenv('CUTIE_DOC_REDUCE_CHARS', 6000))
+DOC_NUM_CTX = int(os.getenv('CUTIE_DOC_NUM_CTX', 4096))
+EMBED_MODEL = os.getenv('CUTIE_EMBED_MODEL', 'nomic-embed-text')
+EMBED_BATCH = int(os.getenv('CUTIE_EMBED_BATCH', 32))
+DOC_CACHE_DIR = os.getenv(
+    'CUTIE_DOC_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'doc_cache')
+)
+
+_PAGE_MARKER = re.compile(r'^--- Page (\d+) ---$', re.MULTILINE)
+_WORD = re.compile(r'\w+', re.UNICODE)
+_SUMMARY_WORDS = ('summar', 'ringkas', 'rangkum', 'ikhtisar', 'overview', 'intisari', 'tl;dr', 'tldr')
+
+MAP_PROMPT = (
+    "Summarize this excerpt of the document '{name}' (page {page}) in 3-5 sentences. "
+    "Keep names, numbers and conclusions; do not add anything that is not in the text.\n\n{text}"
+)
+REDUCE_PROMPT = (
+    "These are summaries of consecutive parts of the document '{name}'. "
+    "Merge them into one coherent summary without repeating yourself.\n\n{text}"
+)
+
+
+def file_digest(path):
+    """SHA-256 of the file contents (cache key: same file, same index)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def split_pages(text):
+    """[(page number, text)] from the '--- Page N ---' markers of TextExtractor"""
+    markers = list(_PAGE_MARKER.finditer(text))
+    if not markers:
+        return [(1, text)]
+    pages = []
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        pages.append((int(marker.group(1)), text[marker.end():end]))
+    return pages
+
+
+def chunk_text(text, size=DOC_CHUNK_CHARS, overlap=DOC_CHUNK_OVERLAP):
+    """Paragraph-packed chunks of at most ~size chars, never spanning pages.
+
+    Consecutive chunks of a page share `overlap` chars so a sentence cut at a
+    boundary is still whole in one of them.
+    """
+    chunks = []
+    for page, page_text in split_pages(text):
+        paragraphs = [' '.join(p.split()) for p in re.split(r'\n\s*\n', page_text)]
+        paragraphs = [p for p in paragraphs if p]
+        current = ''
+        for paragraph in paragraphs:
+            # Paragraphs longer than a chunk are cut on whitespace
+            while len(paragraph) > size:
+                cut = paragraph.rfind(' ', 0, size)
+                cut = cut if cut > size // 2 else size
+                pieces = paragraph[:cut], paragraph[cut:].strip()
+                if current:
+                    chunks.append({'page': page, 'text': current})
+                    current = ''
+                chunks.append({'page': page, 'text': pieces[0]})
+                paragraph = pieces[0][-overlap:] + ' ' + pieces[1] if overlap else pieces[1]
+            if current and len(current) + len(paragraph) + 1 > size:
+                chunks.append({'page': page, 'text': current})
+                current = current[-overlap:] + ' ' + paragraph if overlap else paragraph
+            else:
+                current = f"{current} {paragraph}" if current else paragraph
+        if current:
+            chunks.append({'page': page, 'text': current})
+    for i, chunk in enumerate(chunks):
+        chunk['index'] = i
+    return chunks
+
+
+def _tokens(text):
+    return [token.lower() for token in _WORD.findall(text)]
+
+
+def is_summary_request(question):
+    """No real question, or one that asks for a summary of the whole document"""
+    question = (question or '').strip().lower()
+    return not question or any(word in question for word in _SUMMARY_WORDS)
+
+
+class DocumentIndex:
+    """Chunks of one document plus their embeddings (or a BM25 fallback)"""
+
+    def __init__(self, name, digest, text, chunks, vectors=None, embed_model=None):
+        self.name = name
+        self.digest = digest
+        self.text = text
+        self.chunks = chunks
+        self.vectors = vectors  # float32 [chunks, dim], L2-normalized; None -> lexical search
+        self.embed_model = embed_model
+        self._lexical = None
+
+    @property
+    def pages(self):
+        return len({chunk['page'] for chunk in self.chunks})
+
+    def search(self, query, k=DOC_TOP_K, embedder=None):
+        """Top-k chunks for the query, returned in document order"""
+        if not self.chunks:
+            return []
+        k = min(k, len(self.chunks))
+        scores = None
+        if self.vectors is not None and embedder is not None:
+            query_vector = embedder.embed([query])
+            if query_vector is not None:
+                scores = self.vectors @ query_vector[0]
+        if scores is None:
+            scores = self._bm25(query)
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        return [self.chunks[i] for i in sorted(top.tolist())]
+
+    def _bm25(self, query, k1=1.5, b=0.75):
+        if self._lexical is None:
+            docs = [Counter(_tokens(chunk['text'])) for chunk in self.chunks]
+            lengths = np.array([sum(doc.values()) for doc in docs], dtype=np.float32)
+            frequency = Counter(term for doc in docs for term in doc)
+            self._lexical = (docs, lengths, max(lengths.mean(), 1.0), frequency)
+        docs, lengths, average, frequency = self._lexical
+        scores = np.zeros(len(docs), dtype=np.float32)
+        for term in set(_tokens(query)):
+            df = frequency.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            tf = np.array([doc.get(term, 0) for doc in docs], dtype=np.float32)
+            scores += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / average))
+        return scores
+
+
+class OllamaEmbedder:
+    """Batched Ollama embeddings, L2-normalized; None when the model is not installed"""
+
+    def __init__(self, model=EMBED_MODEL, batch=EMBED_BATCH):
+        self.model = model
+        self.batch = batch
+
+    @property
+    def available(self):
+        return bool(self.model) and get_registry().is_available(self.model)
+
+    def embed(self, texts):
+        if not texts or not self.available:
+            return None
+        try:
+            client = get_client()
+            vectors = []
+            for start in range(0, len(texts), self.batch):
+                batch = texts[start:start + self.batch]
+                if hasattr(client, 'embed'):
+                    vectors.extend(client.embed(model=self.model, input=batch)['embeddings'])
+                else:
+                    # Older ollama clients: one request per text
+                    vectors.extend(client.embeddings(model=self.model, prompt=text)['embedding'] for text in batch)
+            matrix = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            return matrix / np.maximum(norms, 1e-12)
+        except Exception as e:
+            print(f"⚠️ Embedding with {self.model} failed, using keyword search: {e}")
+            return None
+
+
+class DocumentPipeline:
+    """OCR -> chunks -> index, cached on disk by file hash"""
+
+    def __init__(self, cache_dir=DOC_CACHE_DIR, embedder=None, map_workers=DOC_MAP_WORKERS):
+        self.cache_dir = cache_dir
+        self.embedder = embedder or OllamaEmbedder()
+        self.map_workers = map_workers
+        self._indexes = {}  # digest -> DocumentIndex (this session)
+        self._lock = threading.Lock()
+        self.stats_counters = {'ocr_runs': 0, 'cache_hits': 0, 'map_calls': 0, 'map_cache_hits': 0}
+
+    def _path(self, digest, suffix):
+        return os.path.join(self.cache_dir, f"{digest}{suffix}")
+
+    # --- indexing ---------------------------------------------------------
+
+    def load(self, path, extractor):
+        """Index of a file; OCR and embeddings only run the first time it is seen"""
+        digest = file_digest(path)
+        name = os.path.basename(path)
+        with self._lock:
+            index = self._indexes.get(digest)
+        if index is not None:
+            self._count('cache_hits')
+            return index
+
+        text = self._cached_text(digest)
+        if text is None:
+            print(f"📄 OCR {name}...")
+            text = extractor.extract_text_from_pdf(path)
+            if not text or text.startswith("Error processing PDF"):
+                raise ValueError(text or "Failed to extract text from PDF.")
+            self._count('ocr_runs')
+            self._write(self._path(digest, '.txt'), text)
+        else:
+            self._count('cache_hits')
+
+        chunks = chunk_text(text)
+        vectors = self._cached_vectors(digest, len(chunks))
+        if vectors is None and len(text) > DOC_DIRECT_CHARS:
+            vectors = self.embedder.embed([chunk['text'] for chunk in chunks])
+            if vectors is not None:
+                self._save_vectors(digest, vectors)
+
+        index = DocumentIndex(name, digest, text, chunks, vectors, self.embedder.model if vectors is not None else None)
+        print(f"📚 {name}: {index.pages} pages, {len(chunks)} chunks, {'embeddings' if vectors is not None else 'keyword search'}")
+        with self._lock:
+            self._indexes[digest] = index
+        return index
+
+    def _cached_text(self, digest):
+        path = self._path(digest, '.txt')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    @staticmethod
+    def _cache_key(model_name):
+        # Vectors and chunk summaries depend on the model and on how the text was chunked
+        return f"{model_name}-{DOC_CHUNK_CHARS}-{DOC_CHUNK_OVERLAP}".replace(':', '_').replace('/', '_')
+
+    def _vector_key(self):
+        return self._cache_key(self.embedder.model)
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats_counters[counter] += 1
+
+    def _cached_vectors(self, digest, count):
+        path = self._path(digest, f".{self._vector_key()}.npy")
+        if not os.path.exists(path):
+            return None
+        vectors = np.load(path)
+        return vectors if len(vectors) == count else None
+
+    def _save_vectors(self, digest, vectors):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(digest, f".{self._vector_key()}.npy")
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, vectors)
+        os.replace(tmp_path, path)
+
+    def _write(self, path, text):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    # --- prompts ----------------------------------------------------------
+
+    def question_messages(self, index, history, question, k=DOC_TOP_K):
+        """History + one user message holding only the excerpts relevant to the question"""
+        if len(index.text) <= DOC_DIRECT_CHARS:
+            context = index.text.strip()
+            header = f"File : {index.name}, Content :"
+        else:
+            excerpts = index.search(question, k, self.embedder if index.vectors is not None else None)
+            context = '\n\n'.join(f"[Page {chunk['page']}] {chunk['text']}" for chunk in excerpts)
+            header = f"File : {index.name} ({index.pages} pages), relevant excerpts :"
+        content = f"{header}\n{context}"
+        if question:
+            content += f"\n\nQuestion : {question}"
+        return history + [{'role': 'user', 'content': content}]
+
+    def summary_messages(self, index, history, question, model_name, stop_token=None):
+        """History + one user message with the map-reduced summary of the whole document"""
+        if len(index.text) <= DOC_DIRECT_CHARS:
+            return self.question_messages(index, history, question or "Summarize this document.")
+        summaries = self.map_summaries(index, model_name, stop_token)
+        combined = self.reduce(index, summaries, model_name, stop_token)
+        content = f"File : {index.name} ({index.pages} pages), section summaries :\n{combined}"
+        content += f"\n\nQuestion : {question or 'Summarize this document.'}"
+        return history + [{'role': 'user', 'content': content}]
+
+    # --- map-reduce -------------------------------------------------------
+
+    def _complete(self, model_name, prompt):
+        response = get_client().chat(
+            model=model_name,
+            messages=[{'role': 'user', 'content': prompt}],
+            stream=False,
+            options={"temperature": 0.3, "num_ctx": DOC_NUM_CTX, "num_predict": 256},
+            keep_alive=model_lifecycle.keep_alive
+        )
+        return (response.get('message', {}).get('content', '') or '').strip()
+
+    def map_summaries(self, index, model_name, stop_token=None):
+        """One summary per chunk, requested in parallel and cached per document + model"""
+        cache_path = self._path(index.digest, f".summaries.{self._cache_key(model_name)}.json")
+        cached = {}
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+
+        def summarize(chunk):
+            key = str(chunk['index'])
+            if key in cached:
+                self._count('map_cache_hits')
+                return cached[key]
+            if stop_token is not None and stop_token.stopped:
+                return ''
+            self._count('map_calls')
+            return self._complete(model_name, MAP_PROMPT.format(name=index.name, page=chunk['page'], text=chunk['text']))
+
+        # Parallel requests overlap on Ollama (OLLAMA_NUM_PARALLEL) or spread over OLLAMA_HOSTS
+        with ThreadPoolExecutor(max_workers=max(1, self.map_workers), thread_name_prefix="doc-map") as pool:
+            summaries = list(pool.map(summarize, index.chunks))
+
+        if not (stop_token is not None and stop_token.stopped):
+            cached.update({str(chunk['index']): summary for chunk, summary in zip(index.chunks, summaries) if summary})
+            self._write(cache_path, json.dumps(cached, ensure_ascii=False))
+        return [(chunk['page'], summary) for chunk, summary in zip(index.chunks, summaries) if summary]
+
+    def reduce(self, index, summaries, model_name, stop_token=None):
+        """Merge summaries group-wise until they fit in one prompt"""
+        parts = [f"[Page {page}] {summary}" for page, summary in summaries]
+        while sum(len(part) for part in parts) > DOC_REDUCE_CHARS and len(parts) > 1:
+            if stop_token is not None and stop_token.stopped:
+                break
+            groups, current = [], []
+            for part in parts:
+                if current and sum(len(p) for p in current) + len(part) > DOC_REDUCE_CHARS:
+                    groups.append(current)
+                    current = []
+                current.append(part)
+            groups.append(current)
+            if len(groups) == len(parts):
+                break  # every part is already too long on its own
+            with ThreadPoolExecutor(max_workers=max(1, self.map_workers), thread_name_prefix="doc-reduce") as pool:
+                parts = list(pool.map(
+                    lambda group: self._complete(model_name, REDUCE_PROMPT.format(name=index.name, text='\n\n'.join(group))),
+                    groups
+                ))
+        return '\n\n'.join(parts)
+
+    def stats(self):
+        with self._lock:
+            return {"documents": len(self._indexes), **self.stats_counters}
+
+
+document_pipeline = DocumentPipeline()
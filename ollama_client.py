@@ -0,0 +1,617 @@
+"""
+Shared Ollama client layer for CutieChatter
+Satu client per proses (keep-alive connection pooling) + model registry dengan TTL cache;
+dengan OLLAMA_HOSTS request dibagi ke beberapa host (least outstanding, sticky per session)
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+import itertools
+from collections import OrderedDict
+
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+OLLAMA_HOST = os.getenv('OLLAMA_HOST')  # None -> default ollama host (localhost:11434)
+MAX_CONNECTIONS = int(os.getenv('CUTIE_OLLAMA_MAX_CONNECTIONS', 32))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('CUTIE_OLLAMA_MAX_KEEPALIVE', 16))
+KEEPALIVE_EXPIRY = float(os.getenv('CUTIE_OLLAMA_KEEPALIVE_EXPIRY', 60))
+REGISTRY_TTL = float(os.getenv('CUTIE_MODEL_REGISTRY_TTL', 30))
+# Comma-separated list of Ollama hosts; more than one enables the routed host pool
+OLLAMA_HOSTS = [host.strip() for host in os.getenv('OLLAMA_HOSTS', '').split(',') if host.strip()]
+HOST_CHECK_INTERVAL = float(os.getenv('CUTIE_OLLAMA_HOST_CHECK_INTERVAL', 5))
+HOST_CHECK_TIMEOUT = float(os.getenv('CUTIE_OLLAMA_HOST_CHECK_TIMEOUT', 2))
+HOST_COOLDOWN = float(os.getenv('CUTIE_OLLAMA_HOST_COOLDOWN', 15))
+STICKY_SESSIONS = int(os.getenv('CUTIE_OLLAMA_STICKY_SESSIONS', 4096))
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def pool_limits():
+    """Connection pool limits shared by every Ollama client in this process"""
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY
+    )
+
+
+def get_client(session_key=None):
+    """Get the process-wide synchronous Ollama client
+
+    With several OLLAMA_HOSTS this is a routing client; session_key keeps a
+    conversation on the host that already holds its KV cache.
+    """
+    if host_pool is not None:
+        return RoutedClient(host_pool, session_key)
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ollama.Client(host=OLLAMA_HOST, limits=pool_limits())
+    return _client
+
+
+def get_async_client(session_key=None):
+    """Get the asyncio Ollama client bound to the running event loop"""
+    if host_pool is not None:
+        return AsyncRoutedClient(host_pool, session_key)
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = ollama.AsyncClient(host=OLLAMA_HOST, limits=pool_limits())
+        _async_clients[loop] = client
+    return client
+
+
+def host_clients(model_name=None):
+    """Synchronous clients for every usable Ollama host that has `model_name`
+
+    Without OLLAMA_HOSTS this is just the shared client. Used for calls that
+    must reach each host rather than one routed host (warm-up, unload).
+    """
+    if host_pool is None:
+        return [get_client()]
+    return host_pool.clients(model_name)
+
+
+def is_connection_error(error):
+    """True if the error means the Ollama server could not be reached"""
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+def chat_options(model_name, num_threads=None):
+    """Sampling options of the desktop OllamaWorker (shared with the batch runner)"""
+    is_deepseek = 'deepseek' in model_name.lower()
+    return {
+        "num_thread": num_threads or max(1, (os.cpu_count() or 2) // 2),
+        "temperature": 0.7 if is_deepseek else 1.1,
+        "top_k": 40,
+        "top_p": 0.9,
+        "num_ctx": 2048,
+        "num_batch": 512,
+        "repeat_penalty": 1.1,
+        "stop": ["\nHuman:", "\nUser:"] if is_deepseek else []
+    }
+
+
+class NoHealthyHostError(ConnectionError):
+    """Every Ollama host is down or cooling off"""
+
+
+class OllamaHost:
+    """One Ollama endpoint: pooled clients, in-flight count and health"""
+
+    def __init__(self, url):
+        self.url = url
+        self.in_flight = 0
+        self.healthy = True  # optimistic until the first check says otherwise
+        self.down_until = 0.0
+        self.failures = 0
+        self.requests = 0
+        self.models = None  # names installed here; None = not checked yet
+        self.entries = []
+        self.last_error = None
+        self.check_seconds = None
+        self._client = None
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = ollama.Client(host=self.url, limits=pool_limits())
+        return self._client
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = ollama.AsyncClient(host=self.url, limits=pool_limits())
+            self._async_clients[loop] = client
+        return client
+
+    def available(self, now):
+        return self.healthy and now >= self.down_until
+
+    def has_model(self, model_name):
+        if self.models is None or not model_name:
+            return True
+        return model_name in self.models or (':' not in model_name and f"{model_name}:latest" in self.models)
+
+
+class HostPool:
+    """Routes requests over several Ollama hosts.
+
+    A host is picked among the healthy ones that have the model, by fewest
+    requests in flight. A session sticks to its host while that host stays
+    usable (Ollama keeps the conversation's KV cache in the slot it used last).
+    A connection error takes a host out for HOST_COOLDOWN seconds right away;
+    the background check brings it back once /api/tags answers again.
+    """
+
+    def __init__(self, urls, check_interval=HOST_CHECK_INTERVAL, check_timeout=HOST_CHECK_TIMEOUT,
+                 cooldown=HOST_COOLDOWN, sticky_sessions=STICKY_SESSIONS):
+        self.hosts = [OllamaHost(url) for url in urls]
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.cooldown = cooldown
+        self.sticky_sessions = sticky_sessions
+        self._sticky = OrderedDict()  # session_key -> OllamaHost
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = False
+        self._ready = threading.Event()  # set once every host was checked
+        self.failovers = 0
+
+    def acquire(self, model_name=None, session_key=None, exclude=()):
+        """Pick a host for one request and count it as in flight"""
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            usable = [host for host in self.hosts if host not in exclude and host.available(now)]
+            candidates = [host for host in usable if host.has_model(model_name)] or usable
+            if not candidates:
+                raise NoHealthyHostError(f"No healthy Ollama host for {model_name or 'request'}")
+
+            host = self._sticky.get(session_key) if session_key else None
+            if host not in candidates:
+                # Least outstanding requests; the rotating tie-break spreads an idle pool evenly
+                turn = next(self._order)
+                host = min(candidates, key=lambda h: (h.in_flight, (self.hosts.index(h) - turn) % len(self.hosts)))
+            if session_key:
+                self._sticky[session_key] = host
+                self._sticky.move_to_end(session_key)
+                while len(self._sticky) > self.sticky_sessions:
+                    self._sticky.popitem(last=False)
+
+            host.in_flight += 1
+            host.requests += 1
+            return host
+
+    @property
+    def ready(self):
+        """True once the first health check of every host has finished"""
+        return self._ready.is_set()
+
+    def record_failover(self):
+        with self._lock:
+            self.failovers += 1
+
+    def release(self, host, error=None):
+        """End a request; a connection error takes the host out right away"""
+        with self._lock:
+            host.in_flight -= 1
+        if error is not None and is_connection_error(error):
+            self.mark_down(host, error)
+
+    def mark_down(self, host, error):
+        with self._lock:
+            host.healthy = False
+            host.down_until = time.monotonic() + self.cooldown
+            host.failures += 1
+            host.last_error = str(error)
+            for session_key in [key for key, sticky in self._sticky.items() if sticky is host]:
+                del self._sticky[session_key]
+        logger.warning(f"Ollama host {host.url} marked down: {error}")
+        self._wake.set()
+
+    def clients(self, model_name=None):
+        """Clients of every healthy host that has the model (no in-flight accounting)"""
+        self.start()
+        now = time.monotonic()
+        with self._lock:
+            return [host.client for host in self.hosts if host.available(now) and host.has_model(model_name)]
+
+    def has_alternative(self, model_name, exclude):
+        now = time.monotonic()
+        with self._lock:
+            return any(host not in exclude and host.available(now) and host.has_model(model_name) for host in self.hosts)
+
+    def check(self, host):
+        """Probe one host (model list); updates health and installed models"""
+        started = time.monotonic()
+        try:
+            response = ollama.Client(host=host.url, timeout=self.check_timeout).list()
+            entries = list(response.get('models', []))
+            names = {model_entry_name(entry) for entry in entries} - {''}
+            with self._lock:
+                if not host.healthy:
+                    logger.info(f"✅ Ollama host {host.url} is back")
+                host.healthy = True
+                host.down_until = 0.0
+                host.models = names
+                host.entries = entries
+                host.last_error = None
+                host.check_seconds = time.monotonic() - started
+        except Exception as e:
+            with self._lock:
+                was_healthy = host.healthy
+                host.healthy = False
+                host.last_error = str(e)
+            if was_healthy:
+                logger.warning(f"Ollama host {host.url} failed health check: {e}")
+        return host.healthy
+
+    def check_all(self):
+        for host in self.hosts:
+            self.check(host)
+        return any(host.healthy for host in self.hosts)
+
+    def list(self):
+        """Union of the models installed on healthy hosts (ollama.list() shape)"""
+        self.start()
+        with self._lock:
+            healthy = [host for host in self.hosts if host.healthy and host.models is not None]
+            if not healthy:
+                errors = '; '.join(f"{host.url}: {host.last_error}" for host in self.hosts if host.last_error)
+                raise NoHealthyHostError(errors or "No Ollama host checked yet")
+            entries = {}
+            for host in healthy:
+                for entry in host.entries:
+                    entries.setdefault(model_entry_name(entry), entry)
+        return {'models': list(entries.values())}
+
+    def start(self):
+        """Start background health checks (idempotent); the first check runs inline"""
+        with self._lock:
+            started = self._started
+            self._started = True
+            self._stop.clear()
+        if started:
+            # Another thread runs the first check; route on its result, not on guesses
+            self._ready.wait(self.check_timeout * len(self.hosts) + 1)
+            return
+        self.check_all()
+        self._ready.set()
+        self._thread = threading.Thread(target=self._check_loop, name="ollama-host-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._started = False
+        self._stop.set()
+        self._wake.set()
+
+    def _check_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.check_all()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "sticky_sessions": len(self._sticky),
+                "failovers": self.failovers,
+                "hosts": [
+                    {
+                        "url": host.url,
+                        "healthy": host.available(now),
+                        "in_flight": host.in_flight,
+                        "requests": host.requests,
+                        "failures": host.failures,
+                        "models": len(host.models) if host.models is not None else None,
+                        "check_ms": round(host.check_seconds * 1000, 1) if host.check_seconds is not None else None,
+                        "last_error": host.last_error
+                    }
+                    for host in self.hosts
+                ]
+            }
+
+
+class RoutedClient:
+    """ollama.Client look-alike that sends every call through the host pool.
+
+    Streams fail over to another host if the connection fails before the
+    first chunk; after that an error is raised as usual (the answer is partial).
+    """
+
+    def __init__(self, pool, session_key=None):
+        self.pool = pool
+        self.session_key = session_key
+
+    def chat(self, model='', **kwargs):
+        return self._call('chat', model, kwargs)
+
+    def generate(self, model='', **kwargs):
+        return self._call('generate', model, kwargs)
+
+    def embeddings(self, model='', **kwargs):
+        return self._call('embeddings', model, kwargs)
+
+    def embed(self, model='', **kwargs):
+        return self._call('embed', model, kwargs)
+
+    def list(self):
+        return self.pool.list()
+
+    def _call(self, method, model, kwargs):
+        if kwargs.get('stream'):
+            return self._stream(method, model, kwargs)
+        tried = []
+        while True:
+            host = self.pool.acquire(model, self.session_key, exclude=tried)
+            error = None
+            try:
+                return getattr(host.client, method)(model=model, **kwargs)
+            except Exception as e:
+                error = e
+                tried.append(host)
+                if not is_connection_error(e) or not self.pool.has_alternative(model, tried):
+                    raise
+                self.pool.record_failover()
+            finally:
+                self.pool.release(host, error)
+
+    def _stream(self, method, model, kwargs):
+        tried = []
+        while True:
+            host = self.pool.acquire(model, self.session_key, exclude=tried)
+            stream = None
+            started = False
+            error = None
+            try:
+                stream = getattr(host.client, method)(model=model, **kwargs)
+                for chunk in stream:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                error = e
+                tried.append(host)
+                if started or not is_connection_error(e) or not self.pool.has_alternative(model, tried):
+                    raise
+                self.pool.record_failover()
+                logger.info(f"↪️ Retrying {method} on another Ollama host after: {e}")
+            finally:
+                # Closing the inner stream drops the HTTP response (stop button / disconnect)
+                if stream is not None:
+                    stream.close()
+                self.pool.release(host, error)
+
+
+class AsyncRoutedClient(RoutedClient):
+    """ollama.AsyncClient look-alike on top of the host pool
+
+    The pool's first health check is blocking HTTP; it runs in a worker
+    thread so it never stalls the event loop.
+    """
+
+    async def _ensure_started(self):
+        if not self.pool.ready:
+            await asyncio.to_thread(self.pool.start)
+
+    async def chat(self, model='', **kwargs):
+        return await self._acall('chat', model, kwargs)
+
+    async def generate(self, model='', **kwargs):
+        return await self._acall('generate', model, kwargs)
+
+    async def embeddings(self, model='', **kwargs):
+        return await self._acall('embeddings', model, kwargs)
+
+    async def embed(self, model='', **kwargs):
+        return await self._acall('embed', model, kwargs)
+
+    async def list(self):
+        await self._ensure_started()
+        return self.pool.list()
+
+    async def _acall(self, method, model, kwargs):
+        if kwargs.get('stream'):
+            return self._astream(method, model, kwargs)
+        await self._ensure_started()
+        tried = []
+        while True:
+            host = self.pool.acquire(model, self.session_key, exclude=tried)
+            error = None
+            try:
+                return await getattr(host.async_client, method)(model=model, **kwargs)
+            except Exception as e:
+                error = e
+                tried.append(host)
+                if not is_connection_error(e) or not self.pool.has_alternative(model, tried):
+                    raise
+                self.pool.record_failover()
+            finally:
+                self.pool.release(host, error)
+
+    async def _astream(self, method, model, kwargs):
+        await self._ensure_started()
+        tried = []
+        while True:
+            host = self.pool.acquire(model, self.session_key, exclude=tried)
+            stream = None
+            started = False
+            error = None
+            try:
+                stream = await getattr(host.async_client, method)(model=model, **kwargs)
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                error = e
+                tried.append(host)
+                if started or not is_connection_error(e) or not self.pool.has_alternative(model, tried):
+                    raise
+                self.pool.record_failover()
+                logger.info(f"↪️ Retrying {method} on another Ollama host after: {e}")
+            finally:
+                if stream is not None:
+                    await stream.aclose()
+                self.pool.release(host, error)
+
+
+host_pool = HostPool(OLLAMA_HOSTS) if len(OLLAMA_HOSTS) > 1 else None
+if len(OLLAMA_HOSTS) == 1 and not OLLAMA_HOST:
+    OLLAMA_HOST = OLLAMA_HOSTS[0]
+
+
+def start_host_pool():
+    """Run the first host health check now (no-op without OLLAMA_HOSTS)"""
+    if host_pool is not None:
+        host_pool.start()
+
+
+def model_entry_name(entry):
+    """Model name from an `ollama.list()` entry (old: 'name', new: 'model')"""
+    return entry.get('model') or entry.get('name') or ''
+
+
+class ModelRegistry:
+    """TTL-cached view of the models installed on the Ollama server"""
+
+    def __init__(self, client_factory=get_client, ttl=REGISTRY_TTL):
+        self._client_factory = client_factory
+        self.ttl = ttl
+        self._models = {}
+        self._healthy = False
+        self._fetched_at = 0.0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Fetch the model list from Ollama now"""
+        try:
+            response = self._client_factory().list()
+            models = {}
+            for entry in response.get('models', []):
+                name = model_entry_name(entry)
+                if name:
+                    models[name] = {'name': name, 'size': entry.get('size', 0) or 0}
+
+            with self._lock:
+                self._models = models
+                self._healthy = True
+                self.last_error = None
+                self._fetched_at = time.monotonic()
+
+        except Exception as e:
+            with self._lock:
+                self._healthy = False
+                self.last_error = str(e)
+                self._fetched_at = time.monotonic()
+            logger.warning(f"Model registry refresh failed: {e}")
+
+        return self._healthy
+
+    def _ensure_loaded(self):
+        if self._fetched_at == 0.0:
+            self.refresh()
+
+    def models(self):
+        """Cached list of installed models"""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._models.values())
+
+    def names(self):
+        """Cached list of installed model names"""
+        return [model['name'] for model in self.models()]
+
+    def is_available(self, model_name):
+        """Check the cache for an installed model (tag optional)"""
+        names = self.names()
+        if model_name in names:
+            return True
+        return ':' not in model_name and f"{model_name}:latest" in names
+
+    def find(self, keyword):
+        """First installed model whose name contains keyword"""
+        for name in self.names():
+            if keyword.lower() in name.lower():
+                return name
+        return None
+
+    @property
+    def healthy(self):
+        self._ensure_loaded()
+        return self._healthy
+
+    def mark_unreachable(self, error):
+        """Record a failed request and ask the background thread to re-check soon"""
+        with self._lock:
+            self._healthy = False
+            self.last_error = str(error)
+        self._wake.set()
+
+    def status(self):
+        """Snapshot for health endpoints / diagnostics"""
+        with self._lock:
+            age = time.monotonic() - self._fetched_at if self._fetched_at else None
+            status = {
+                "healthy": self._healthy,
+                "models": len(self._models),
+                "age_seconds": round(age, 1) if age is not None else None,
+                "last_error": self.last_error
+            }
+        if host_pool is not None:
+            status["host_pool"] = host_pool.stats()
+        return status
+
+    def start(self):
+        """Start background refresh (idempotent)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, name="ollama-model-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop background refresh"""
+        self._stop.set()
+        self._wake.set()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._wake.wait(self.ttl)
+            self._wake.clear()
+
+
+model_registry = ModelRegistry()
+
+
+def get_registry():
+    """Get the process-wide model registry, starting background refresh on first use"""
+    model_registry.start()
+    return model_registry
@@ -0,0 +1,105 @@
+"""
+Prefix/KV reuse across turns for CutieChatter
+Menyimpan array `context` dari Ollama generate API per session, sehingga turn
+berikutnya hanya perlu prefill pesan user yang baru
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from prompts import SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+PREFIX_CACHE_ENABLED = os.getenv('CUTIE_PREFIX_CACHE', '0') == '1'
+PREFIX_CACHE_SESSIONS = int(os.getenv('CUTIE_PREFIX_CACHE_SESSIONS', 512))
+
+
+def message_key(message):
+    """Identity of a message for prefix matching.
+
+    Assistant replies are post-processed (think blocks stripped, whitespace
+    normalized) before they enter the history, so they are matched by
+    position only; system and user messages must match exactly.
+    """
+    role = message.get('role')
+    if role == 'assistant':
+        return (role,)
+    return (role, message.get('content'))
+
+
+def system_prompt(messages):
+    """The pinned system prompt, passed explicitly so the Modelfile default never applies"""
+    return "\n\n".join(m.get('content', '') for m in messages if m.get('role') == 'system') or SYSTEM_PROMPT
+
+
+class PrefixCache:
+    """Per-session Ollama `context` arrays keyed to the messages they encode"""
+
+    def __init__(self, max_sessions=PREFIX_CACHE_SESSIONS):
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()  # session_key -> {'model', 'keys', 'context'}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, session_key, model_name, messages):
+        """Generate arguments for this turn: (prompt, system, context), or None
+
+        Ollama templates a generate prompt as one user turn, so generate is only
+        used when a single user message is new: on a hit (everything before it is
+        in the cached context) and on the first turn of a session, which starts
+        the context. Any other miss (edited or trimmed history, other model,
+        history from before the cache) drops the stale entry and returns None;
+        the caller then sends the full conversation through /api/chat.
+        """
+        keys = [message_key(message) for message in messages]
+        system = system_prompt(messages)
+
+        with self._lock:
+            entry = self._entries.get(session_key)
+            if entry is not None:
+                covered = len(entry['keys'])
+                if (
+                    entry['model'] == model_name
+                    and len(keys) == covered + 1
+                    and keys[:covered] == entry['keys']
+                    and keys[-1][0] == 'user'
+                ):
+                    self._entries.move_to_end(session_key)
+                    self.hits += 1
+                    return messages[-1].get('content', ''), system, entry['context']
+
+                # Stale: history was edited, trimmed or the model changed
+                del self._entries[session_key]
+            self.misses += 1
+
+        turns = [m for m in messages if m.get('role') != 'system']
+        if len(turns) == 1 and turns[0].get('role') == 'user':
+            return turns[0].get('content', ''), system, None
+        return None
+
+    def store(self, session_key, model_name, messages, context):
+        """Remember the context returned after answering `messages`"""
+        if not context:
+            return
+        keys = [message_key(message) for message in messages] + [('assistant',)]
+        with self._lock:
+            self._entries[session_key] = {'model': model_name, 'keys': keys, 'context': list(context)}
+            self._entries.move_to_end(session_key)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, session_key):
+        with self._lock:
+            self._entries.pop(session_key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+prefix_cache = PrefixCache()
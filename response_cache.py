@@ -0,0 +1,190 @@
+"""
+Response cache in front of Ollama for CutieChatter
+Tier exact (hash ter-normalisasi dari model, opsi sampling, system prompt + N turn
+terakhir) dan tier semantic opsional (mean-pooled embedding dari sentiment.memory.textsimilarity)
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+RESPONSE_CACHE_ENABLED = os.getenv('CUTIE_RESPONSE_CACHE', '0') == '1'
+RESPONSE_CACHE_SIZE = int(os.getenv('CUTIE_RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = float(os.getenv('CUTIE_RESPONSE_CACHE_TTL', 3600))
+RESPONSE_CACHE_TURNS = int(os.getenv('CUTIE_RESPONSE_CACHE_TURNS', 3))
+SEMANTIC_CACHE_ENABLED = os.getenv('CUTIE_SEMANTIC_CACHE', '0') == '1'
+SEMANTIC_THRESHOLD = float(os.getenv('CUTIE_SEMANTIC_THRESHOLD', 0.92))
+
+_NON_WORD = re.compile(r'[^\w\s]+')
+_WHITESPACE = re.compile(r'\s+')
+_REPLAY_TOKEN = re.compile(r'\S+\s*|\s+')
+
+
+def normalize(text):
+    """Case, punctuation and whitespace insensitive form used for keys"""
+    return _WHITESPACE.sub(' ', _NON_WORD.sub(' ', (text or '').lower())).strip()
+
+
+def replay_chunks(text):
+    """Split a cached response into word-sized chunks to simulate a token stream"""
+    return _REPLAY_TOKEN.findall(text or '')
+
+
+class TextSimilarityEmbedder:
+    """Embeds text with the existing mean-pooled encoder code (TextSimilaritySearch)"""
+
+    def __init__(self, model, tokenizer, device):
+        from sentiment.memory.textsimilarity import TextSimilaritySearch
+        self.search = TextSimilaritySearch()
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+
+    def __call__(self, text):
+        embedding = self.search.get_embedding(text, self.model, self.tokenizer, self.device)
+        return self.search.normalize_embeddings(embedding)[0]
+
+
+class ResponseCache:
+    """TTL/LRU cache of final responses keyed on the recent conversation"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, last_turns=RESPONSE_CACHE_TURNS,
+                 semantic_threshold=SEMANTIC_THRESHOLD, embedder=None, enabled=RESPONSE_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.last_turns = last_turns
+        self.semantic_threshold = semantic_threshold
+        self.embedder = embedder
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> {'response', 'created', 'bucket', 'embedding'}
+        self._buckets = {}             # bucket -> set of keys (semantic tier candidates)
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def set_embedder(self, embedder):
+        """Enable the semantic tier (None disables it)"""
+        self.embedder = embedder
+
+    def _parts(self, messages, model=None, options=None):
+        system = "\n".join(m.get('content', '') for m in messages if m.get('role') == 'system')
+        turns = [m for m in messages if m.get('role') != 'system'][-self.last_turns:]
+        if not turns or turns[-1].get('role') != 'user':
+            return None
+        # Another model or sampling setup must not be answered from this one's cache
+        options = options or {}
+        generation = f"{model}|{options.get('num_predict')}|{options.get('temperature')}"
+        context = [f"{m.get('role')}:{normalize(m.get('content'))}" for m in turns[:-1]]
+        bucket = hashlib.sha256("\x1e".join([generation, normalize(system)] + context).encode('utf-8')).hexdigest()
+        query = normalize(turns[-1].get('content'))
+        key = hashlib.sha256(f"{bucket}\x1e{query}".encode('utf-8')).hexdigest()
+        return key, bucket, query
+
+    def _expired(self, entry):
+        return time.time() - entry['created'] > self.ttl
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._buckets.get(entry['bucket'])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[entry['bucket']]
+
+    def get(self, messages, model=None, options=None):
+        """Cached response for this conversation state, model and options, or None"""
+        if not self.enabled:
+            return None
+        parts = self._parts(messages, model, options)
+        if parts is None:
+            return None
+        key, bucket, query = parts
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry['response']
+            candidates = [
+                (k, self._entries[k]) for k in self._buckets.get(bucket, ())
+                if self._entries[k]['embedding'] is not None
+            ]
+
+        if self.embedder is not None and SEMANTIC_CACHE_ENABLED and candidates:
+            try:
+                embedding = self.embedder(query)
+                best_key, best_score = None, self.semantic_threshold
+                for candidate_key, candidate in candidates:
+                    score = float(embedding @ candidate['embedding'])
+                    if score >= best_score:
+                        best_key, best_score = candidate_key, score
+
+                with self._lock:
+                    entry = self._entries.get(best_key) if best_key else None
+                    if entry is not None and not self._expired(entry):
+                        self._entries.move_to_end(best_key)
+                        self.semantic_hits += 1
+                        return entry['response']
+            except Exception as e:
+                logger.warning(f"Semantic cache lookup failed: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, messages, response, model=None, options=None):
+        """Cache the final response `model` generated for `messages` with `options`"""
+        if not self.enabled or not response or not response.strip():
+            return
+        parts = self._parts(messages, model, options)
+        if parts is None:
+            return
+        key, bucket, query = parts
+
+        embedding = None
+        if self.embedder is not None and SEMANTIC_CACHE_ENABLED:
+            try:
+                embedding = self.embedder(query)
+            except Exception as e:
+                logger.warning(f"Semantic cache embedding failed: {e}")
+
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = {'response': response, 'created': time.time(), 'bucket': bucket, 'embedding': embedding}
+            self._buckets.setdefault(bucket, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'semantic': self.embedder is not None and SEMANTIC_CACHE_ENABLED,
+                'size': len(self._entries),
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.exact_hits + self.semantic_hits) / lookups, 4) if lookups else 0.0
+            }
+
+
+response_cache = ResponseCache()
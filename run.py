@@ -1,4 +1,4 @@
-import sys, subprocess
+import sys
 from PyQt6.QtWidgets import QApplication
 from cutie import CutieTheCutest
 
@@ -9,7 +9,13 @@ from cutie import CutieTheCutest
 '''
 
 def on_quit():
-    subprocess.run(["ollama", "stop", "deepseek-r1:8b"], check=True) 
+    # unload whichever models this session actually loaded
+    try:
+        from model_lifecycle import model_lifecycle
+        model_lifecycle.stop()
+        model_lifecycle.unload_all()
+    except ImportError:
+        pass
 
 if __name__ == "__main__":
 
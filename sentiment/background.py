@@ -0,0 +1,87 @@
+"""
+Background inference executor for sentiment / similarity analysis
+Analisis sentimen dan similarity jalan di thread terpisah sehingga generasi
+langsung dimulai; hasilnya ditempelkan ke turn begitu selesai. Prompt hanya
+dikondisikan dengan emosi user kalau hasilnya datang sebelum deadline
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Configuration (environment overrides)
+SENTIMENT_WORKERS = int(os.getenv('CUTIE_SENTIMENT_WORKERS', 2))
+SENTIMENT_CONDITIONING = os.getenv('CUTIE_SENTIMENT_CONDITIONING', '0') == '1'
+SENTIMENT_DEADLINE_MS = float(os.getenv('CUTIE_SENTIMENT_DEADLINE_MS', 50))
+
+CONDITIONING_PROMPT = "The user's last message reads as {emotion}. Let that set the tone of your reply; do not mention it."
+
+
+class InferenceExecutor:
+    """Small thread pool for model passes that must not delay the first token"""
+
+    def __init__(self, workers=SENTIMENT_WORKERS, conditioning=SENTIMENT_CONDITIONING, deadline_ms=SENTIMENT_DEADLINE_MS):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="sentiment")
+        self.conditioning = conditioning
+        self.deadline = max(0.0, deadline_ms) / 1000
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'conditioned': 0, 'missed_deadline': 0}
+
+    def submit(self, fn, *args, callback=None):
+        """Run fn(*args) in the background; callback(result) runs on the worker thread"""
+        with self._lock:
+            self._counters['submitted'] += 1
+
+        def run():
+            try:
+                result = fn(*args)
+                if callback is not None:
+                    callback(result)
+            except Exception as e:
+                with self._lock:
+                    self._counters['failed'] += 1
+                print(f"⚠️ Background analysis failed: {e}")
+                raise
+            with self._lock:
+                self._counters['completed'] += 1
+            return result
+
+        return self._pool.submit(run)
+
+    def conditioning_message(self, future):
+        """System hint with the user's emotion, or None when disabled, failed or past the deadline"""
+        if future is None or not self.conditioning:
+            return None
+        try:
+            prediction = future.result(timeout=self.deadline)
+        except FutureTimeout:
+            with self._lock:
+                self._counters['missed_deadline'] += 1
+            return None
+        except Exception:
+            return None
+        prediction = prediction[0] if isinstance(prediction, tuple) else prediction
+        emotion = getattr(prediction, 'dominant_primary_emotion', None)
+        if not emotion or emotion in ('Error', 'neutral'):
+            return None
+        with self._lock:
+            self._counters['conditioned'] += 1
+        return {'role': 'system', 'content': CONDITIONING_PROMPT.format(emotion=emotion)}
+
+    def condition(self, messages, future):
+        """Messages with the emotion hint just before the last user turn (prefix stays reusable)"""
+        hint = self.conditioning_message(future)
+        if hint is None or not messages:
+            return messages
+        return messages[:-1] + [hint] + messages[-1:]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['pending'] = counters['submitted'] - counters['completed'] - counters['failed']
+        counters['conditioning'] = self.conditioning
+        counters['deadline_ms'] = self.deadline * 1000
+        return counters
@@ -0,0 +1,121 @@
+"""
+Dynamic micro-batching for the emotion classifier
+Panggilan dari beberapa thread (desktop, chat bridge, chat paralel) dikumpulkan
+beberapa milidetik lalu dijalankan sebagai satu batch ber-padding
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Configuration (environment overrides)
+SENTIMENT_MAX_BATCH = int(os.getenv('CUTIE_SENTIMENT_MAX_BATCH', 32))
+SENTIMENT_BATCH_WAIT_MS = float(os.getenv('CUTIE_SENTIMENT_BATCH_WAIT_MS', 5))
+
+
+class MicroBatcher:
+    """Collects single-text requests into batches for a `classify_batch(texts)` function.
+
+    The first request opens a window of `max_wait_ms`; everything that arrives
+    in it (up to `max_batch`) is classified in one call on the batcher thread,
+    which is also the only thread touching the model. A lone caller (previous
+    batch of one, nothing else queued) is dispatched without waiting.
+    """
+
+    def __init__(self, classify_batch, max_batch=SENTIMENT_MAX_BATCH, max_wait_ms=SENTIMENT_BATCH_WAIT_MS):
+        self.classify_batch = classify_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._last_batch = 1
+        self._counters = {'requests': 0, 'batches': 0, 'max_batch_seen': 0, 'errors': 0}
+
+    def submit(self, text):
+        """Future resolving to the prediction for `text`"""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sentiment-batcher", daemon=True)
+                self._thread.start()
+            self._counters['requests'] += 1
+        self._queue.put((text, future))
+        return future
+
+    def classify(self, text, timeout=None):
+        """Blocking single prediction (batched with concurrent callers)"""
+        return self.submit(text).result(timeout)
+
+    def classify_many(self, texts, timeout=None):
+        """Predictions for several texts, sharing batches with other callers"""
+        futures = [self.submit(text) for text in texts]
+        return [future.result(timeout) for future in futures]
+
+    def _collect(self):
+        """Block for one request, then gather more until the window or the batch is full"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        if self._last_batch == 1 and self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            self._last_batch = len(batch)
+            with self._lock:
+                self._counters['batches'] += 1
+                self._counters['max_batch_seen'] = max(self._counters['max_batch_seen'], len(batch))
+            try:
+                predictions = self.classify_batch([text for text, _ in batch])
+            except Exception as e:
+                with self._lock:
+                    self._counters['errors'] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+    def close(self):
+        """Finish queued requests and stop the batcher thread"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['mean_batch'] = round(counters['requests'] / counters['batches'], 2) if counters['batches'] else None
+        counters['max_batch'] = self.max_batch
+        counters['max_wait_ms'] = self.max_wait * 1000
+        return counters
@@ -32,13 +32,16 @@ class TextSimilaritySearch:
         # Get the model outputs
         outputs = model(**inputs)
         
-        # Use the last hidden state instead of all hidden states
-        last_hidden_state = outputs.last_hidden_state
-        
-        # Mean pooling - take average of all tokens
-        attention_mask = inputs['attention_mask']
-        input_mask_expanded = attention_mask.unsqueeze(-1).expand(last_hidden_state.size()).float()
-        sentence_embeddings = torch.sum(last_hidden_state * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
+        # A SharedEncoderModel already returns the mean-pooled embedding
+        sentence_embeddings = getattr(outputs, 'sentence_embedding', None)
+        if sentence_embeddings is None:
+            # Use the last hidden state instead of all hidden states
+            last_hidden_state = outputs.last_hidden_state
+            
+            # Mean pooling - take average of all tokens
+            attention_mask = inputs['attention_mask']
+            input_mask_expanded = attention_mask.unsqueeze(-1).expand(last_hidden_state.size()).float()
+            sentence_embeddings = torch.sum(last_hidden_state * input_mask_expanded, 1) / torch.clamp(input_mask_expanded.sum(1), min=1e-9)
         
         # Convert to numpy and handle batch dimension properly
         embeddings = sentence_embeddings.cpu().numpy()
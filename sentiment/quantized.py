@@ -0,0 +1,316 @@
+"""
+Quantized CPU inference for the stardust_6 classifier and encoder
+Ekspor ke ONNX INT8 (onnxruntime) atau INT8 dinamis torch, dengan cek paritas
+terhadap logits fp32; load_models memakainya otomatis kalau jalan di CPU
+
+Usage:
+    python -m sentiment.quantized CoreDynamics/models/stardust_6 --format onnx
+    python -m sentiment.quantized CoreDynamics/models/stardust_6 --format int8 --kind all
+
+Kinds: 'shared' (logits + embedding from one backbone, what load_models uses),
+'classifier' (logits only) and 'encoder' (hidden states only).
+"""
+
+import os
+import json
+import time
+import inspect
+import argparse
+import statistics
+
+import torch
+from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+from transformers.modeling_outputs import BaseModelOutput, SequenceClassifierOutput
+
+from sentiment.shared_encoder import SharedEncoderModel, SharedEncoderOutput, mean_pool
+
+# Configuration (environment overrides)
+QUANT_BACKEND = os.getenv('CUTIE_SENTIMENT_BACKEND', 'auto')  # auto | onnx | int8 | torch
+QUANT_MIN_AGREEMENT = float(os.getenv('CUTIE_QUANT_MIN_AGREEMENT', 0.95))  # classifier: same top emotion
+QUANT_MIN_COSINE = float(os.getenv('CUTIE_QUANT_MIN_COSINE', 0.98))        # encoder: mean cosine to fp32
+QUANT_DIRNAME = 'quantized'
+MANIFEST = 'manifest.json'
+
+KINDS = ('shared', 'classifier', 'encoder')
+FORMATS = ('onnx', 'int8')
+
+PARITY_TEXTS = (
+    "I feel so down today, and my mom asked me to wash the dishes",
+    "Good job my nephew! I felt really happy today, how about you?",
+    "Nah, he mocked me too often and I'm sick of it",
+    "I can't believe you remembered my birthday, I love you so much",
+    "Why would you do that to me?! I'm furious right now",
+    "I'm scared of walking home alone at night",
+    "Wait, what? You got married last week?",
+    "Aku sedih banget hari ini, rasanya pengen nangis",
+    "Yeay! Aku lulus ujian, senang sekali",
+    "Kamu tuh bikin aku kesel terus, capek deh",
+    "Aku takut banget sama petir tadi malam",
+    "Hah? Serius kamu pindah ke Jepang?",
+    "Makasih ya sudah selalu ada buat aku, sayang kamu",
+    "Meh, it's fine I guess. Nothing special happened.",
+    "My dog passed away this morning and the house feels empty",
+    "We won the finals!!! Best day of my life",
+    "Please don't leave, I don't know what I'd do without you",
+    "That customer service agent was unbelievably rude",
+    "I have a job interview tomorrow and my hands are shaking",
+    "Oh wow, I did not expect a surprise party at all",
+    "Hari ini biasa aja sih, kerja terus pulang",
+    "Dia ninggalin aku tanpa penjelasan apa pun",
+    "Aku kaget banget pas lihat nilai rapor",
+    "Lagi kangen masa-masa kuliah dulu, seru tapi sedih juga",
+)
+
+
+def quantized_dir(model_path):
+    return os.path.join(model_path, QUANT_DIRNAME)
+
+
+def read_manifest(model_path):
+    path = os.path.join(quantized_dir(model_path), MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write_manifest(model_path, manifest):
+    path = os.path.join(quantized_dir(model_path), MANIFEST)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class OnnxModel:
+    """onnxruntime session behind the HF call interface (model(**inputs)[0] / .last_hidden_state)"""
+
+    def __init__(self, path, kind, threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.kind = kind
+
+    def __call__(self, **inputs):
+        feed = {name: value.cpu().numpy() for name, value in inputs.items() if name in self.input_names}
+        outputs = [torch.from_numpy(output) for output in self.session.run(None, feed)]
+        if self.kind == 'classifier':
+            return SequenceClassifierOutput(logits=outputs[0])
+        if self.kind == 'encoder':
+            return BaseModelOutput(last_hidden_state=outputs[0])
+        return SharedEncoderOutput(
+            logits=outputs[0],
+            last_hidden_state=outputs[1],
+            sentence_embedding=mean_pool(outputs[1], inputs['attention_mask'].cpu())
+        )
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+class _ExportHead(torch.nn.Module):
+    """(input_ids, attention_mask) -> logits and/or last hidden state, for tracing"""
+
+    def __init__(self, model, kind):
+        super().__init__()
+        self.model = model
+        self.kind = kind
+
+    def forward(self, input_ids, attention_mask):
+        output = self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+        if self.kind == 'classifier':
+            return output.logits
+        if self.kind == 'encoder':
+            return output.last_hidden_state
+        return output.logits, output.last_hidden_state
+
+
+def load_reference(model_path, kind):
+    """fp32 tokenizer + model on CPU, prepared the same way as load_models"""
+    tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=True, model_max_length=512, trust_remote_code=True)
+    if tokenizer.pad_token is None:
+        if tokenizer.eos_token is not None:
+            tokenizer.pad_token = tokenizer.eos_token
+        elif tokenizer.unk_token is not None:
+            tokenizer.pad_token = tokenizer.unk_token
+        else:
+            tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+    if kind == 'encoder':
+        model = AutoModel.from_pretrained(model_path, trust_remote_code=True)
+    else:
+        model = AutoModelForSequenceClassification.from_pretrained(model_path, num_labels=6, trust_remote_code=True)
+    if tokenizer.pad_token == '[PAD]':
+        model.resize_token_embeddings(len(tokenizer))
+    if kind == 'shared':
+        model = SharedEncoderModel(model)
+    return tokenizer, model.eval()
+
+
+def export_int8(model, path):
+    """Dynamic INT8 quantization of every nn.Linear (weights int8, activations quantized on the fly)"""
+    quantized = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    torch.save(quantized, path)
+    return quantized
+
+
+def export_onnx(model, tokenizer, kind, path):
+    """ONNX export with dynamic batch / sequence axes, then onnxruntime dynamic INT8 quantization"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    sample = tokenizer(["export sample", "a slightly longer export sample text"], return_tensors="pt", padding=True)
+    fp32_path = path.replace('.int8.onnx', '.fp32.onnx')
+    output_names = {'classifier': ['logits'], 'encoder': ['last_hidden_state']}.get(kind, ['logits', 'last_hidden_state'])
+    kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+    torch.onnx.export(
+        _ExportHead(model, kind),
+        (sample['input_ids'], sample['attention_mask']),
+        fp32_path,
+        input_names=['input_ids', 'attention_mask'],
+        output_names=output_names,
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            **{name: {0: 'batch'} if name == 'logits' else {0: 'batch', 1: 'sequence'} for name in output_names}
+        },
+        opset_version=17,
+        **kwargs
+    )
+    quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+    return OnnxModel(path, kind)
+
+
+def _outputs(model, tokenizer, kind, texts):
+    """Logits ([n, 6]) and/or mean-pooled embeddings ([n, hidden]) for the parity texts, one text per pass"""
+    logits, embeddings, seconds = [], [], []
+    with torch.no_grad():
+        for text in texts:
+            inputs = tokenizer([text], return_tensors="pt", truncation=True, padding=True, max_length=512,
+                               return_token_type_ids=False, return_attention_mask=True)
+            started = time.perf_counter()
+            output = model(**inputs)
+            seconds.append(time.perf_counter() - started)
+            if kind != 'encoder':
+                logits.append(output[0][0].float())
+            if kind != 'classifier':
+                embedding = getattr(output, 'sentence_embedding', None)
+                if embedding is None:
+                    embedding = mean_pool(output.last_hidden_state.float(), inputs['attention_mask'])
+                embeddings.append(embedding[0].float())
+    return (
+        torch.stack(logits) if logits else None,
+        torch.stack(embeddings) if embeddings else None,
+        statistics.median(seconds)
+    )
+
+
+def parity_check(reference, candidate, tokenizer, kind, texts=PARITY_TEXTS):
+    """Accuracy and batch-1 latency of the candidate against the fp32 reference"""
+    expected_logits, expected_embeddings, reference_seconds = _outputs(reference, tokenizer, kind, texts)
+    actual_logits, actual_embeddings, candidate_seconds = _outputs(candidate, tokenizer, kind, texts)
+    report = {
+        'texts': len(texts),
+        'fp32_ms': round(reference_seconds * 1000, 2),
+        'quantized_ms': round(candidate_seconds * 1000, 2),
+        'speedup': round(reference_seconds / candidate_seconds, 2) if candidate_seconds else None
+    }
+    passed = True
+    if expected_logits is not None:
+        agreement = (expected_logits.argmax(1) == actual_logits.argmax(1)).float().mean().item()
+        report.update({
+            'top_emotion_agreement': round(agreement, 4),
+            'max_abs_logit_diff': round((expected_logits - actual_logits).abs().max().item(), 4)
+        })
+        passed = passed and agreement >= QUANT_MIN_AGREEMENT
+    if expected_embeddings is not None:
+        cosine = torch.nn.functional.cosine_similarity(expected_embeddings, actual_embeddings, dim=1)
+        report.update({
+            'mean_cosine': round(cosine.mean().item(), 4),
+            'min_cosine': round(cosine.min().item(), 4)
+        })
+        passed = passed and cosine.mean().item() >= QUANT_MIN_COSINE
+    report['passed'] = passed
+    return report
+
+
+def export(model_path, fmt, kinds=KINDS):
+    """Export, parity-check and register each kind; returns the manifest"""
+    os.makedirs(quantized_dir(model_path), exist_ok=True)
+    manifest = read_manifest(model_path)
+    for kind in kinds:
+        tokenizer, reference = load_reference(model_path, kind)
+        filename = f"{kind}.int8.onnx" if fmt == 'onnx' else f"{kind}.int8.pt"
+        path = os.path.join(quantized_dir(model_path), filename)
+        print(f"📦 Exporting {kind} to {fmt} ({path})...")
+        if fmt == 'onnx':
+            candidate = export_onnx(reference, tokenizer, kind, path)
+        else:
+            candidate = export_int8(reference, path)
+        report = parity_check(reference, candidate, tokenizer, kind)
+        report['fp32_mb'] = round(sum(p.numel() * p.element_size() for p in reference.parameters()) / 2**20, 1)
+        report['quantized_mb'] = round(os.path.getsize(path) / 2**20, 1)
+        manifest.setdefault(kind, {})[fmt] = {'file': filename, **report}
+        print(f"{'✅' if report['passed'] else '❌'} {kind}/{fmt}: {json.dumps(report)}")
+        write_manifest(model_path, manifest)
+    return manifest
+
+
+def load_optimized(model_path, kind, device, backend=QUANT_BACKEND):
+    """Quantized model for `kind` when running on CPU and an export that passed parity exists, else None"""
+    if backend == 'torch' or getattr(device, 'type', str(device)) != 'cpu' or not os.path.isdir(model_path):
+        return None
+    entries = read_manifest(model_path).get(kind, {})
+    for fmt in (FORMATS if backend == 'auto' else (backend,)):
+        entry = entries.get(fmt)
+        if not entry:
+            continue
+        if not entry.get('passed'):
+            print(f"⚠️ Skipping {kind}/{fmt} export: parity check failed")
+            continue
+        path = os.path.join(quantized_dir(model_path), entry['file'])
+        if not os.path.exists(path) or (fmt == 'onnx' and not onnxruntime_available()):
+            continue
+        try:
+            if fmt == 'onnx':
+                model = OnnxModel(path, kind)
+            else:
+                model = torch.load(path, weights_only=False).eval()  # our own export, not an untrusted file
+            print(f"⚡ Using {'ONNX' if fmt == 'onnx' else 'torch'} INT8 {kind} ({entry.get('speedup')}x faster than fp32 at export)")
+            return model
+        except Exception as e:
+            print(f"⚠️ Could not load {kind}/{fmt} export: {e}")
+    return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the emotion classifier / encoder for quantized CPU inference")
+    parser.add_argument('model_path', help="fp32 model directory (e.g. CoreDynamics/models/stardust_6)")
+    parser.add_argument('--format', choices=FORMATS, default='onnx' if onnxruntime_available() else 'int8')
+    parser.add_argument('--kind', choices=KINDS + ('all',), default='shared')
+    parser.add_argument('--threads', type=int, default=None, help="torch intra-op threads while measuring")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    manifest = export(args.model_path, args.format, KINDS if args.kind == 'all' else (args.kind,))
+    failed = [f"{kind}/{fmt}" for kind, entries in manifest.items() for fmt, entry in entries.items() if not entry['passed']]
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
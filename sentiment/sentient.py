@@ -1,8 +1,8 @@
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 import os
-from typing import Dict, Optional
-from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
 
 CompositeDictionary = {
     "bittersweet": {
@@ -79,6 +79,7 @@ class EmotionPrediction:
     dominant_composite_emotion: str
     dominant_composite_logits: float
     top_n_composite_emotions: Dict[str, float]
+    sentence_embedding: Optional[Any] = field(default=None, repr=False)  # mean-pooled, from a SharedEncoderModel
 
 class EmotionClassifier:
     def __init__(self,
@@ -95,13 +96,9 @@ class EmotionClassifier:
         self.emotion_to_label = {0: 'sadness', 1: 'joy', 2: 'love', 3: 'anger', 4: 'fear', 5: 'surprise'}
         self.composite_dictionary = composite_dictionary or {}
 
-        self.composite_cache = {
-            name: (
-                torch.tensor(data['emotions'], device=self.device),
-                torch.tensor(data['weights'], device=self.device, dtype=torch.float32)
-            )
-            for name, data in self.composite_dictionary.items()
-        }
+        self.composite_names, self.composite_matrix = compile_composites(
+            self.composite_dictionary, len(self.emotion_to_label), self.device
+        )
 
     @torch.no_grad()  
     def GetEmotionForClassification(
@@ -112,27 +109,92 @@ class EmotionClassifier:
         max_length: int = 512,
         top_n: int = 5
     ) -> EmotionPrediction:
-        try:
-            inputs = self.tokenizer(
-                texts,
-                return_tensors="pt",
-                truncation=True,
-                padding=True,
-                max_length=max_length,
-                return_token_type_ids=False,  
-                return_attention_mask=True
-            )
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            logits = self.model(**inputs)[0]
-            
-            logits = logits / temperature
+        return self.classify_batch(
+            [texts],
+            threshold=threshold,
+            temperature=temperature,
+            max_length=max_length,
+            top_n=top_n
+        )[0]
 
-            logits_np = logits.cpu().numpy()[0]
+    @torch.no_grad()
+    def classify_batch(
+        self,
+        texts: List[str],
+        threshold: float = 0,
+        temperature: float = 1.0,
+        max_length: int = 512,
+        top_n: int = 5,
+        batch_size: int = 32
+    ) -> List[EmotionPrediction]:
+        """One EmotionPrediction per text, in input order.
+
+        Texts are sorted by length and run as padded batches of `batch_size`,
+        so similar lengths share a forward pass and little compute goes to padding.
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        predictions = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            indices = order[start:start + batch_size]
+            try:
+                inputs = self.tokenizer(
+                    [texts[i] for i in indices],
+                    return_tensors="pt",
+                    truncation=True,
+                    padding=True,
+                    max_length=max_length,
+                    return_token_type_ids=False,  
+                    return_attention_mask=True
+                )
+                inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+                output = self.model(**inputs)
+                logits = output[0]
+                embeddings = getattr(output, 'sentence_embedding', None)
 
+                logits = logits / temperature
+
+                for i, prediction in zip(indices, self._predictions(logits, threshold, top_n, embeddings)):
+                    predictions[i] = prediction
+            except Exception as e:
+                print(f"Error in emotion classification: {str(e)}")
+                for i in indices:
+                    predictions[i] = self._error_prediction()
+        return predictions
+
+    def _predictions(
+        self,
+        logits: torch.Tensor,
+        threshold: float,
+        top_n: int,
+        embeddings: Optional[torch.Tensor] = None
+    ) -> List[EmotionPrediction]:
+        """EmotionPrediction per row of a [batch, 6] logits tensor.
+
+        Composite scores are one matmul against the [composites x 6] matrix;
+        thresholding and top-n happen on the device and logits, top values, top
+        indices (and sentence embeddings, if the model returns them) come back
+        to the host in a single transfer.
+        """
+        labels = logits.shape[1]
+        k = min(top_n, len(self.composite_names))
+        parts = [logits.float()]
+        if k > 0:
+            scores = logits.float() @ self.composite_matrix.T
+            scores = scores.masked_fill(scores < threshold, float('-inf'))
+            top_values, top_indices = scores.topk(k, dim=1)
+            parts += [top_values, top_indices.float()]
+        if embeddings is not None:
+            parts.append(embeddings.float())
+        packed = torch.cat(parts, dim=1).cpu().numpy()
+
+        predictions = []
+        for row in packed:
             emotion_logits = {
                 self.emotion_to_label[i]: float(logit)
-                for i, logit in enumerate(logits_np)
+                for i, logit in enumerate(row[:labels])
             }
             
             filtered_emotions = {
@@ -147,51 +209,52 @@ class EmotionClassifier:
                 default=("neutral", 0)
             )
             
-            composite_logits = {}
-            for name, (indices, weights) in self.composite_cache.items():
-                selected_logits = logits.index_select(1, indices)
-                score = (selected_logits * weights).sum().item()
-                composite_logits[name] = score
-            
-            filtered_composites = {
-                k: v for k, v in composite_logits.items() 
-                if v >= threshold
+            # topk is already sorted; -inf marks composites under the threshold
+            sorted_composites = {
+                self.composite_names[int(index)]: float(value)
+                for value, index in zip(row[labels:labels + k], row[labels + k:labels + 2 * k])
+                if value != float('-inf')
             }
             
-            sorted_composites = dict(
-                sorted(
-                    filtered_composites.items(),
-                    key=lambda x: x[1],
-                    reverse=True
-                )[:top_n]
-            )
-            
-            dominant_composite = max(
-                sorted_composites.items(),
-                key=lambda x: x[1],
-                default=("neutral", 0)
-            )
+            dominant_composite = next(iter(sorted_composites.items()), ("neutral", 0))
             
-            return EmotionPrediction(
+            predictions.append(EmotionPrediction(
                 dominant_primary_emotion=dominant_emotion,
                 dominant_primary_logits=max_logit,
                 primary_emotion_logits=emotion_logits,
                 dominant_composite_emotion=dominant_composite[0],
                 dominant_composite_logits=dominant_composite[1],
-                top_n_composite_emotions=sorted_composites
-            )    
-        except Exception as e:
-            print(f"Error in emotion classification: {str(e)}")
-            return EmotionPrediction(
-                dominant_primary_emotion="Error",
-                dominant_primary_logits=0.0,
-                primary_emotion_logits={},
-                dominant_composite_emotion="Error",
-                dominant_composite_logits=0.0,
-                top_n_composite_emotions={}
-            )
+                top_n_composite_emotions=sorted_composites,
+                sentence_embedding=row[labels + 2 * k:].copy() if embeddings is not None else None
+            ))
+        return predictions
+
+    @staticmethod
+    def _error_prediction() -> EmotionPrediction:
+        return EmotionPrediction(
+            dominant_primary_emotion="Error",
+            dominant_primary_logits=0.0,
+            primary_emotion_logits={},
+            dominant_composite_emotion="Error",
+            dominant_composite_logits=0.0,
+            top_n_composite_emotions={}
+        )
         
 
+def compile_composites(composite_dictionary: Dict, num_labels: int, device: any):
+    """Composite names and their dense [composites x num_labels] weight matrix"""
+    names = list(composite_dictionary)
+    matrix = torch.zeros(len(names), num_labels, dtype=torch.float32)
+    for row, name in enumerate(names):
+        data = composite_dictionary[name]
+        matrix[row].index_add_(
+            0,
+            torch.tensor(data['emotions'], dtype=torch.long),
+            torch.tensor(data['weights'], dtype=torch.float32)
+        )
+    return names, matrix.to(device)
+
+
 def L2S(logits: torch.Tensor) -> Dict[str, float]:
     softmax = torch.nn.Softmax(dim=1)
     probabilities = softmax(logits).to(logits.device).numpy()[0]
@@ -0,0 +1,78 @@
+"""
+Shared encoder: one backbone pass for emotion logits and sentence embedding
+Checkpoint stardust_6 cukup dimuat sekali (sebagai sequence classifier);
+hidden state terakhirnya di-mean-pool untuk similarity dan response cache
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import torch
+from transformers.modeling_outputs import ModelOutput
+
+
+@dataclass
+class SharedEncoderOutput(ModelOutput):
+    """logits first, so `output[0]` still means logits for EmotionClassifier"""
+    logits: Optional[torch.FloatTensor] = None
+    last_hidden_state: Optional[torch.FloatTensor] = None
+    sentence_embedding: Optional[torch.FloatTensor] = None
+
+
+def mean_pool(last_hidden_state, attention_mask):
+    """Mask-aware mean over tokens (the same pooling as TextSimilaritySearch)"""
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    return (last_hidden_state * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+
+
+def embedding_similarity(embedding_1, embedding_2):
+    """Cosine similarity of two sentence embeddings (None if either is missing)"""
+    if embedding_1 is None or embedding_2 is None:
+        return None
+    embedding_1 = np.asarray(embedding_1, dtype=np.float32).ravel()
+    embedding_2 = np.asarray(embedding_2, dtype=np.float32).ravel()
+    norms = np.linalg.norm(embedding_1) * np.linalg.norm(embedding_2)
+    return float(np.dot(embedding_1, embedding_2) / max(norms, 1e-9))
+
+
+class SharedEncoderModel(torch.nn.Module):
+    """Wraps an AutoModelForSequenceClassification so it also serves as the embedding encoder.
+
+    The classification head reads the backbone output anyway; asking for the
+    hidden states returns the same last hidden state an AutoModel of the
+    checkpoint would produce, without a second copy of the weights or a
+    second forward pass.
+    """
+
+    def __init__(self, classification_model):
+        super().__init__()
+        self.model = classification_model
+
+    @property
+    def config(self):
+        return self.model.config
+
+    def forward(self, input_ids=None, attention_mask=None, **kwargs):
+        kwargs.pop('output_hidden_states', None)
+        kwargs.pop('return_dict', None)
+        output = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            output_hidden_states=True,
+            return_dict=True,
+            **kwargs
+        )
+        last_hidden_state = output.hidden_states[-1]
+        if attention_mask is None:
+            attention_mask = torch.ones(last_hidden_state.shape[:2], device=last_hidden_state.device)
+        return SharedEncoderOutput(
+            logits=output.logits,
+            last_hidden_state=last_hidden_state,
+            sentence_embedding=mean_pool(last_hidden_state, attention_mask)
+        )
+
+
+def is_shared_encoder(model):
+    """True for models that return logits and sentence embeddings from one pass"""
+    return isinstance(model, SharedEncoderModel) or getattr(model, 'kind', None) == 'shared'
@@ -0,0 +1,168 @@
+"""
+Server-side conversation session store for CutieChatter backend
+LRU di memory + spill-to-disk untuk session yang idle
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+SESSION_CACHE_SIZE = int(os.getenv('CUTIE_SESSION_CACHE_SIZE', 256))
+SESSION_IDLE_SECONDS = float(os.getenv('CUTIE_SESSION_IDLE_SECONDS', 600))
+SESSION_SPILL_DIR = os.getenv(
+    'CUTIE_SESSION_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions')
+)
+
+_SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+
+class SessionStore:
+    """Conversation histories keyed by session ID"""
+
+    def __init__(self, max_sessions=SESSION_CACHE_SIZE, idle_seconds=SESSION_IDLE_SECONDS, spill_dir=SESSION_SPILL_DIR):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir
+        self._sessions = OrderedDict()  # session_id -> {'history': [...], 'last_access': ts}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def is_valid_id(session_id):
+        return bool(session_id) and bool(_SESSION_ID_PATTERN.match(session_id))
+
+    def _path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def create(self, session_id=None, history=None):
+        """Create a session and return its ID"""
+        session_id = session_id or uuid.uuid4().hex
+        if not self.is_valid_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id}")
+
+        with self._lock:
+            self._sessions[session_id] = {'history': list(history or []), 'last_access': time.time()}
+            self._sessions.move_to_end(session_id)
+            self._evict()
+        return session_id
+
+    def exists(self, session_id):
+        with self._lock:
+            return session_id in self._sessions or (
+                self.is_valid_id(session_id) and os.path.exists(self._path(session_id))
+            )
+
+    def _load(self, session_id):
+        """Bring a spilled session back into memory (caller holds the lock)"""
+        if session_id in self._sessions:
+            return self._sessions[session_id]
+        if not self.is_valid_id(session_id):
+            return None
+
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+            os.remove(path)
+        except Exception as e:
+            logger.error(f"Could not load spilled session {session_id}: {e}")
+            return None
+
+        entry = {'history': history, 'last_access': time.time()}
+        self._sessions[session_id] = entry
+        self._evict()
+        return entry
+
+    def get(self, session_id):
+        """Copy of the session history, or None if unknown"""
+        with self._lock:
+            entry = self._load(session_id)
+            if entry is None:
+                return None
+            entry['last_access'] = time.time()
+            self._sessions.move_to_end(session_id)
+            return list(entry['history'])
+
+    def append(self, session_id, messages):
+        """Append messages to a session (created if missing); returns new length"""
+        with self._lock:
+            entry = self._load(session_id)
+            if entry is None:
+                self.create(session_id)
+                entry = self._sessions[session_id]
+            entry['history'].extend(messages)
+            entry['last_access'] = time.time()
+            self._sessions.move_to_end(session_id)
+            return len(entry['history'])
+
+    def delete(self, session_id):
+        with self._lock:
+            removed = self._sessions.pop(session_id, None) is not None
+            if self.is_valid_id(session_id) and os.path.exists(self._path(session_id)):
+                os.remove(self._path(session_id))
+                removed = True
+            return removed
+
+    def _spill(self, session_id):
+        """Write one session to disk and drop it from memory (caller holds the lock).
+
+        Returns False if the write failed; the session then stays in memory
+        at its old LRU position.
+        """
+        entry = self._sessions.pop(session_id)
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            tmp_path = self._path(session_id) + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry['history'], f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(session_id))
+        except Exception as e:
+            logger.error(f"Could not spill session {session_id}: {e}")
+            self._sessions[session_id] = entry
+            self._sessions.move_to_end(session_id, last=False)
+            return False
+        return True
+
+    def _evict(self):
+        # Least recently used sessions go to disk first; if the disk refuses
+        # (full, permissions) keep the overflow in memory instead of retrying forever
+        while len(self._sessions) > self.max_sessions:
+            session_id = next(iter(self._sessions))
+            if not self._spill(session_id):
+                logger.warning(f"⚠️ Session spill failed, keeping {len(self._sessions)} sessions in memory")
+                break
+
+    def spill_idle(self):
+        """Spill every session idle for longer than idle_seconds; returns count"""
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            idle = [sid for sid, entry in self._sessions.items() if entry['last_access'] < cutoff]
+            spilled = sum(1 for session_id in idle if self._spill(session_id))
+        if spilled:
+            logger.info(f"💾 Spilled {spilled} idle sessions to disk")
+        return spilled
+
+    def spill_all(self):
+        """Persist everything (used on shutdown)"""
+        with self._lock:
+            for session_id in list(self._sessions):
+                self._spill(session_id)
+
+    def stats(self):
+        with self._lock:
+            in_memory = len(self._sessions)
+        on_disk = 0
+        if os.path.isdir(self.spill_dir):
+            on_disk = sum(1 for name in os.listdir(self.spill_dir) if name.endswith('.json'))
+        return {"in_memory": in_memory, "on_disk": on_disk, "max_in_memory": self.max_sessions}
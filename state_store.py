@@ -0,0 +1,357 @@
+"""
+Shared state for the CutieChatter backend (sessions + model status)
+Backend bisa diganti lewat CUTIE_STATE_BACKEND: 'memory' (satu proses), 'sqlite'
+(WAL, beberapa worker di satu mesin) atau 'postgres' (database_config, beberapa
+instance di belakang proxy) - semua worker melihat session yang sama
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+from session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Configuration (environment overrides)
+STATE_BACKEND = os.getenv('CUTIE_STATE_BACKEND', 'memory').lower()
+STATE_SQLITE_PATH = os.getenv(
+    'CUTIE_STATE_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cutie_state.db')
+)
+STATE_PG_POOL_SIZE = int(os.getenv('CUTIE_STATE_PG_POOL', 8))
+STATE_BUSY_TIMEOUT_MS = int(os.getenv('CUTIE_STATE_BUSY_TIMEOUT_MS', 5000))
+
+DEFAULT_MODEL_STATUS = ("deepseek-r1:1.5b", "qwen", "ollama")
+
+# One table per concern; messages are append-only rows so a turn never rewrites the history
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS cutie_sessions (
+        session_id TEXT PRIMARY KEY,
+        created DOUBLE PRECISION NOT NULL,
+        last_access DOUBLE PRECISION NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS cutie_session_messages (
+        session_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        PRIMARY KEY (session_id, seq)
+    )""",
+    """CREATE TABLE IF NOT EXISTS cutie_model_status (
+        name TEXT PRIMARY KEY,
+        available INTEGER NOT NULL,
+        loading INTEGER NOT NULL,
+        updated DOUBLE PRECISION NOT NULL
+    )""",
+)
+
+
+class SQLStateBackend:
+    """Sessions and model status in SQL tables; subclasses provide connections.
+
+    Every method is a short transaction, so any number of processes can share
+    the same database. Appends lock the session row first, which keeps `seq`
+    gap-free when two workers answer the same session at once.
+    """
+
+    name = 'sql'
+    placeholder = '?'
+
+    def _connection(self):
+        raise NotImplementedError
+
+    def _lock_session(self, cursor, session_id):
+        """Serialize writers of one session (inside the current transaction)"""
+        raise NotImplementedError
+
+    def _sql(self, statement):
+        return statement.replace('?', self.placeholder)
+
+    @contextmanager
+    def _transaction(self):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _execute(self, cursor, statement, params=()):
+        cursor.execute(self._sql(statement), params)
+
+    def init_schema(self):
+        with self._transaction() as cursor:
+            for statement in _SCHEMA:
+                self._execute(cursor, statement)
+
+    # --- sessions ---------------------------------------------------------
+
+    def create_session(self, session_id, history):
+        now = time.time()
+        with self._transaction() as cursor:
+            self._execute(cursor, "DELETE FROM cutie_session_messages WHERE session_id = ?", (session_id,))
+            self._execute(cursor, "DELETE FROM cutie_sessions WHERE session_id = ?", (session_id,))
+            self._execute(cursor, "INSERT INTO cutie_sessions (session_id, created, last_access) VALUES (?, ?, ?)", (session_id, now, now))
+            self._insert_messages(cursor, session_id, 0, history)
+
+    def _insert_messages(self, cursor, session_id, first_seq, messages):
+        rows = [(session_id, first_seq + i, json.dumps(message, ensure_ascii=False)) for i, message in enumerate(messages)]
+        if rows:
+            cursor.executemany(self._sql("INSERT INTO cutie_session_messages (session_id, seq, message) VALUES (?, ?, ?)"), rows)
+
+    def session_exists(self, session_id):
+        with self._transaction() as cursor:
+            self._execute(cursor, "SELECT 1 FROM cutie_sessions WHERE session_id = ?", (session_id,))
+            return cursor.fetchone() is not None
+
+    def get_session(self, session_id):
+        with self._transaction() as cursor:
+            self._execute(cursor, "UPDATE cutie_sessions SET last_access = ? WHERE session_id = ?", (time.time(), session_id))
+            if cursor.rowcount == 0:
+                return None
+            self._execute(cursor, "SELECT message FROM cutie_session_messages WHERE session_id = ? ORDER BY seq", (session_id,))
+            return [json.loads(row[0]) for row in cursor.fetchall()]
+
+    def append_session(self, session_id, messages):
+        now = time.time()
+        with self._transaction() as cursor:
+            self._lock_session(cursor, session_id)
+            self._execute(cursor, "SELECT 1 FROM cutie_sessions WHERE session_id = ?", (session_id,))
+            if cursor.fetchone() is None:
+                self._execute(cursor, "INSERT INTO cutie_sessions (session_id, created, last_access) VALUES (?, ?, ?)", (session_id, now, now))
+                length = 0
+            else:
+                self._execute(cursor, "UPDATE cutie_sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+                self._execute(cursor, "SELECT COUNT(*) FROM cutie_session_messages WHERE session_id = ?", (session_id,))
+                length = cursor.fetchone()[0]
+            self._insert_messages(cursor, session_id, length, messages)
+            return length + len(messages)
+
+    def delete_session(self, session_id):
+        with self._transaction() as cursor:
+            self._execute(cursor, "DELETE FROM cutie_session_messages WHERE session_id = ?", (session_id,))
+            self._execute(cursor, "DELETE FROM cutie_sessions WHERE session_id = ?", (session_id,))
+            return cursor.rowcount > 0
+
+    def session_count(self):
+        with self._transaction() as cursor:
+            self._execute(cursor, "SELECT COUNT(*) FROM cutie_sessions")
+            return cursor.fetchone()[0]
+
+    # --- model status -----------------------------------------------------
+
+    def set_model_status(self, name, available, loading=False):
+        with self._transaction() as cursor:
+            self._execute(
+                cursor,
+                "INSERT INTO cutie_model_status (name, available, loading, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET available = excluded.available, loading = excluded.loading, updated = excluded.updated",
+                (name, int(available), int(loading), time.time())
+            )
+
+    def ensure_model_status(self, names):
+        with self._transaction() as cursor:
+            for name in names:
+                self._execute(
+                    cursor,
+                    "INSERT INTO cutie_model_status (name, available, loading, updated) VALUES (?, 0, 0, ?) ON CONFLICT (name) DO NOTHING",
+                    (name, time.time())
+                )
+
+    def reset_model_status(self):
+        with self._transaction() as cursor:
+            self._execute(cursor, "UPDATE cutie_model_status SET available = 0, loading = 0, updated = ?", (time.time(),))
+
+    def model_status(self):
+        with self._transaction() as cursor:
+            self._execute(cursor, "SELECT name, available, loading FROM cutie_model_status ORDER BY name")
+            return {name: {"available": bool(available), "loading": bool(loading)} for name, available, loading in cursor.fetchall()}
+
+    def stats(self):
+        return {"backend": self.name}
+
+    def close(self):
+        pass
+
+
+class SQLiteStateBackend(SQLStateBackend):
+    """SQLite in WAL mode: readers never block, one writer at a time across processes"""
+
+    name = 'sqlite'
+
+    def __init__(self, path=STATE_SQLITE_PATH, busy_timeout_ms=STATE_BUSY_TIMEOUT_MS):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.init_schema()
+
+    @contextmanager
+    def _connection(self):
+        # sqlite3 connections are not shared between threads; one per thread, kept open
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        conn.execute("BEGIN")
+        yield conn
+
+    def _lock_session(self, cursor, session_id):
+        # Upgrade to a write lock before reading the message count (BEGIN is deferred)
+        self._execute(cursor, "UPDATE cutie_sessions SET last_access = last_access WHERE session_id = ?", (session_id,))
+
+    def stats(self):
+        return {"backend": self.name, "path": self.path, "sessions": self.session_count()}
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class PostgresStateBackend(SQLStateBackend):
+    """PostgreSQL via database_config (same DB_* settings as auth), pooled connections"""
+
+    name = 'postgres'
+    placeholder = '%s'
+
+    def __init__(self, config=None, pool_size=STATE_PG_POOL_SIZE):
+        from psycopg2.pool import ThreadedConnectionPool
+
+        if config is None:
+            from database_config import db_config as config
+        self.config = config
+        self._pool = ThreadedConnectionPool(1, max(1, pool_size), **config.get_connection_params())
+        self.init_schema()
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            self._pool.putconn(conn)
+
+    def _lock_session(self, cursor, session_id):
+        # Transaction-scoped advisory lock: also covers a session row that does not exist yet
+        self._execute(cursor, "SELECT pg_advisory_xact_lock(hashtext(?))", (session_id,))
+
+    def stats(self):
+        return {"backend": self.name, "host": self.config.host, "sessions": self.session_count()}
+
+    def close(self):
+        self._pool.closeall()
+
+
+class SharedSessionStore:
+    """SessionStore API on top of a shared SQL backend (no per-process cache)"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    is_valid_id = staticmethod(SessionStore.is_valid_id)
+
+    def create(self, session_id=None, history=None):
+        session_id = session_id or uuid.uuid4().hex
+        if not self.is_valid_id(session_id):
+            raise ValueError(f"Invalid session id: {session_id}")
+        self.backend.create_session(session_id, list(history or []))
+        return session_id
+
+    def exists(self, session_id):
+        return self.is_valid_id(session_id) and self.backend.session_exists(session_id)
+
+    def get(self, session_id):
+        if not self.is_valid_id(session_id):
+            return None
+        return self.backend.get_session(session_id)
+
+    def append(self, session_id, messages):
+        return self.backend.append_session(session_id, messages)
+
+    def delete(self, session_id):
+        if not self.is_valid_id(session_id):
+            return False
+        return self.backend.delete_session(session_id)
+
+    def spill_idle(self):
+        # Already durable: nothing lives only in this process
+        return 0
+
+    def spill_all(self):
+        pass
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class ModelStatusTable:
+    """Availability per model, kept in this process"""
+
+    def __init__(self, names=DEFAULT_MODEL_STATUS):
+        self._status = {name: {"available": False, "loading": False} for name in names}
+        self._lock = threading.Lock()
+
+    def set(self, name, available, loading=False):
+        with self._lock:
+            self._status[name] = {"available": bool(available), "loading": bool(loading)}
+
+    def reset(self):
+        with self._lock:
+            for name in self._status:
+                self._status[name] = {"available": False, "loading": False}
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+
+class SharedModelStatus:
+    """ModelStatusTable API on top of a shared SQL backend"""
+
+    def __init__(self, backend, names=DEFAULT_MODEL_STATUS):
+        self.backend = backend
+        self.backend.ensure_model_status(names)
+
+    def set(self, name, available, loading=False):
+        self.backend.set_model_status(name, available, loading)
+
+    def reset(self):
+        self.backend.reset_model_status()
+
+    def snapshot(self):
+        return self.backend.model_status()
+
+
+def create_backend(kind=STATE_BACKEND):
+    """SQL backend for `kind`, or None for the in-process default"""
+    if kind in ('', 'memory'):
+        return None
+    if kind == 'sqlite':
+        return SQLiteStateBackend()
+    if kind in ('postgres', 'postgresql'):
+        return PostgresStateBackend()
+    raise ValueError(f"Unknown CUTIE_STATE_BACKEND: {kind}")
+
+
+def create_state(kind=STATE_BACKEND):
+    """(session store, model status table) for the configured backend"""
+    backend = create_backend(kind)
+    if backend is None:
+        return SessionStore(), ModelStatusTable()
+    logger.info(f"🗄️ Shared state backend: {backend.name}")
+    return SharedSessionStore(backend), SharedModelStatus(backend)
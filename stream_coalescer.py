@@ -0,0 +1,132 @@
+"""
+Chunk coalescing for streamed responses in CutieChatter
+Token-token kecil digabung lalu di-flush setiap N ms atau M karakter (mana yang
+lebih dulu), dipakai oleh Qt signal, WebChannel dan SSE
+"""
+
+import os
+import time
+import asyncio
+import threading
+
+from cancellation import aclose_stream
+
+# Configuration (environment overrides)
+COALESCE_INTERVAL_MS = float(os.getenv('CUTIE_COALESCE_MS', 50))
+COALESCE_MAX_CHARS = int(os.getenv('CUTIE_COALESCE_CHARS', 64))
+
+
+class ChunkCoalescer:
+    """Buffers pushed chunks and hands them to `emit` in order, in fewer, larger pieces.
+
+    With background=True a flusher thread also empties the buffer when the
+    interval passes without a new chunk, so a stalled stream never holds text back.
+    """
+
+    def __init__(self, emit, interval_ms=COALESCE_INTERVAL_MS, max_chars=COALESCE_MAX_CHARS, background=False):
+        self.emit = emit
+        self.interval = interval_ms / 1000.0
+        self.max_chars = max_chars
+        self._buffer = []
+        self._size = 0
+        self._first_at = None  # when the oldest buffered chunk arrived
+        self._lock = threading.Condition()
+        self._closed = False
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._flush_loop, name="chunk-coalescer", daemon=True)
+            self._thread.start()
+
+    def push(self, text):
+        if not text:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            if not self._buffer:
+                self._first_at = time.monotonic()
+                self._lock.notify()
+            self._buffer.append(text)
+            self._size += len(text)
+            if self._size >= self.max_chars or time.monotonic() - self._first_at >= self.interval:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        # Emitting under the lock keeps chunks in order across threads
+        if self._buffer:
+            text = ''.join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self._first_at = None
+            self.emit(text)
+
+    def close(self):
+        """Final flush; later pushes are ignored"""
+        with self._lock:
+            self._flush_locked()
+            self._closed = True
+            self._lock.notify()
+
+    def _flush_loop(self):
+        with self._lock:
+            while not self._closed:
+                if not self._buffer:
+                    self._lock.wait()
+                    continue
+                remaining = self.interval - (time.monotonic() - self._first_at)
+                if remaining > 0:
+                    self._lock.wait(remaining)
+                else:
+                    self._flush_locked()
+
+
+async def coalesce(chunks, interval_ms=COALESCE_INTERVAL_MS, max_chars=COALESCE_MAX_CHARS):
+    """Async generator merging an async stream of text chunks; final flush at the end"""
+    interval = interval_ms / 1000.0
+    iterator = chunks.__aiter__()
+    buffer = []
+    size = 0
+    first_at = None
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = None
+            if buffer:
+                timeout = max(0.0, interval - (time.monotonic() - first_at))
+            # asyncio.wait does not cancel the pending read on timeout
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                yield ''.join(buffer)
+                buffer, size, first_at = [], 0, None
+                continue
+
+            try:
+                text = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+
+            if not text:
+                continue
+            if not buffer:
+                first_at = time.monotonic()
+            buffer.append(text)
+            size += len(text)
+            if size >= max_chars or time.monotonic() - first_at >= interval:
+                yield ''.join(buffer)
+                buffer, size, first_at = [], 0, None
+
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        await aclose_stream(iterator, pending)
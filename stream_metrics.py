@@ -0,0 +1,240 @@
+"""
+Per-stream latency / throughput metrics for CutieChatter
+TTFT, time-to-first-answer-token (setelah </think>), tokens/s dari chunk terakhir
+Ollama dan durasi tiap stage; diagregasi jadi histogram (Prometheus) dan JSON
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from model_router import TTFTClock
+
+# Configuration (environment overrides)
+METRICS_RECENT = int(os.getenv('CUTIE_METRICS_RECENT', 100))
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 40, 80, 160, 320)
+
+OK = 'ok'
+STOPPED = 'stopped'
+ERROR = 'error'
+
+
+def _seconds(nanoseconds):
+    return nanoseconds / 1e9 if nanoseconds else None
+
+
+class StreamTimer(TTFTClock):
+    """Timings of one generation: first token, first answer token, stages and Ollama's own counters"""
+
+    def __init__(self, model, source):
+        super().__init__()
+        self.model = model
+        self.source = source  # 'desktop', 'api', ...
+        self.ttfat = None
+        self.stages = {}
+        self.done_chunk = None
+
+    def answer(self):
+        """First token shown to the user (after the reasoning)"""
+        if self.ttfat is None:
+            self.ttfat = time.monotonic() - self.started
+
+    def done(self, chunk):
+        """Keep Ollama's last chunk (eval / prompt-eval / load durations)"""
+        self.done_chunk = chunk
+
+    @contextmanager
+    def stage(self, name):
+        """Accumulate the time spent in a named stage (cleaning, cache lookup, queue wait, ...)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def finish(self, status=OK):
+        """Final record of this generation (Ollama durations are in nanoseconds)"""
+        done_chunk = self.done_chunk or {}
+        eval_count = done_chunk.get('eval_count') or 0
+        eval_seconds = _seconds(done_chunk.get('eval_duration'))
+        return {
+            'model': self.model,
+            'source': self.source,
+            'status': status,
+            'timestamp': time.time(),
+            'ttft': self.ttft,
+            'ttfat': self.ttfat,
+            'total': time.monotonic() - self.started,
+            'eval_count': eval_count,
+            'eval_seconds': eval_seconds,
+            'tokens_per_second': eval_count / eval_seconds if eval_seconds else None,
+            'prompt_eval_count': done_chunk.get('prompt_eval_count') or 0,
+            'prompt_eval_seconds': _seconds(done_chunk.get('prompt_eval_duration')),
+            'load_seconds': _seconds(done_chunk.get('load_duration')),
+            'stages': dict(self.stages)
+        }
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values (Prometheus semantics)"""
+
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for labels, series in sorted(self._series.items()):
+            base = ','.join(f'{key}="{_escape(value)}"' for key, value in zip(self.label_names, labels))
+            prefix = base + ',' if base else ''
+            for i, bound in enumerate(self.buckets):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {series[i]}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{base}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{base}}} {series[-1]}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StreamMetrics:
+    """Thread-safe aggregation of finished StreamTimer records"""
+
+    def __init__(self, recent=METRICS_RECENT):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=recent)
+        self._requests = {}  # (model, source, status) -> count
+        self._tokens = {}    # model -> generated tokens
+        self._stage_recent = {}  # stage -> recent durations
+        self.ttft = Histogram('cutie_ttft_seconds', 'Time to first streamed token', ('model', 'source'), LATENCY_BUCKETS)
+        self.ttfat = Histogram('cutie_ttfat_seconds', 'Time to first answer token (after the reasoning)', ('model', 'source'), LATENCY_BUCKETS)
+        self.total = Histogram('cutie_request_seconds', 'Wall time of a generation request', ('model', 'source'), LATENCY_BUCKETS)
+        self.prompt_eval = Histogram('cutie_prompt_eval_seconds', 'Ollama prompt evaluation (prefill) time', ('model',), LATENCY_BUCKETS)
+        self.rate = Histogram('cutie_tokens_per_second', 'Ollama generation speed (eval_count / eval_duration)', ('model',), RATE_BUCKETS)
+        self.stage = Histogram('cutie_stage_seconds', 'Time spent per pipeline stage', ('stage', 'source'), STAGE_BUCKETS)
+
+    def record(self, record):
+        model, source = record['model'], record['source']
+        with self._lock:
+            self._recent.append(record)
+            key = (model, source, record['status'])
+            self._requests[key] = self._requests.get(key, 0) + 1
+            if record['eval_count']:
+                self._tokens[model] = self._tokens.get(model, 0) + record['eval_count']
+            if record['ttft'] is not None:
+                self.ttft.observe((model, source), record['ttft'])
+            if record['ttfat'] is not None:
+                self.ttfat.observe((model, source), record['ttfat'])
+            self.total.observe((model, source), record['total'])
+            if record['prompt_eval_seconds'] is not None:
+                self.prompt_eval.observe((model,), record['prompt_eval_seconds'])
+            if record['tokens_per_second'] is not None:
+                self.rate.observe((model,), record['tokens_per_second'])
+            for name, seconds in record['stages'].items():
+                self._observe_stage_locked(name, seconds, source)
+        return record
+
+    def _observe_stage_locked(self, name, seconds, source):
+        self.stage.observe((name, source), seconds)
+        if name not in self._stage_recent:
+            self._stage_recent[name] = deque(maxlen=self._recent.maxlen)
+        self._stage_recent[name].append(seconds)
+
+    def observe_stage(self, name, seconds, source='desktop'):
+        """Stage outside a generation (e.g. sentiment on the user message)"""
+        with self._lock:
+            self._observe_stage_locked(name, seconds, source)
+
+    @contextmanager
+    def timed(self, name, source='desktop'):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - started, source)
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = [
+            "# HELP cutie_requests_total Finished generation requests",
+            "# TYPE cutie_requests_total counter"
+        ]
+        with self._lock:
+            for (model, source, status), count in sorted(self._requests.items()):
+                lines.append(f'cutie_requests_total{{model="{_escape(model)}",source="{_escape(source)}",status="{status}"}} {count}')
+            lines.append("# HELP cutie_generated_tokens_total Tokens generated by Ollama")
+            lines.append("# TYPE cutie_generated_tokens_total counter")
+            for model, count in sorted(self._tokens.items()):
+                lines.append(f'cutie_generated_tokens_total{{model="{_escape(model)}"}} {count}')
+            for histogram in (self.ttft, self.ttfat, self.total, self.prompt_eval, self.rate, self.stage):
+                histogram.render(lines)
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """JSON-friendly percentiles over the most recent requests (desktop diagnostics)"""
+        with self._lock:
+            recent = list(self._recent)
+            stage_recent = {name: list(values) for name, values in self._stage_recent.items()}
+            requests = {'/'.join(key): count for key, count in self._requests.items()}
+
+        by_model = {}
+        for record in recent:
+            by_model.setdefault(f"{record['model']}/{record['source']}", []).append(record)
+
+        models = {}
+        for key, records in by_model.items():
+            rates = [r['tokens_per_second'] for r in records if r['tokens_per_second']]
+            models[key] = {
+                'requests': len(records),
+                'ttft_p50': _percentile([r['ttft'] for r in records], 0.5),
+                'ttft_p95': _percentile([r['ttft'] for r in records], 0.95),
+                'ttfat_p50': _percentile([r['ttfat'] for r in records], 0.5),
+                'ttfat_p95': _percentile([r['ttfat'] for r in records], 0.95),
+                'total_p50': _percentile([r['total'] for r in records], 0.5),
+                'total_p95': _percentile([r['total'] for r in records], 0.95),
+                'tokens_per_second': round(sum(rates) / len(rates), 2) if rates else None
+            }
+
+        return {
+            'requests': requests,
+            'models': models,
+            'stages_ms': {
+                name: {'p50': _ms(_percentile(values, 0.5)), 'p95': _ms(_percentile(values, 0.95))}
+                for name, values in stage_recent.items()
+            },
+            'recent': recent
+        }
+
+
+def _percentile(values, q):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+stream_metrics = StreamMetrics()
@@ -0,0 +1,132 @@
+# test_context_window.py - Test ContextWindow token budget and rolling summary
+"""
+Test script for the token-budgeted context window.
+Run directly (python test_context_window.py) or with pytest.
+"""
+
+import sys
+import threading
+
+from context_window import ContextWindow, MESSAGE_OVERHEAD_TOKENS
+
+SYSTEM = {'role': 'system', 'content': 'sys'}
+
+
+class FakeClient:
+    """Ollama client stand-in: records summary requests, optionally waits before answering"""
+
+    def __init__(self, summary="<think>hmm</think> User said hello.", gate=None):
+        self.summary = summary
+        self.gate = gate
+        self.models = []
+        self.called = threading.Event()
+
+    def chat(self, model, messages, **kwargs):
+        self.models.append(model)
+        self.called.set()
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        return {'message': {'content': self.summary}}
+
+
+def _history(count):
+    """System prompt + `count` alternating turns, each 10 characters long"""
+    turns = [
+        {'role': 'user' if index % 2 == 0 else 'assistant', 'content': f"turn-{index:04d}"}
+        for index in range(count)
+    ]
+    return [SYSTEM] + turns
+
+
+def _window(budget):
+    # One token per character keeps the arithmetic readable
+    return ContextWindow(token_budget=budget, token_counter=len)
+
+
+def _wait_for_summary(window):
+    window._summary_thread.join(timeout=5)
+    assert not window._summary_thread.is_alive(), "summary thread did not finish"
+
+
+def test_budget_keeps_system_and_newest_turns():
+    """Oldest turns are dropped first; the system prompt stays pinned"""
+    turn_cost = 10 + MESSAGE_OVERHEAD_TOKENS
+    window = _window(budget=(3 + MESSAGE_OVERHEAD_TOKENS) + 3 * turn_cost)
+    history = _history(6)
+
+    messages = window.build(history)
+    assert messages[0] == SYSTEM
+    assert messages[1:] == history[-3:]
+    assert window.stats()['dropped_turns'] == 3
+
+
+def test_latest_message_kept_over_budget():
+    """A single message larger than the budget is still sent"""
+    window = _window(budget=5)
+    history = _history(4)
+    assert window.build(history) == [SYSTEM, history[-1]]
+
+
+def test_summary_replaces_dropped_turns():
+    """Dropped turns are folded into a summary that build() puts after the system prompt"""
+    window = _window(budget=60)
+    history = _history(8)
+    client = FakeClient()
+
+    window.build(history)
+    window.refresh_summary(history, 'deepseek-r1:1.5b', client=client)
+    _wait_for_summary(window)
+
+    assert client.models == ['deepseek-r1:1.5b']
+    messages = window.build(history)
+    assert messages[0] == SYSTEM
+    assert messages[1]['role'] == 'system'
+    assert messages[1]['content'].endswith("User said hello."), "think block leaked into the summary"
+    assert messages[-1] == history[-1]
+    assert window.stats()['summarized_turns'] > 0
+
+
+def test_reset_during_summary_discards_it():
+    """A summary computed for an older epoch is never committed"""
+    window = _window(budget=60)
+    history = _history(8)
+    gate = threading.Event()
+    client = FakeClient(gate=gate)
+
+    window.build(history)
+    window.refresh_summary(history, 'm', client=client)
+    assert client.called.wait(timeout=5)
+    window.reset()
+    gate.set()
+    _wait_for_summary(window)
+
+    assert window.stats()['summarized_turns'] == 0
+    assert all('Summary' not in message['content'] for message in window.build(history))
+
+
+def test_edited_history_forgets_summary():
+    """Replacing the summarized turns drops the stale summary"""
+    window = _window(budget=60)
+    history = _history(8)
+
+    window.build(history)
+    window.refresh_summary(history, 'm', client=FakeClient())
+    _wait_for_summary(window)
+    assert window.stats()['summarized_turns'] > 0
+
+    edited = [SYSTEM] + [dict(message, content=message['content'].upper()) for message in history[1:]]
+    messages = window.build(edited)
+    assert window.stats()['summarized_turns'] == 0
+    assert all('Summary' not in message['content'] for message in messages)
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in [(name, obj) for name, obj in globals().items() if name.startswith('test_')]:
+        try:
+            test()
+            print(f"  ✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  ❌ {name}: {e}")
+    sys.exit(1 if failed else 0)
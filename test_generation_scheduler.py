@@ -0,0 +1,135 @@
+# test_generation_scheduler.py - Test GenerationScheduler fairness, priority lane and backpressure
+"""
+Test script for the backend2 generation scheduler.
+Run directly (python test_generation_scheduler.py) or with pytest.
+"""
+
+import sys
+import math
+import asyncio
+
+import generation_scheduler
+from generation_scheduler import GenerationScheduler, QueueFullError, DEFAULT_SERVICE_SECONDS
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_round_robin_across_sessions():
+    """A session with many queued requests cannot starve another session"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = scheduler.submit('m', 'busy')
+        queued = [scheduler.submit('m', 'busy') for _ in range(3)]
+        other = scheduler.submit('m', 'other')
+
+        assert scheduler.position(other) == 2
+        scheduler.release(running)
+        assert queued[0].granted and not other.granted
+        scheduler.release(queued[0])
+        assert other.granted, "second session waited behind the whole first session"
+    _run(scenario())
+
+
+def test_priority_lane_with_burst_limit():
+    """Short prompts jump ahead, but only PRIORITY_BURST times in a row"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = scheduler.submit('m', 'a')
+        normal = scheduler.submit('m', 'slow')
+        burst = generation_scheduler.PRIORITY_BURST
+        interactive = [scheduler.submit('m', f'fast{i}', priority=True) for i in range(burst + 1)]
+
+        assert scheduler.position(interactive[0]) == 1
+        assert scheduler.position(normal) == burst + 1
+
+        holder = running
+        for ticket in interactive[:burst]:
+            scheduler.release(holder)
+            assert ticket.granted
+            holder = ticket
+        scheduler.release(holder)
+        assert normal.granted, "normal lane starved by the priority lane"
+        assert not interactive[burst].granted
+    _run(scenario())
+
+
+def test_queue_full_raises_with_retry_after():
+    """A full queue is refused with a Retry-After estimate (turned into a 429)"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=2, max_queue_depth=2)
+        for session_id in ('a', 'b', 'c', 'd'):
+            scheduler.submit('m', session_id)
+        try:
+            scheduler.submit('m', 'e')
+        except QueueFullError as e:
+            assert e.model == 'm' and e.depth == 2
+            # 3 waiting (2 queued + this one) over 2 slots -> 1.5 average service times
+            assert e.retry_after == math.ceil(1.5 * DEFAULT_SERVICE_SECONDS)
+        else:
+            raise AssertionError("QueueFullError not raised")
+    _run(scenario())
+
+
+def test_wait_for_turn_reports_positions():
+    """wait_for_turn yields the queue position until the slot is granted"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = scheduler.submit('m', 'a')
+        first = scheduler.submit('m', 'b')
+        second = scheduler.submit('m', 'c')
+        positions = []
+
+        async def wait():
+            async for position in scheduler.wait_for_turn(second):
+                positions.append(position)
+
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0)
+        scheduler.release(running)
+        await asyncio.sleep(0)
+        scheduler.release(first)
+        await asyncio.wait_for(waiter, timeout=1)
+        assert positions == [2, 1]
+    _run(scenario())
+
+
+def test_release_is_idempotent_and_leaves_queue():
+    """Releasing twice frees one slot; releasing a waiting ticket removes it"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1)
+        running = scheduler.submit('m', 'a')
+        waiting = scheduler.submit('m', 'b')
+        scheduler.release(waiting)
+        assert scheduler.stats()['m']['queued'] == 0
+        scheduler.release(running)
+        scheduler.release(running)
+        assert scheduler.stats()['m']['active'] == 0
+    _run(scenario())
+
+
+def test_unused_slot_skips_service_time():
+    """A cache hit gives its slot back without pulling the Retry-After estimate down"""
+    async def scenario():
+        scheduler = GenerationScheduler(max_concurrency=1)
+        ticket = scheduler.submit('m', 'a')
+        scheduler.release(ticket, generated=False)
+        assert scheduler.stats()['m']['avg_service_seconds'] == DEFAULT_SERVICE_SECONDS
+
+        ticket = scheduler.submit('m', 'a')
+        scheduler.release(ticket)
+        assert scheduler.stats()['m']['avg_service_seconds'] < DEFAULT_SERVICE_SECONDS
+    _run(scenario())
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in [(name, obj) for name, obj in globals().items() if name.startswith('test_')]:
+        try:
+            test()
+            print(f"  ✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  ❌ {name}: {e}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,121 @@
+# test_response_cache.py - Test ResponseCache keys and the semantic bucket
+"""
+Test script for the response cache shared by the desktop app and backend2.
+Run directly (python test_response_cache.py) or with pytest.
+"""
+
+import sys
+from unittest import mock
+
+from response_cache import ResponseCache
+
+OPTIONS = {'num_predict': 512, 'temperature': 0.7}
+
+
+class Vector(tuple):
+    """Minimal stand-in for a normalized embedding (supports a @ b)"""
+
+    def __matmul__(self, other):
+        return sum(a * b for a, b in zip(self, other))
+
+
+class FakeEmbedder:
+    """Maps known queries to fixed unit vectors; anything else is orthogonal"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+        self.calls = 0
+
+    def __call__(self, text):
+        self.calls += 1
+        return self.vectors.get(text, Vector((0.0, 0.0, 1.0)))
+
+
+def _conversation(*turns, system="You're CutieChatter"):
+    messages = [{'role': 'system', 'content': system}]
+    for index, content in enumerate(turns):
+        messages.append({'role': 'user' if index % 2 == 0 else 'assistant', 'content': content})
+    return messages
+
+
+def test_exact_key_ignores_case_punctuation_and_whitespace():
+    """The same question typed differently hits the same entry"""
+    cache = ResponseCache(enabled=True)
+    cache.put(_conversation("Halo, apa kabar?"), "Baik!", 'm', OPTIONS)
+    assert cache.get(_conversation("  halo apa   KABAR "), 'm', OPTIONS) == "Baik!"
+    assert cache.stats()['exact_hits'] == 1
+
+
+def test_key_covers_model_options_system_and_context():
+    """Another model, sampling setup, system prompt or earlier turn is a miss"""
+    cache = ResponseCache(enabled=True)
+    cache.put(_conversation("hai", "halo!", "siapa kamu?"), "Aku Cutie", 'm', OPTIONS)
+
+    assert cache.get(_conversation("hai", "halo!", "siapa kamu?"), 'other', OPTIONS) is None
+    assert cache.get(_conversation("hai", "halo!", "siapa kamu?"), 'm', dict(OPTIONS, temperature=1.2)) is None
+    assert cache.get(_conversation("hai", "halo!", "siapa kamu?", system="Be formal"), 'm', OPTIONS) is None
+    assert cache.get(_conversation("pagi", "halo!", "siapa kamu?"), 'm', OPTIONS) is None
+    assert cache.get(_conversation("hai", "halo!", "siapa kamu?"), 'm', OPTIONS) == "Aku Cutie"
+
+
+def test_only_recent_turns_are_keyed():
+    """Turns older than last_turns do not change the key"""
+    cache = ResponseCache(enabled=True, last_turns=3)
+    cache.put(_conversation("lama", "ok", "hai", "halo!", "siapa kamu?"), "Aku Cutie", 'm', OPTIONS)
+    assert cache.get(_conversation("beda", "ok", "hai", "halo!", "siapa kamu?"), 'm', OPTIONS) == "Aku Cutie"
+
+
+def test_ttl_and_lru_eviction():
+    """Expired entries miss; the least recently used entry is evicted first"""
+    cache = ResponseCache(enabled=True, max_entries=2, ttl=60)
+    with mock.patch('response_cache.time.time', return_value=1000.0):
+        cache.put(_conversation("a"), "A", 'm', OPTIONS)
+        cache.put(_conversation("b"), "B", 'm', OPTIONS)
+        assert cache.get(_conversation("a"), 'm', OPTIONS) == "A"
+        cache.put(_conversation("c"), "C", 'm', OPTIONS)
+        assert cache.get(_conversation("b"), 'm', OPTIONS) is None
+    with mock.patch('response_cache.time.time', return_value=1061.0):
+        assert cache.get(_conversation("a"), 'm', OPTIONS) is None
+    assert cache.stats()['size'] == 1
+
+
+def test_semantic_hit_stays_in_bucket():
+    """A paraphrase hits within the same context bucket, never across buckets"""
+    embedder = FakeEmbedder({
+        'apa kabar': Vector((1.0, 0.0, 0.0)),
+        'gimana kabarnya': Vector((0.96, 0.28, 0.0)),
+    })
+    cache = ResponseCache(enabled=True, embedder=embedder, semantic_threshold=0.9)
+    with mock.patch('response_cache.SEMANTIC_CACHE_ENABLED', True):
+        cache.put(_conversation("apa kabar"), "Baik!", 'm', OPTIONS)
+
+        assert cache.get(_conversation("gimana kabarnya"), 'm', OPTIONS) == "Baik!"
+        assert cache.stats()['semantic_hits'] == 1
+        # Same paraphrase after a different earlier turn: other bucket, nothing to embed against
+        assert cache.get(_conversation("hai", "halo!", "gimana kabarnya"), 'm', OPTIONS) is None
+        assert embedder.calls == 2
+        # Same bucket but below the threshold
+        assert cache.get(_conversation("cuaca hari ini"), 'm', OPTIONS) is None
+
+
+def test_disabled_cache_and_empty_responses():
+    """A disabled cache never answers; blank responses are not stored"""
+    cache = ResponseCache(enabled=False)
+    cache.put(_conversation("hai"), "halo", 'm', OPTIONS)
+    assert cache.get(_conversation("hai"), 'm', OPTIONS) is None
+
+    cache = ResponseCache(enabled=True)
+    cache.put(_conversation("hai"), "   ", 'm', OPTIONS)
+    assert cache.stats()['size'] == 0
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in [(name, obj) for name, obj in globals().items() if name.startswith('test_')]:
+        try:
+            test()
+            print(f"  ✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  ❌ {name}: {e}")
+    sys.exit(1 if failed else 0)
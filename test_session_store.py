@@ -0,0 +1,62 @@
+# test_session_store.py - Test SessionStore eviction and spill-to-disk
+"""
+Test script for the backend2 session store.
+Run directly (python test_session_store.py) or with pytest.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from unittest import mock
+
+from session_store import SessionStore
+
+
+def test_spill_round_trip():
+    """Evicted sessions go to disk and come back on access"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        store = SessionStore(max_sessions=2, spill_dir=spill_dir)
+        for session_id in ('a', 'b', 'c'):
+            store.append(session_id, [{'role': 'user', 'content': session_id}])
+
+        assert store.stats()['in_memory'] == 2
+        assert os.path.exists(os.path.join(spill_dir, 'a.json'))
+        assert store.get('a') == [{'role': 'user', 'content': 'a'}]
+        assert not os.path.exists(os.path.join(spill_dir, 'a.json'))
+
+
+def test_spill_write_failure_does_not_hang():
+    """A failing spill write keeps the sessions in memory instead of looping under the lock"""
+    with tempfile.TemporaryDirectory() as spill_dir:
+        store = SessionStore(max_sessions=2, spill_dir=spill_dir)
+        done = threading.Event()
+
+        def fill():
+            with mock.patch('session_store.json.dump', side_effect=OSError("No space left on device")):
+                for session_id in ('a', 'b', 'c', 'd'):
+                    store.append(session_id, [{'role': 'user', 'content': session_id}])
+            done.set()
+
+        threading.Thread(target=fill, daemon=True).start()
+        assert done.wait(timeout=5), "eviction loop hung on spill failure"
+
+        # Nothing was lost and LRU order is unchanged
+        assert store.stats()['in_memory'] == 4
+        assert [store.get(session_id)[0]['content'] for session_id in ('a', 'b', 'c', 'd')] == ['a', 'b', 'c', 'd']
+
+        # Once the disk accepts writes again the next eviction catches up
+        store.append('e', [{'role': 'user', 'content': 'e'}])
+        assert store.stats()['in_memory'] == 2
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in [(name, obj) for name, obj in globals().items() if name.startswith('test_')]:
+        try:
+            test()
+            print(f"  ✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  ❌ {name}: {e}")
+    sys.exit(1 if failed else 0)
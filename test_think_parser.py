@@ -0,0 +1,79 @@
+# test_think_parser.py - Test ThinkStreamParser on tags split across chunks
+"""
+Test script for the streamed <think> block parser.
+Run directly (python test_think_parser.py) or with pytest.
+"""
+
+import sys
+
+from think_parser import ThinkStreamParser, REASONING, ANSWER
+
+
+def _parse(chunks, starts_in_reasoning=False):
+    """Feed every chunk, then close; returns the parser and all segments"""
+    parser = ThinkStreamParser(starts_in_reasoning=starts_in_reasoning)
+    segments = []
+    for chunk in chunks:
+        segments.extend(parser.feed(chunk))
+    segments.extend(parser.close())
+    return parser, segments
+
+
+def _split_everywhere(text):
+    """Every way of cutting text into two chunks"""
+    return [[text[:i], text[i:]] for i in range(len(text) + 1)]
+
+
+def test_tags_split_at_every_position():
+    """Reasoning and answer come out the same wherever the chunk boundary falls"""
+    text = "<think>plan the reply</think>\n\nHalo kamu!"
+    for chunks in _split_everywhere(text):
+        parser, _ = _parse(chunks)
+        assert parser.reasoning == "plan the reply", chunks
+        assert parser.answer == "Halo kamu!", chunks
+        assert parser.saw_answer
+
+
+def test_one_character_chunks():
+    """Tags arriving one character at a time are still recognised"""
+    text = "<think>a</think>b <THINK>c</Think>d"
+    parser, _ = _parse(list(text))
+    assert parser.reasoning == "ac"
+    assert parser.answer == "b d"
+
+
+def test_missing_open_tag_for_deepseek():
+    """With starts_in_reasoning everything before </think> is reasoning"""
+    for chunks in _split_everywhere("thinking...</think>Jawaban"):
+        parser, segments = _parse(chunks, starts_in_reasoning=True)
+        assert parser.reasoning == "thinking...", chunks
+        assert parser.answer == "Jawaban", chunks
+        assert not any('think>' in text for _, text in segments), "tag leaked into a segment"
+
+
+def test_stream_ends_inside_reasoning():
+    """No </think>: nothing is answer and saw_answer stays False"""
+    parser, segments = _parse(["still ", "thinking <"], starts_in_reasoning=True)
+    assert not parser.saw_answer
+    assert parser.answer == ""
+    assert parser.reasoning == "still thinking <"
+    assert all(kind == REASONING for kind, _ in segments)
+
+
+def test_partial_tag_that_is_not_a_tag():
+    """A held-back '<' that turns out to be text is emitted, not lost"""
+    parser, segments = _parse(["a <", "b> c <th", "ing"])
+    assert parser.answer == "a <b> c <thing"
+    assert all(kind == ANSWER for kind, _ in segments)
+
+
+if __name__ == "__main__":
+    failed = 0
+    for name, test in [(name, obj) for name, obj in globals().items() if name.startswith('test_')]:
+        try:
+            test()
+            print(f"  ✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  ❌ {name}: {e}")
+    sys.exit(1 if failed else 0)
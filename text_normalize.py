@@ -0,0 +1,211 @@
+"""
+Shared text normalization for CutieChatter
+Semua pattern di-compile sekali dan digabung: satu pass untuk semua tag
+think / end marker, dengan varian display, storage, TTS dan classifier
+"""
+
+import re
+
+THINK_CLOSE = '</think>'
+THINK_SPAN_OPEN = '<span style="font-style: italic; font-weight: 200;">'
+THINK_SPAN_CLOSE = '</span><br><br>'
+
+# One scan finds every tag-like token; the rare matches are classified below.
+# The literal '<' in front lets the regex engine skip plain text quickly.
+_TAG_CANDIDATE = re.compile(r'<\s*/?\s*[a-z]*\s*/?>', re.IGNORECASE)
+_RULE = '---'
+
+_OPEN = 'open'
+_CLOSE = 'close'
+_LINE_BREAK = 'line_break'
+_END = 'end'
+_BROKEN = 'broken'
+
+_TAG_KINDS = (
+    (_OPEN, re.compile(r'<\s*think\s*>', re.IGNORECASE)),
+    (_CLOSE, re.compile(r'<\s*/\s*think\s*>', re.IGNORECASE)),
+    (_LINE_BREAK, re.compile(r'<\s*/\s*br\s*>', re.IGNORECASE)),
+    (_END, re.compile(r'<\s*/\s*(?:div|response|button|compose)\s*>', re.IGNORECASE)),
+    (_BROKEN, re.compile(r'<\s*/?\s*th?i?n?k?\s*/?>', re.IGNORECASE)),
+)
+
+_ITALIC = re.compile(r'\*(.*?)\*', re.DOTALL)
+_SPECIAL_TOKEN = re.compile(r'<\|[^|]+\|>')
+_MARKUP = re.compile(r'<\|[^|]+\|>|<[^>]+>|---')
+_HTML_TAG = re.compile(r'<[^>]+>')
+_EMOJI = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # Emoticons
+    "\U0001F300-\U0001F5FF"  # Symbols & Pictographs
+    "\U0001F680-\U0001F6FF"  # Transport & Map Symbols
+    "\U0001F700-\U0001F77F"  # Alchemical Symbols
+    "\U0001F780-\U0001F7FF"  # Geometric Shapes Extended
+    "\U0001F800-\U0001F8FF"  # Supplemental Arrows-C
+    "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs
+    "\U0001FA00-\U0001FA6F"  # Chess Symbols
+    "\U0001FA70-\U0001FAFF"  # Symbols and Pictographs Extended-A
+    "\U00002702-\U000027B0"  # Dingbats
+    "\U0001F100-\U0001F251"  # Enclosed Alphanumerics / Ideographic Supplement
+    "\u24C2\u2600-\u26FF"       # Circled M, Misc Symbols
+    "\uFE0F\u200D"               # Variation selector, zero width joiner
+    "]+"
+)
+# QwenWorker._clean_response's class, range for range: its U+24C2..U+1F251 span also
+# removes CJK and Hangul (stray Chinese in Qwen output); to_tts keeps those via _EMOJI
+_QWEN_EMOJI = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"
+    "\U0001F300-\U0001F5FF"
+    "\U0001F680-\U0001F6FF"
+    "\U0001F700-\U0001F77F"
+    "\U0001F780-\U0001F7FF"
+    "\U0001F800-\U0001F8FF"
+    "\U0001F900-\U0001F9FF"
+    "\U0001FA00-\U0001FA6F"
+    "\U0001FA70-\U0001FAFF"
+    "\U00002702-\U000027B0"
+    "\U000024C2-\U0001F251"
+    "]+"
+)
+
+
+def _tag_kind(tag):
+    for kind, pattern in _TAG_KINDS:
+        if pattern.fullmatch(tag):
+            return kind
+    return None
+
+
+class _TagRewriter:
+    """Replaces think tags and end markers in one pass (kind -> replacement)"""
+
+    def __init__(self, replacements):
+        self.replacements = replacements
+
+    def _replace(self, match):
+        tag = match.group()
+        return self.replacements.get(_tag_kind(tag), tag)
+
+    def __call__(self, text):
+        if '<' in text:
+            text = _TAG_CANDIDATE.sub(self._replace, text)
+        # '---' behaves like an end marker; plain str.replace is cheaper than a regex hit
+        return text.replace(_RULE, self.replacements[_END])
+
+
+# '---' and stray closing tags end a think block, same as </think>
+_display_tags = _TagRewriter({
+    _OPEN: THINK_SPAN_OPEN,
+    _CLOSE: THINK_SPAN_CLOSE,
+    _LINE_BREAK: THINK_SPAN_CLOSE,
+    _END: THINK_SPAN_CLOSE,
+    _BROKEN: '',
+})
+
+_strip_tags = _TagRewriter({
+    _OPEN: '',
+    _CLOSE: '',
+    _LINE_BREAK: '\n',
+    _END: '',
+    _BROKEN: '',
+})
+
+
+def _strip_emoji(text):
+    # Emoji are never ASCII; skip the charset scan for plain text
+    return text if text.isascii() else _EMOJI.sub('', text)
+
+
+def drop_reasoning(text):
+    """Everything after the last </think> (unchanged if there is none)"""
+    index = text.lower().rfind(THINK_CLOSE)
+    return text[index + len(THINK_CLOSE):] if index != -1 else text
+
+
+def replace_italic(text):
+    """*text* -> <em>text</em>"""
+    return _ITALIC.sub(r'<em>\1</em>', text) if text else text
+
+
+def replace_think_tags(text):
+    """Think tags and end markers as styled spans"""
+    return _display_tags(text) if text else text
+
+
+def to_display(text):
+    """HTML for the chat bubble: styled think blocks, *italic*, line breaks"""
+    if not text:
+        return text
+    return replace_italic(_display_tags(text)).replace('\n', '<br>')
+
+
+def strip_markers(text):
+    """Remove think tags and end markers, keep everything else"""
+    return _strip_tags(text) if text else text
+
+
+def to_storage(text):
+    """Answer only, as stored in the conversation history"""
+    if not text:
+        return text
+    return _strip_tags(drop_reasoning(text)).strip()
+
+
+def to_classifier(text):
+    """Plain text for the sentiment / similarity models (emoji kept, they carry sentiment)"""
+    if not text:
+        return text
+    return ' '.join(_MARKUP.sub(' ', drop_reasoning(text)).split())
+
+
+def to_tts(text):
+    """Plain speakable text: no reasoning, tags, special tokens or emoji"""
+    if not text:
+        return text
+    return ' '.join(_strip_emoji(_MARKUP.sub(' ', drop_reasoning(text))).split())
+
+
+def strip_tokens_and_emoji(text):
+    """Remove <|special|> tokens and emoji (local Qwen output)"""
+    if not text:
+        return text
+    text = _SPECIAL_TOKEN.sub('', text)
+    return text if text.isascii() else _QWEN_EMOJI.sub('', text)
+
+
+# Heuristic answer extraction for DeepSeek output that never closed its think block
+_THINKING_OPENERS = re.compile(
+    r'</think>\s*|<think>.*?</think>'
+    r'|Alright,.*?\n\n|I should.*?\n\n|Let me.*?\n\n|Hmm.*?\n\n|Okay.*?\n\n'
+    r'|I want to.*?\n\n|I need to.*?\n\n|Actually.*?\n\n',
+    re.IGNORECASE | re.DOTALL
+)
+_THINKING_KEYWORDS = ('let me', 'i should', 'hmm', 'alright', 'actually')
+_FALLBACK_ANSWER = "Halo! Ada yang bisa saya bantu?"
+
+
+def extract_answer(text):
+    """Answer part of a DeepSeek response, with heuristics when </think> is missing"""
+    if not text:
+        return text
+
+    index = text.find(THINK_CLOSE)
+    if index != -1:
+        return text[index + len(THINK_CLOSE):].strip()
+
+    cleaned = _THINKING_OPENERS.sub('', text)
+
+    # Still looks like thinking: keep the last sentence that doesn't
+    if any(keyword in cleaned.lower()[:50] for keyword in _THINKING_KEYWORDS):
+        for sentence in reversed(cleaned.split('. ')):
+            sentence = sentence.strip()
+            if sentence and not any(keyword in sentence.lower() for keyword in _THINKING_KEYWORDS[:3]):
+                cleaned = sentence if sentence.endswith('.') else sentence + '.'
+                break
+
+    cleaned = ' '.join(_HTML_TAG.sub('', cleaned).split())
+
+    # Very short leftovers of a long response are most likely an error
+    if len(cleaned) < 10 and len(text) > 100:
+        return _FALLBACK_ANSWER
+    return cleaned
@@ -0,0 +1,107 @@
+"""
+Incremental parser for DeepSeek-R1 <think> blocks in streamed output
+State machine satu pass: setiap chunk dipisah menjadi teks reasoning atau
+answer, aman walaupun tag terpotong di batas chunk
+"""
+
+REASONING = 'reasoning'
+ANSWER = 'answer'
+
+OPEN_TAG = '<think>'
+CLOSE_TAG = '</think>'
+_LONGEST_TAG = max(len(OPEN_TAG), len(CLOSE_TAG))
+
+
+class ThinkStreamParser:
+    """Splits streamed text into (kind, text) segments, kind being REASONING or ANSWER.
+
+    DeepSeek-R1 behind Ollama often omits the opening <think>, so for those
+    models start with starts_in_reasoning=True: everything up to </think> is
+    reasoning. Only the unscanned chunk plus at most one partial tag is looked
+    at per feed(), so the cost per token does not grow with the reasoning length.
+    """
+
+    def __init__(self, starts_in_reasoning=False):
+        self.in_reasoning = starts_in_reasoning
+        self.saw_answer = False   # a </think> was seen, or the stream started as answer
+        self._pending = ''         # possible partial tag held back from the last chunk
+        self._at_answer_start = True
+        self._reasoning = []
+        self._answer = []
+        if not starts_in_reasoning:
+            self.saw_answer = True
+
+    @property
+    def reasoning(self):
+        return ''.join(self._reasoning)
+
+    @property
+    def answer(self):
+        return ''.join(self._answer)
+
+    def _emit(self, segments, text):
+        if not text:
+            return
+        if self.in_reasoning:
+            self._reasoning.append(text)
+            segments.append((REASONING, text))
+            return
+        if self._at_answer_start:
+            # Drop the blank lines DeepSeek puts right after </think>
+            text = text.lstrip()
+            if not text:
+                return
+            self._at_answer_start = False
+        self._answer.append(text)
+        segments.append((ANSWER, text))
+
+    @staticmethod
+    def _partial_tag_length(lower):
+        """Length of a trailing prefix of either tag that the next chunk may complete"""
+        start = lower.rfind('<', max(0, len(lower) - _LONGEST_TAG + 1))
+        if start == -1:
+            return 0
+        tail = lower[start:]
+        if OPEN_TAG.startswith(tail) or CLOSE_TAG.startswith(tail):
+            return len(tail)
+        return 0
+
+    def feed(self, chunk):
+        """Classify one streamed chunk; returns a list of (kind, text) segments"""
+        text = self._pending + (chunk or '')
+        self._pending = ''
+        segments = []
+
+        while text:
+            lower = text.lower()
+            wanted, stray = (CLOSE_TAG, OPEN_TAG) if self.in_reasoning else (OPEN_TAG, CLOSE_TAG)
+            index = lower.find(wanted)
+            stray_index = lower.find(stray)
+
+            if stray_index != -1 and (index == -1 or stray_index < index):
+                # Tag that does not change state (repeated <think>, </think> outside a block)
+                self._emit(segments, text[:stray_index])
+                text = text[stray_index + len(stray):]
+                continue
+
+            if index == -1:
+                keep = self._partial_tag_length(lower)
+                self._emit(segments, text[:len(text) - keep])
+                self._pending = text[len(text) - keep:]
+                break
+
+            self._emit(segments, text[:index])
+            text = text[index + len(wanted):]
+            self.in_reasoning = not self.in_reasoning
+            if not self.in_reasoning:
+                self.saw_answer = True
+                self._at_answer_start = True
+
+        return segments
+
+    def close(self):
+        """Flush a held-back partial tag at the end of the stream"""
+        segments = []
+        pending, self._pending = self._pending, ''
+        self._emit(segments, pending)
+        return segments
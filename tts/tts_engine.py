@@ -13,6 +13,7 @@ from typing import Dict, Optional, Callable
 from PyQt6.QtCore import QObject, pyqtSignal, QThread
 import tempfile
 import os
+from text_normalize import to_tts
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -452,13 +453,8 @@ class TTSEngine:
     
     def _preprocess_text(self, text: str) -> str:
         """Preprocess text for better TTS output"""
-        import re
-        
-        # Remove HTML tags
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # Remove excessive whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
+        # Drop reasoning, tags, special tokens and emoji; collapse whitespace
+        text = to_tts(text)
         
         # Limit text length
         words = text.split()